@@ -1,131 +1,56 @@
 import numpy as np
 import pandas as pd
-import os
-import pickle
 
 from torch.utils.data import Dataset
 
+from dataloaders.loader_utils import factorize, build_seqs, match_seq_len, cache_preprocess
+
 DATASET_DIR = "../datasets/EdNet/pre_train.csv"
-PICKLE_DIR = "../datasets/EdNet/"
 
 class EDNET(Dataset):
-    def __init__(self, max_seq_len, dataset_dir=DATASET_DIR, pickle_dir=PICKLE_DIR) -> None:
+    def __init__(self, max_seq_len, dataset_dir=DATASET_DIR, stride=None) -> None:
         super().__init__()
 
         self.dataset_dir = dataset_dir
-        self.pickle_dir = pickle_dir
         
-        if os.path.exists(os.path.join(self.pickle_dir, "q_seqs.pkl")):
-            with open(os.path.join(self.pickle_dir, "q_seqs.pkl"), "rb") as f:
-                self.q_seqs = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "r_seqs.pkl"), "rb") as f:
-                self.r_seqs = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "q_list.pkl"), "rb") as f:
-                self.q_list = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "u_list.pkl"), "rb") as f:
-                self.u_list = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "r_list.pkl"), "rb") as f:
-                self.r_list = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "q2idx.pkl"), "rb") as f:
-                self.q2idx = pickle.load(f)
-            with open(os.path.join(self.pickle_dir, "u2idx.pkl"), "rb") as f:
-                self.u2idx = pickle.load(f)
-        else:
-            self.q_seqs, self.r_seqs, self.q_list, self.u_list, self.r_list, self.q2idx, \
-                self.u2idx = self.preprocess() #가장 아래에서 각각의 요소를 가져옴
+        self.q_seqs, self.r_seqs, self.q_list, self.u_list, self.r_list, self.q2idx, \
+            self.u2idx = self.preprocess() #가장 아래에서 각각의 요소를 가져옴
 
         self.num_u = self.u_list.shape[0]
         self.num_q = self.q_list.shape[0]
         self.num_r = self.r_list.shape[0]
 
-        # match_seq_len은 경우에 따라 설정하기 -> 사용하려면 parameter에 seq_len을 추가해야 함
-        # match_seq_len을 거치면, 모든 데이터는 101개로 통일되고, 빈칸인 부분은 -1로 전처리되어있음
+        # match_seq_len을 거치면, 모든 데이터는 max_seq_len 길이의 window로 나뉘고, 빈칸인 부분은 -1로 채워짐
+        # stride가 max_seq_len보다 작으면 window끼리 겹침 (None이면 겹치지 않음)
         self.q_seqs, self.r_seqs = \
-            self.match_seq_len(self.q_seqs, self.r_seqs, max_seq_len) #아래 method를 한번 거치도록 처리
+            match_seq_len([self.q_seqs, self.r_seqs], max_seq_len, stride)
 
         self.len = len(self.q_seqs)
 
     def __getitem__(self, index):
-        #출력되는 벡터는 모두 101개로 전처리되어있고, 만약 빈칸이 있는 데이터의 경우에는 -1로 채워져있음
+        #출력되는 벡터는 모두 max_seq_len개로 전처리되어있고, 만약 빈칸이 있는 데이터의 경우에는 -1로 채워져있음
         return self.q_seqs[index], self.r_seqs[index]
 
     def __len__(self):
         return self.len
 
+    @cache_preprocess
     def preprocess(self):
         df = pd.read_csv(self.dataset_dir)
         df = df[(df["answered_correctly"] == 0) | (df["answered_correctly"] == 1)]
 
-        u_list = np.unique(df["user_id"].values) #중복되지 않은 user의 목록
-        q_list = np.unique(df["content_id"].values) #중복되지 않은 question의 목록
+        q_list, q_idx = factorize(df["content_id"].values) #중복되지 않은 question의 목록
         r_list = np.unique(df["answered_correctly"].values)
 
-        u2idx = {u: idx for idx, u in enumerate(u_list)} #중복되지 않은 user에게 idx를 붙여준 딕셔너리
         q2idx = {q: idx for idx, q in enumerate(q_list)} #중복되지 않은 question에 idx를 붙여준 딕셔너리
 
-        q_seqs = [] #로그 기준으로 각 user별 질문 목록을 담은 리스트
-        r_seqs = [] #로그 기준으로 각 user별 정답 목록을 담은 리스트
-
-        for u in u_list:
-            df_u = df[df["user_id"] == u].sort_values("timestamp")
-
-            q_seq = np.array([q2idx[q] for q in df_u["content_id"].values]) # 판다스로 짜는게 좋음
-            r_seq = df_u["answered_correctly"].values
-
-            q_seqs.append(q_seq)
-            r_seqs.append(r_seq)
-
-        #pickle로 만들기
-        with open(os.path.join(self.pickle_dir, "q_seqs.pkl"), "wb") as f:
-            pickle.dump(q_seqs, f)
-        with open(os.path.join(self.pickle_dir, "r_seqs.pkl"), "wb") as f:
-            pickle.dump(r_seqs, f)
-        with open(os.path.join(self.pickle_dir, "q_list.pkl"), "wb") as f:
-            pickle.dump(q_list, f)
-        with open(os.path.join(self.pickle_dir, "u_list.pkl"), "wb") as f:
-            pickle.dump(u_list, f)
-        with open(os.path.join(self.pickle_dir, "r_list.pkl"), "wb") as f:
-            pickle.dump(r_list, f)
-        with open(os.path.join(self.pickle_dir, "q2idx.pkl"), "wb") as f:
-            pickle.dump(q2idx, f)
-        with open(os.path.join(self.pickle_dir, "u2idx.pkl"), "wb") as f:
-            pickle.dump(u2idx, f)
+        # 로그 기준으로 각 user별 질문, 정답 목록을 담은 리스트
+        u_list, (q_seqs, r_seqs) = build_seqs(
+            df["user_id"].values,
+            [q_idx, df["answered_correctly"].values],
+            df["timestamp"].values,
+        )
 
-        return q_seqs, r_seqs, q_list, u_list, r_list, q2idx, u2idx
+        u2idx = {u: idx for idx, u in enumerate(u_list)} #중복되지 않은 user에게 idx를 붙여준 딕셔너리
 
-    #수정할 것
-    def match_seq_len(self, q_seqs, r_seqs, max_seq_len, pad_val=-1):
-
-        proc_q_seqs = []
-        proc_r_seqs = []
-
-        for q_seq, r_seq in zip(q_seqs, r_seqs):
-
-            #max_seq_len(100)보다 작거나 같은 데이터는 넘기고, 100보다 큰 데이터는 while문을 통과하게 됨
-            #while을 통과할 경우, 100개씩 데이터를 떼서 proc에 넣음
-            i = 0 #i는 while을 통과할 경우 추가되고, 아니면 추가되지 않음
-            while i + max_seq_len < len(q_seq): # 첫반복: 100보다 큰 경우, 두번째 반복: 200보다 큰 경우
-                proc_q_seqs.append(q_seq[i:i + max_seq_len - 1])
-                proc_r_seqs.append(r_seq[i:i + max_seq_len - 1])
-
-                i += max_seq_len
-
-            #while을 거치지 않은 경우는 바로, while을 거친 경우 남은 데이터에 대해서만 처리하게 됨
-            proc_q_seqs.append(
-                np.concatenate(
-                    [
-                        q_seq[i:], #while을 거치지 않았다면, 처음부터 끝까지, while을 거쳤다면 남은부분만
-                        np.array([pad_val] * (i + max_seq_len - len(q_seq))) #총 100개로 만들기, 대신 남은 부분은 -1로 채움
-                    ]
-                )
-            )
-            proc_r_seqs.append(
-                np.concatenate(
-                    [
-                        r_seq[i:],
-                        np.array([pad_val] * (i + max_seq_len - len(q_seq)))
-                    ]
-                )
-            )
-
-        return proc_q_seqs, proc_r_seqs
\ No newline at end of file
+        return q_seqs, r_seqs, q_list, u_list, r_list, q2idx, u2idx
@@ -0,0 +1,400 @@
+import os
+import json
+import bisect
+import shutil
+import tempfile
+import hashlib
+import functools
+
+import numpy as np
+import pandas as pd
+
+def factorize(values):
+    """
+    Map raw ids to contiguous indices in one hashed pass.
+
+        :param values: (np.ndarray) raw ids, e.g. df["skill_id"].values
+
+        :output uniques: (np.ndarray) sorted unique ids, same as np.unique(values)
+        :output codes: (np.ndarray) index of each value in uniques
+    """
+    codes, uniques = pd.factorize(values, sort=True)
+
+    return np.asarray(uniques), codes
+
+class RaggedArray:
+    """
+    Variable-length sequences stored as one flat value array.
+
+    Row i is values[starts[i]:stops[i]], so indexing returns a view and never copies.
+    values can be a np.memmap, which lets DataLoader workers share it through the page cache.
+
+        :param values: (np.ndarray) flat values of all rows
+        :param starts: (np.ndarray) start of every row in values
+        :param stops: (np.ndarray) end of every row in values, if None, starts are offsets with len(rows) + 1 entries
+    """
+    def __init__(self, values, starts, stops=None):
+        if stops is None:
+            starts, stops = starts[:-1], starts[1:]
+
+        self.values = values
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+
+    @classmethod
+    def from_seqs(cls, seqs, dtype=None):
+        lens = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lens)])
+        values = np.concatenate(seqs) if len(seqs) > 0 else np.array([], dtype=np.int64)
+
+        return cls(values.astype(dtype or values.dtype, copy=False), offsets)
+
+    @property
+    def lengths(self):
+        return self.stops - self.starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return self.values[self.starts[index]:self.stops[index]]
+
+    def __iter__(self):
+        for start, stop in zip(self.starts, self.stops):
+            yield self.values[start:stop]
+
+def build_seqs(u_values, seq_values, order_values=None):
+    """
+    Split the columns of an interaction log into per-user sequences.
+
+    Users are factorized once and the rows are sorted once by user with a stable sort,
+    so each user keeps the row order of the log (or the order of order_values).
+    The columns are then cut on the user boundaries,
+    which is linear in the number of rows instead of one full scan per user.
+
+        :param u_values: (np.ndarray) user id of every row
+        :param seq_values: (list of np.ndarray) columns to split, already mapped to indices
+        :param order_values: (np.ndarray) if given, rows of each user are sorted by this column, e.g. timestamp
+
+        :output u_list: (np.ndarray) sorted unique users, same as np.unique(u_values)
+        :output seqs: (list of RaggedArray) seqs[k][u] is the k-th column of the u-th user in u_list
+    """
+    u_list, u_idx = factorize(u_values)
+
+    if order_values is None:
+        order = np.argsort(u_idx, kind="stable")
+    else:
+        # lexsort is stable, the last key is the primary one
+        order = np.lexsort((order_values, u_idx))
+
+    # first row of every user, plus the end of the log
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(u_idx, minlength=len(u_list)))])
+
+    seqs = [RaggedArray(np.asarray(values)[order], offsets) for values in seq_values]
+
+    return u_list, seqs
+
+def get_window_starts(lens, max_seq_len, stride=None):
+    """
+    Compute the start offset of every window of every user at once.
+
+    A user of length L gets windows starting at 0, stride, 2 * stride, ... until one reaches the end,
+    i.e. 1 + ceil(max(L - max_seq_len, 0) / stride) windows, so no interaction is dropped.
+    stride == max_seq_len gives non-overlapping windows, a smaller stride gives sliding windows.
+
+        :param lens: (np.ndarray) length of every user sequence
+        :param max_seq_len: (int) length of a window
+        :param stride: (int) distance between the starts of two windows of the same user, 1 <= stride <= max_seq_len, max_seq_len if None
+
+        :output user_idx: (np.ndarray) user of every window
+        :output w_offsets: (np.ndarray) start of every window inside its user sequence
+    """
+    stride = stride or max_seq_len
+    # a stride longer than the windows would skip the interactions between them
+    if not 1 <= stride <= max_seq_len:
+        raise ValueError("stride must be in [1, max_seq_len=%d], got %d" % (max_seq_len, stride))
+
+    lens = np.asarray(lens, dtype=np.int64)
+    n_windows = 1 + (np.maximum(lens - max_seq_len, 0) + stride - 1) // stride
+
+    user_idx = np.repeat(np.arange(len(lens)), n_windows)
+    # position of every window inside its user
+    window_idx = np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+
+    return user_idx, window_idx * stride
+
+class RaggedWindows:
+    """
+    Windows of max_seq_len interactions of a RaggedArray, cut when they are indexed.
+
+    Only the start and the true length of every window are kept, so the values are never copied as a whole
+    and a memory-mapped RaggedArray stays on disk until a batch reads its windows.
+    Indexing gives the windows padded with pad_val, like a (num_windows, max_seq_len) array would.
+
+        :param seq: (RaggedArray) per-user sequences of one field
+        :param w_starts: (np.ndarray) start of every window in seq.values
+        :param w_lens: (np.ndarray) true length of every window
+        :param max_seq_len: (int) length of a window
+        :param pad_val: (int) value of the padded positions
+    """
+    def __init__(self, seq, w_starts, w_lens, max_seq_len, pad_val=-1):
+        self.values = seq.values
+        self.w_starts = w_starts
+        self.w_lens = w_lens
+        self.max_seq_len = max_seq_len
+        self.pad_val = pad_val
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def shape(self):
+        return (len(self.w_starts), self.max_seq_len)
+
+    def __len__(self):
+        return len(self.w_starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            start, w_len = self.w_starts[index], self.w_lens[index]
+            window = np.full(self.max_seq_len, self.pad_val, dtype=self.dtype)
+            window[:w_len] = self.values[start:start + w_len]
+            return window
+            # |window| = (max_seq_len,)
+
+        w_starts, w_lens = self.w_starts[index], self.w_lens[index]
+
+        # |gather_idx| = |valid| = (num_windows, max_seq_len)
+        gather_idx = w_starts[:, None] + np.arange(self.max_seq_len)[None, :]
+        valid = np.arange(self.max_seq_len)[None, :] < w_lens[:, None]
+
+        windows = np.full((len(w_starts), self.max_seq_len), self.pad_val, dtype=self.dtype)
+        windows[valid] = self.values[gather_idx[valid]]
+
+        return windows
+        # |windows| = (num_windows, max_seq_len)
+
+    def __array__(self, dtype=None, copy=None):
+        windows = self[slice(None)]
+        return windows if dtype is None else windows.astype(dtype, copy=False)
+
+def match_seq_len(seqs, max_seq_len, stride=None, pad_val=-1):
+    """
+    Cut the per-user sequences into windows of max_seq_len interactions.
+
+    All window offsets are computed at once, the windows themselves are only gathered when they are indexed,
+    see RaggedWindows, and the tail of short windows is filled with pad_val.
+
+        :param seqs: (list of RaggedArray) per-user sequences of every field, e.g. [q_seqs, r_seqs, pid_seqs]
+        :param max_seq_len: (int) length of a window
+        :param stride: (int) distance between two windows of the same user, max_seq_len (no overlap) if None
+        :param pad_val: (int) value of the padded positions
+
+        :output windows: (list of RaggedWindows) |window| = (num_windows, max_seq_len), in the same order as seqs
+    """
+    starts, lens = seqs[0].starts, seqs[0].lengths
+    user_idx, w_offsets = get_window_starts(lens, max_seq_len, stride)
+
+    w_starts = starts[user_idx] + w_offsets
+    w_lens = np.minimum(lens[user_idx] - w_offsets, max_seq_len)
+
+    return [RaggedWindows(seq, w_starts, w_lens, max_seq_len, pad_val) for seq in seqs]
+
+def get_pack_offsets(lens, max_seq_len):
+    """
+    Pack windows shorter than max_seq_len into shared windows, best fit decreasing.
+
+    The windows are placed from the longest to the shortest, each one into the shared window
+    with the smallest free space it still fits in, so a full window always gets a shared window of its own.
+
+        :param lens: (np.ndarray) true length of every window
+        :param max_seq_len: (int) length of a shared window
+
+        :output pack_idx: (np.ndarray) shared window of every window
+        :output pack_offsets: (np.ndarray) start of every window inside its shared window
+        :output num_packs: (int) number of shared windows
+    """
+    lens = np.asarray(lens, dtype=np.int64)
+    pack_idx = np.empty(len(lens), dtype=np.int64)
+    pack_offsets = np.empty(len(lens), dtype=np.int64)
+
+    # free space of the open shared windows, sorted, and the shared window of each
+    frees, free_packs = [], []
+    num_packs = 0
+
+    for w in np.argsort(-lens, kind="stable"):
+        w_len = int(lens[w])
+        i = bisect.bisect_left(frees, w_len)
+        if i < len(frees):
+            free, pack = frees.pop(i), free_packs.pop(i)
+        else:
+            free, pack = max_seq_len, num_packs
+            num_packs += 1
+
+        pack_idx[w] = pack
+        pack_offsets[w] = max_seq_len - free
+
+        free -= w_len
+        if free > 0:
+            i = bisect.bisect_left(frees, free)
+            frees.insert(i, free)
+            free_packs.insert(i, pack)
+
+    return pack_idx, pack_offsets, num_packs
+
+# bump this when the layout of the cache file or the preprocess outputs change
+CACHE_VERSION = 3
+
+def get_cache_key(dataset_name, dataset_dir, params=None):
+    """
+    Hash the source csv, the dataset name and the preprocessing parameters.
+
+    The csv is identified by its absolute path, size and modification time,
+    so editing or regenerating it invalidates the cache without re-reading it.
+    """
+    stat = os.stat(dataset_dir)
+    key_src = json.dumps(
+        {
+            "version": CACHE_VERSION,
+            "dataset_name": dataset_name,
+            "dataset_dir": os.path.abspath(dataset_dir),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "params": params or {},
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+    return hashlib.sha1(key_src.encode("utf-8")).hexdigest()
+
+def get_compact_int_dtype(min_value, max_value):
+    """
+    Smallest signed integer dtype (int8, int16 or int32) that holds [min_value, max_value] and the -1 padding.
+    Returns None if the range does not fit in int32.
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if min(min_value, -1) >= info.min and max_value <= info.max:
+            return dtype
+
+    return None
+
+def compact_int(values):
+    """
+    Store integer values in the smallest dtype chosen from their range,
+    e.g. responses and difficulties become int8 and most question ids int16.
+    Floats and ints that need more than int32 are kept as they are.
+    """
+    if np.issubdtype(values.dtype, np.integer) or values.dtype == np.bool_:
+        if len(values) == 0:
+            return values.astype(np.int8)
+
+        dtype = get_compact_int_dtype(int(values.min()), int(values.max()))
+        if dtype is not None:
+            return values.astype(dtype, copy=False)
+
+    return values
+
+def save_cache(cache_path, key, outputs):
+    """
+    Write the outputs of preprocess() to the directory cache_path, one .npy file per array.
+
+    Per-user sequences (RaggedArray or list of np.ndarray) are stored as one flat value array
+    in the smallest integer dtype that fits (see compact_int) plus int64 offsets, so they can be memory-mapped on load.
+    Dicts (q2idx, u2idx, ...) are stored as their keys and values.
+    """
+    arrays = {}
+    kinds = []
+
+    for i, output in enumerate(outputs):
+        if isinstance(output, dict):
+            kinds.append("dict")
+            arrays["%d_keys" % i] = np.array(list(output.keys()))
+            arrays["%d_values" % i] = np.array(list(output.values()))
+        elif isinstance(output, (RaggedArray, list)):
+            kinds.append("seqs")
+            if isinstance(output, list):
+                output = RaggedArray.from_seqs(output)
+            arrays["%d_values" % i] = compact_int(
+                np.concatenate(list(output)) if len(output) > 0 else np.asarray(output.values[:0])
+            )
+            arrays["%d_offsets" % i] = np.concatenate([[0], np.cumsum(output.lengths)]).astype(np.int64)
+        else:
+            kinds.append("array")
+            arrays["%d" % i] = np.asarray(output)
+
+    # write into a temporary directory of this process and rename it,
+    # so a killed run never leaves a broken cache and two runs never write into the same directory
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(cache_path), prefix=os.path.basename(cache_path) + ".tmp")
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), array, allow_pickle=array.dtype == object)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"version": CACHE_VERSION, "key": key, "kinds": kinds}, f)
+
+    # a broken entry of a killed run is replaced, a complete one written by another run in the meantime is kept
+    if os.path.exists(cache_path) and load_cache(cache_path, key) is None:
+        shutil.rmtree(cache_path, ignore_errors=True)
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path)
+
+def load_cache(cache_path, key):
+    """
+    Read the outputs of preprocess() back from cache_path.
+    Per-user sequences are returned as RaggedArray over read-only memory-maps.
+    Returns None if there is no cache or it was written for another key or version.
+    """
+    meta_path = os.path.join(cache_path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta["version"] != CACHE_VERSION or meta["key"] != key:
+        return None
+
+    def load(name, mmap_mode=None):
+        return np.load(os.path.join(cache_path, name + ".npy"), mmap_mode=mmap_mode, allow_pickle=True)
+
+    outputs = []
+    for i, kind in enumerate(meta["kinds"]):
+        if kind == "dict":
+            outputs.append(dict(zip(load("%d_keys" % i), load("%d_values" % i))))
+        elif kind == "seqs":
+            outputs.append(RaggedArray(load("%d_values" % i, mmap_mode="r"), load("%d_offsets" % i)))
+        else:
+            outputs.append(load("%d" % i))
+
+    return tuple(outputs)
+
+def cache_preprocess(preprocess):
+    """
+    Decorator for the preprocess() method of the datasets.
+
+    The outputs are cached under <dataset dir>/cache/<class name>_<key>/,
+    where the key hashes the csv and the class name.
+    preprocess() only depends on the csv, the windows are cut from its outputs afterwards.
+    Entries of other keys are never removed, another run may still be using them.
+    The outputs are always read back from the cache, so the sequences are memory-mapped on the first run too.
+    """
+    @functools.wraps(preprocess)
+    def wrapper(self):
+        dataset_name = type(self).__name__
+        key = get_cache_key(dataset_name, self.dataset_dir)
+
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(self.dataset_dir)), "cache")
+        cache_path = os.path.join(cache_dir, "%s_%s" % (dataset_name, key[:16]))
+
+        outputs = load_cache(cache_path, key)
+        if outputs is None:
+            outputs = preprocess(self)
+            save_cache(cache_path, key, outputs)
+            outputs = load_cache(cache_path, key)
+
+        return outputs
+
+    return wrapper
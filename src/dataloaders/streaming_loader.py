@@ -0,0 +1,201 @@
+import os
+import glob
+import json
+
+import numpy as np
+import pandas as pd
+
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataloaders.loader_utils import RaggedArray, match_seq_len
+
+# streaming mode for corpora larger than memory
+# a stream directory holds user-sorted csv shards and a meta.json:
+#   shard_*.csv: the rows of a user are contiguous and in order, and a user is never split over two shards,
+#                the field columns are already mapped to indices (e.g. skill_idx, not skill_id)
+#   meta.json: {"user_col": "user_id", "field_cols": ["q", "r", "pid"], "num_q": ..., "num_r": ..., "num_pid": ...}
+# field_cols must be in the order the collate of the dataset expects, see write_stream_shards
+
+STREAM_META = "meta.json"
+STREAM_SHARD_PATTERN = "shard_*.csv"
+
+def get_stream_meta(stream_dir):
+    with open(os.path.join(stream_dir, STREAM_META)) as f:
+        return json.load(f)
+
+def write_stream_shards(df, stream_dir, user_col, field_cols, num_shards, **meta):
+    """
+    Write a user-sorted interaction log as the shards of a stream directory.
+
+    Users are assigned to the shards in contiguous blocks, so every shard is user-sorted too.
+    For logs that don't fit in memory, write the shards the same way from each chunk of users.
+
+        :param df: (pd.DataFrame) interactions, already sorted by user (and time inside a user)
+        :param stream_dir: (str) directory of the shards
+        :param user_col: (str) user column
+        :param field_cols: (list of str) index columns of a window, e.g. ["q", "r", "pid"]
+        :param num_shards: (int) number of shard files
+        :param meta: counts the models need, e.g. num_q=..., num_r=..., num_pid=...
+    """
+    os.makedirs(stream_dir, exist_ok=True)
+
+    users = df[user_col].values
+    # first row of every user
+    user_starts = np.flatnonzero(np.concatenate([[True], users[1:] != users[:-1]]))
+    # the shards are cut on user boundaries
+    shard_starts = user_starts[np.linspace(0, len(user_starts), num_shards, endpoint=False).astype(np.int64)]
+    shard_bounds = np.concatenate([shard_starts, [len(df)]])
+
+    for i in range(num_shards):
+        df.iloc[shard_bounds[i]:shard_bounds[i + 1]][[user_col] + list(field_cols)].to_csv(
+            os.path.join(stream_dir, "shard_%05d.csv" % i), index=False
+        )
+
+    with open(os.path.join(stream_dir, STREAM_META), "w") as f:
+        json.dump(dict(meta, user_col=user_col, field_cols=list(field_cols)), f)
+
+class StreamingWindows(IterableDataset):
+    """
+    Windows of a stream directory, read shard by shard and windowed on the fly.
+
+    Only chunk_rows rows of a shard and buffer_size windows are in memory at a time,
+    so the peak memory depends on the buffer size, not on the size of the corpus.
+    The windows are cut like match_seq_len and shuffled through a bounded buffer.
+
+    Every DataLoader worker of every DDP rank reads its own part of the stream:
+    whole shards when there are at least as many shards as readers, otherwise every reader
+    reads all shards and keeps every n-th user. The split and the shuffle only depend on seed and epoch,
+    so a run is reproducible for the same number of workers and ranks.
+
+        :param stream_dir: (str) directory with the shards and meta.json
+        :param max_seq_len: (int) length of a window
+        :param stride: (int) distance between two windows of the same user, max_seq_len if None
+        :param shuffle: (bool) shuffle the shards and the windows
+        :param buffer_size: (int) number of windows in the shuffle buffer
+        :param chunk_rows: (int) number of rows read from a shard at a time
+        :param seed: (int) seed of the shuffle
+    """
+    def __init__(self, stream_dir, max_seq_len, stride=None, shuffle=False, buffer_size=10000, chunk_rows=1000000, seed=0):
+        super().__init__()
+
+        self.stream_dir = stream_dir
+        self.max_seq_len = max_seq_len
+        self.stride = stride
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.chunk_rows = chunk_rows
+        self.seed = seed
+        self.epoch = 0
+
+        self.shard_paths = sorted(glob.glob(os.path.join(stream_dir, STREAM_SHARD_PATTERN)))
+        if not self.shard_paths:
+            raise ValueError("no %s in %s" % (STREAM_SHARD_PATTERN, stream_dir))
+
+        meta = get_stream_meta(stream_dir)
+        self.user_col = meta["user_col"]
+        self.field_cols = meta["field_cols"]
+        self.num_q = meta["num_q"]
+        self.num_r = meta["num_r"]
+        # only the pid and diff streams have these
+        self.num_pid = meta.get("num_pid")
+        self.num_diff = meta.get("num_diff")
+
+    def set_epoch(self, epoch):
+        # a new shuffle every epoch, the same in every worker and rank
+        self.epoch = epoch
+
+    def get_reader_info(self):
+        # reader id and number of readers over the DataLoader workers of all DDP ranks
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def read_users(self, shard_path):
+        """
+        Read the complete users of a shard, chunk by chunk.
+        The last user of a chunk can continue in the next chunk, so its rows are carried over.
+
+            :output seqs: (list of RaggedArray) per-user sequences of every field of the users of a chunk
+        """
+        carry = None
+        reader = pd.read_csv(shard_path, usecols=[self.user_col] + self.field_cols, chunksize=self.chunk_rows)
+
+        for chunk in reader:
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+
+            users = chunk[self.user_col].values
+            # rows of the last user are kept until the next chunk
+            last_start = np.flatnonzero(users != users[-1])
+            last_start = last_start[-1] + 1 if len(last_start) > 0 else 0
+            carry = chunk.iloc[last_start:]
+
+            if last_start > 0:
+                yield self.get_user_seqs(chunk.iloc[:last_start])
+
+        if carry is not None and len(carry) > 0:
+            yield self.get_user_seqs(carry)
+
+    def get_user_seqs(self, chunk):
+        users = chunk[self.user_col].values
+        offsets = np.concatenate([np.flatnonzero(np.concatenate([[True], users[1:] != users[:-1]])), [len(users)]])
+
+        return [RaggedArray(chunk[col].values, offsets) for col in self.field_cols]
+
+    def iter_windows(self):
+        reader_id, num_readers = self.get_reader_info()
+
+        shard_paths = list(self.shard_paths)
+        if self.shuffle:
+            # the same order in every reader, so each shard is still read by exactly one of them
+            shard_paths = [shard_paths[i] for i in np.random.default_rng((self.seed, self.epoch)).permutation(len(shard_paths))]
+
+        split_shards = len(shard_paths) >= num_readers
+        if split_shards:
+            shard_paths = shard_paths[reader_id::num_readers]
+
+        user_count = 0
+        for shard_path in shard_paths:
+            for seqs in self.read_users(shard_path):
+                num_users = len(seqs[0])
+                if not split_shards:
+                    # every num_readers-th user of the stream
+                    keep = (user_count + np.arange(num_users)) % num_readers == reader_id
+                    keep_idx = np.flatnonzero(keep)
+                    seqs = [RaggedArray(seq.values, seq.starts[keep_idx], seq.stops[keep_idx]) for seq in seqs]
+                user_count += num_users
+
+                if len(seqs[0]) == 0:
+                    continue
+
+                windows = match_seq_len(seqs, self.max_seq_len, self.stride)
+                for i in range(len(windows[0])):
+                    # a window is gathered into its own array, so a buffered window doesn't keep the whole chunk alive
+                    yield tuple(window[i] for window in windows)
+
+    def __iter__(self):
+        reader_id, _ = self.get_reader_info()
+        rng = np.random.default_rng((self.seed, self.epoch, reader_id))
+
+        if not self.shuffle:
+            yield from self.iter_windows()
+            return
+
+        # bounded shuffle buffer: a random buffered window is given out for every new one
+        buffer = []
+        for window in self.iter_windows():
+            if len(buffer) < self.buffer_size:
+                buffer.append(window)
+                continue
+            j = rng.integers(self.buffer_size)
+            yield buffer[j]
+            buffer[j] = window
+
+        rng.shuffle(buffer)
+        yield from buffer
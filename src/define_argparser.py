@@ -6,6 +6,7 @@ def define_argparser():
 
     # model_file_name
     p.add_argument('--model_fn', required=True)
+    p.add_argument('--checkpoint_path', type=str, default='../checkpoints/checkpoint.pt') # best model of early stopping, every fold worker gets its own
 
     # basic arguments
     p.add_argument('--gpu_id', type=int, default=0 if torch.cuda.is_available() else -1)
@@ -15,6 +16,7 @@ def define_argparser():
     p.add_argument('--n_epochs', type=int, default=20)
     p.add_argument('--verbose', type=int, default=2)
     p.add_argument('--learning_rate', type=int, default = 0.001)
+    p.add_argument('--auc_bins', type=int, default=0) # 0: exact AUC of every epoch, k: streaming AUC from a histogram of k bins (memory doesn't grow with the epoch)
 
     # model, opt, dataset, crit arguments
     p.add_argument('--model_name', type=str, default='bidkt')
@@ -24,24 +26,47 @@ def define_argparser():
 
     # bidkt's arguments
     p.add_argument('--max_seq_len', type=int, default=100)
+    p.add_argument('--window_stride', type=int, default=None) # None: non-overlapping windows (stride = max_seq_len), smaller: sliding windows, never larger than max_seq_len
+    p.add_argument('--collate', type=str, default='window') # window: one gather per batch from the padded windows, sample: per-sample collate_fn
+    p.add_argument('--length_bucket', type=int, default=0) # 0: every batch is padded to max_seq_len, k: batch windows of similar length within pools of k batches (window collate only, models with packing=True in get_models)
+    p.add_argument('--packing', type=bool, default=False) # pack short training windows into shared windows (window collate only, see --model_name with packing=True in get_models)
+    p.add_argument('--stream_dir', type=str, default=None) # read train/valid/test shards from this directory while training, instead of loading the dataset
+    p.add_argument('--stream_buffer', type=int, default=10000) # windows in the shuffle buffer of the streaming mode
+    p.add_argument('--stream_workers', type=int, default=0) # DataLoader workers of the streaming mode, each reads its own part of the shards
     p.add_argument('--num_encoder', type=int, default=12)
     p.add_argument('--hidden_size', type=int, default=512)
     p.add_argument('--num_head', type=int, default=16) # it will be divided 2(default) in attention class, so actual head num is 8(default)
     p.add_argument('--output_size', type=int, default=1) # KT is binary classification
     p.add_argument('--dropout_p', type=int, default=.1)
     p.add_argument('--use_leakyrelu', type=bool, default=True)
+    p.add_argument('--attn_backend', type=str, default='bmm') # bmm or sdpa (F.scaled_dot_product_attention), for bidkt, bert4kt_plus, albert4kt_plus and bert4kt_plus_diff
+    p.add_argument('--attn_block_size', type=int, default=0) # 0: full (n, n) scores, k: blockwise monotonic attention in k x k tiles (mona models), for max_seq_len in the thousands
+    p.add_argument('--mlm_seed', type=int, default=None) # seed of the 15% <MASK> draws of training, None: drawn from the torch seed
+    p.add_argument('--mlm_workers', type=int, default=0) # 0: the trainer draws the training masks, k: k DataLoader workers draw them while the model trains
 
     # bigberd4kt's arguments
     p.add_argument('--num_random_blocks', type=int, default=3) # num_random_blocks = 3 
     p.add_argument('--block_size', type=int, default=5) # block_size = 64
 
+    # all-positions evaluation of the best model on the test set, every interaction is predicted from its past
+    p.add_argument('--eval_all_positions', type=bool, default=False) # score every test interaction every epoch, and once more with the best model to export the predictions
+    p.add_argument('--eval_batch_tokens', type=int, default=0) # positions of a fused batch of prefixes, 0: batch_size * max_seq_len
+    p.add_argument('--eval_export_path', type=str, default=None) # csv of the per-interaction predictions, every fold gets its own (best model only)
+
     # grad_accumulation
     p.add_argument('--grad_acc', type=bool, default=False)
     p.add_argument('--grad_acc_iter', type=int, default=4)
 
     #five_fold cross validation
     p.add_argument('--fivefold', type=bool, default=False)
+    p.add_argument('--fold_workers', type=int, default=1) # number of folds trained at the same time, each in its own process
+    p.add_argument('--threads_per_fold', type=int, default=0) # torch threads of a fold worker, 0: cpu count / fold_workers
+    p.add_argument('--split_seed', type=int, default=42) # seed of the train/valid split of the folds, the splits are saved with the dataset cache
 
     config = p.parse_args()
 
+    # windows further apart than max_seq_len would skip interactions
+    if config.window_stride is not None and not 1 <= config.window_stride <= config.max_seq_len:
+        p.error("--window_stride must be in [1, --max_seq_len], got %d" % config.window_stride)
+
     return config
\ No newline at end of file
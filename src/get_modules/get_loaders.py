@@ -1,299 +1,167 @@
-from torch.utils.data import DataLoader, random_split, Subset, ConcatDataset
+import os
+import tempfile
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, random_split, Subset
+
+from dataloaders.loader_utils import get_cache_key
+from dataloaders.streaming_loader import StreamingWindows
 from utils import collate_fn, pid_collate_fn, pid_time_collate_fn, pid_diff_collate_fn, pid_diff_pt_collate_fn
-from dataloaders.assist2015_loader import ASSIST2015
-from dataloaders.assist2009_loader import ASSIST2009
-from dataloaders.algebra2005_loader import ALGEBRA2005
-from dataloaders.algebra2006_loader import ALGEBRA2006
-from dataloaders.slepemapy_loader import SLEPEMAPY
-from dataloaders.ednet_loader import EDNET
-from dataloaders.ednet_pid_loader import EDNET_PID
-from dataloaders.ednet_pid_diff_loader import EDNET_PID_DIFF
-from dataloaders.assist2017_loader import ASSIST2017
-from dataloaders.statics_loader import STATICS
-from dataloaders.assist2009_pid_loader import ASSIST2009_PID
-from dataloaders.assist2017_pid_loader import ASSIST2017_PID
-from dataloaders.assist2012_loader import ASSIST2012
-from dataloaders.assist2012_pid_loader import ASSIST2012_PID
-from dataloaders.algebra2005_pid_loader import ALGEBRA2005_PID
-from dataloaders.algebra2006_pid_loader import ALGEBRA2006_PID
-from dataloaders.slepemapy_pid_loader import SLEPEMAPY_PID
-from dataloaders.algebra2005_pid_time_loader import ALGEBRA2005_PID_Time
-from dataloaders.algebra2006_pid_time_loader import ALGEBRA2006_PID_Time
-from dataloaders.assist2012_pid_time_loader import ASSIST2012_PID_Time
-from dataloaders.assist2017_pid_time_loader import ASSIST2017_PID_Time
-from dataloaders.assist2009_pid_diff_loader import ASSIST2009_PID_DIFF
-from dataloaders.assist2012_pid_diff_loader import ASSIST2012_PID_DIFF
-from dataloaders.assist2017_pid_diff_loader import ASSIST2017_PID_DIFF
-from dataloaders.algebra2005_pid_diff_loader import ALGEBRA2005_PID_DIFF
-from dataloaders.algebra2006_pid_diff_loader import ALGEBRA2006_PID_DIFF
-from dataloaders.assist2009_pid_diff_pt_loader import ASSIST2009_PID_DIFF_PT
+from utils import PaddedWindows, PackedWindows, WindowBatchSampler, LengthBucketBatchSampler, get_window_indices
+from utils import EpochDataLoader
+from get_modules.get_models import MODELS
+from get_modules.registry import Registry
+from trainers.trainer_utils import MlmCollate
+
+# dataset_name -> dataset class, imported only when it is selected
+# each dataset has its own collate, e.g. pid_collate_fn give you more data
+# float_fields are the fields the collate gives as float, they are needed by the collate fast path (PaddedWindows)
+DATASETS = Registry("dataset_name")
+DATASETS.register("assist2015", "dataloaders.assist2015_loader:ASSIST2015", collate=collate_fn)
+DATASETS.register("assist2009", "dataloaders.assist2009_loader:ASSIST2009", collate=collate_fn)
+DATASETS.register("assist2012", "dataloaders.assist2012_loader:ASSIST2012", collate=collate_fn)
+DATASETS.register("algebra2005", "dataloaders.algebra2005_loader:ALGEBRA2005", collate=collate_fn)
+DATASETS.register("algebra2006", "dataloaders.algebra2006_loader:ALGEBRA2006", collate=collate_fn)
+DATASETS.register("slepemapy", "dataloaders.slepemapy_loader:SLEPEMAPY", collate=collate_fn)
+DATASETS.register("ednet", "dataloaders.ednet_loader:EDNET", collate=collate_fn)
+DATASETS.register("assist2017", "dataloaders.assist2017_loader:ASSIST2017", collate=collate_fn)
+DATASETS.register("statics", "dataloaders.statics_loader:STATICS", collate=collate_fn)
+DATASETS.register("assist2009_pid", "dataloaders.assist2009_pid_loader:ASSIST2009_PID", collate=pid_collate_fn)
+DATASETS.register("assist2017_pid", "dataloaders.assist2017_pid_loader:ASSIST2017_PID", collate=pid_collate_fn)
+DATASETS.register("assist2012_pid", "dataloaders.assist2012_pid_loader:ASSIST2012_PID", collate=pid_collate_fn)
+DATASETS.register("algebra2005_pid", "dataloaders.algebra2005_pid_loader:ALGEBRA2005_PID", collate=pid_collate_fn)
+DATASETS.register("algebra2006_pid", "dataloaders.algebra2006_pid_loader:ALGEBRA2006_PID", collate=pid_collate_fn)
+DATASETS.register("slepemapy_pid", "dataloaders.slepemapy_pid_loader:SLEPEMAPY_PID", collate=pid_collate_fn)
+DATASETS.register("ednet_pid", "dataloaders.ednet_pid_loader:EDNET_PID", collate=pid_collate_fn)
+DATASETS.register("algebra2005_pid_time", "dataloaders.algebra2005_pid_time_loader:ALGEBRA2005_PID_Time", collate=pid_time_collate_fn, float_fields=(3,))
+DATASETS.register("algebra2006_pid_time", "dataloaders.algebra2006_pid_time_loader:ALGEBRA2006_PID_Time", collate=pid_time_collate_fn, float_fields=(3,))
+DATASETS.register("assist2012_pid_time", "dataloaders.assist2012_pid_time_loader:ASSIST2012_PID_Time", collate=pid_time_collate_fn, float_fields=(3,))
+DATASETS.register("assist2017_pid_time", "dataloaders.assist2017_pid_time_loader:ASSIST2017_PID_Time", collate=pid_time_collate_fn, float_fields=(3,))
+DATASETS.register("assist2009_pid_diff", "dataloaders.assist2009_pid_diff_loader:ASSIST2009_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("assist2012_pid_diff", "dataloaders.assist2012_pid_diff_loader:ASSIST2012_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("assist2017_pid_diff", "dataloaders.assist2017_pid_diff_loader:ASSIST2017_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("algebra2005_pid_diff", "dataloaders.algebra2005_pid_diff_loader:ALGEBRA2005_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("algebra2006_pid_diff", "dataloaders.algebra2006_pid_diff_loader:ALGEBRA2006_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("ednet_pid_diff", "dataloaders.ednet_pid_diff_loader:EDNET_PID_DIFF", collate=pid_diff_collate_fn)
+DATASETS.register("assist2009_pid_diff_pt", "dataloaders.assist2009_pid_diff_pt_loader:ASSIST2009_PID_DIFF_PT", collate=pid_diff_pt_collate_fn)
+
+# windows further apart than max_seq_len would skip the interactions between them
+def check_window_stride(config):
+    if config.window_stride is not None and not 1 <= config.window_stride <= config.max_seq_len:
+        raise ValueError(
+            "window_stride must be in [1, max_seq_len=%d], got %d" % (config.max_seq_len, config.window_stride)
+        )
+
+# build the selected dataset, it can be shared by the five folds
+def get_dataset(config):
+    check_window_stride(config)
+    dataset_class, dataset_meta = DATASETS.get(config.dataset_name)
+    dataset = dataset_class(config.max_seq_len, stride=config.window_stride)
+
+    return dataset, dataset_meta
+
+def get_fold_splits(dataset, config):
+    """
+    Train, valid and test window indices of the five folds.
+
+    The windows are cut into five contiguous chunks, fold idx tests on the idx-th chunk
+    and splits the other four at random into train and valid (valid_ratio of them).
+    The splits are computed once for all folds and saved next to the dataset cache,
+    so reruns and fold workers get identical folds without rebuilding them.
+    Every set of parameters has its own file, so runs with other parameters can run at the same time.
+
+        :param dataset: (Dataset) dataset from get_dataset
+        :param config: (argparse.Namespace) uses valid_ratio and split_seed
+
+        :output fold_splits: (list of dict) fold_splits[idx] = {"train": ..., "valid": ..., "test": ...}, np.ndarray of indices
+    """
+    dataset_name = type(dataset).__name__
+    params = {
+        "num_windows": len(dataset),
+        "max_seq_len": config.max_seq_len,
+        "window_stride": config.window_stride,
+        "valid_ratio": config.valid_ratio,
+        "split_seed": config.split_seed,
+    }
+    key = get_cache_key(dataset_name, dataset.dataset_dir, params)
+
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(dataset.dataset_dir)), "cache")
+    split_path = os.path.join(cache_dir, "%s_folds_%s.npz" % (dataset_name, key[:16]))
+
+    if not os.path.exists(split_path):
+        generator = torch.Generator().manual_seed(config.split_seed)
+        bounds = [int(len(dataset) * ratio) for ratio in (0, 0.2, 0.4, 0.6, 0.8)] + [len(dataset)]
+        chunks = [np.arange(bounds[i], bounds[i + 1]) for i in range(5)]
+
+        arrays = {}
+        for idx in range(5):
+            # train_dataset is 0.8 of whole dataset, the valid_ratio of it is valid_dataset
+            train_idxs = np.concatenate([chunk for i, chunk in enumerate(chunks) if i != idx])
+            valid_size = int(len(train_idxs) * config.valid_ratio)
+            train_idxs = train_idxs[torch.randperm(len(train_idxs), generator=generator).numpy()]
+
+            arrays["%d_train" % idx] = train_idxs[:len(train_idxs) - valid_size]
+            arrays["%d_valid" % idx] = train_idxs[len(train_idxs) - valid_size:]
+            # test_dataset is 0.2 of whole dataset
+            arrays["%d_test" % idx] = chunks[idx]
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file of this process and rename it, so a parallel run never reads a half written file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(split_path) + ".", suffix=".tmp.npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, split_path)
+
+    with np.load(split_path) as f:
+        return [{split: f["%d_%s" % (idx, split)] for split in ("train", "valid", "test")} for idx in range(5)]
 
 # choose the loaders
-def get_loaders(config, idx=None):
+# dataset and fold_splits can be given, so the five folds build the dataset only once
+def get_loaders(config, idx=None, dataset=None, fold_splits=None):
+
+    # packing needs the window collate and a model that honors the segment ids in its attention mask
+    if config.packing:
+        if config.collate != "window":
+            raise ValueError("packing is only supported with --collate window")
+        if not MODELS.get_meta(config.model_name).get("packing", False):
+            raise ValueError("%s does not support packing" % config.model_name)
+
+    # length_bucket trims the batches, which changes the outputs of the models that see the padding (see get_models)
+    if config.length_bucket > 0:
+        if config.collate != "window":
+            raise ValueError("length_bucket is only supported with --collate window")
+        if not MODELS.get_meta(config.model_name).get("packing", False):
+            raise ValueError("%s sees the padding, its batches can't be trimmed by length_bucket" % config.model_name)
+
+    # the fold workers are daemonic processes, they can't start DataLoader workers
+    if config.mlm_workers > 0 and config.fivefold and config.fold_workers > 1:
+        raise ValueError("--mlm_workers can't be used with --fold_workers > 1")
+
+    # streaming mode: the data is read from the shards of stream_dir while training
+    if config.stream_dir is not None:
+        return get_streaming_loaders(config)
 
     #1. select the dataset
-    if config.dataset_name == "assist2015":
-        dataset = ASSIST2015(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        # collate are different
-        collate = collate_fn
-    elif config.dataset_name == "assist2009":
-        dataset = ASSIST2009(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "assist2012":
-        dataset = ASSIST2012(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "algebra2005":
-        dataset = ALGEBRA2005(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "algebra2006":
-        dataset = ALGEBRA2006(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "slepemapy":
-        dataset = SLEPEMAPY(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "ednet":
-        dataset = EDNET(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "assist2017":
-        dataset = ASSIST2017(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "statics":
-        dataset = STATICS(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = None
-        num_diff = None
-        collate = collate_fn
-    elif config.dataset_name == "assist2009_pid":
-        dataset = ASSIST2009_PID(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        # pid_collate_fn give you more data
-        collate = pid_collate_fn
-    elif config.dataset_name == "assist2017_pid":
-        dataset = ASSIST2017_PID(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "assist2012_pid":
-        dataset = ASSIST2012_PID(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "algebra2005_pid":
-        dataset = ALGEBRA2005_PID(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "algebra2006_pid":
-        dataset = ALGEBRA2006_PID(config.max_seq_len)  
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "slepemapy_pid":
-        dataset = SLEPEMAPY_PID(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "ednet_pid":
-        dataset = EDNET_PID(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_collate_fn
-    elif config.dataset_name == "algebra2005_pid_time":
-        dataset = ALGEBRA2005_PID_Time(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        # for time
-        collate = pid_time_collate_fn
-    elif config.dataset_name == "algebra2006_pid_time":
-        dataset = ALGEBRA2006_PID_Time(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_time_collate_fn
-    elif config.dataset_name == "assist2012_pid_time":
-        dataset = ASSIST2012_PID_Time(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_time_collate_fn
-    elif config.dataset_name == "assist2017_pid_time":
-        dataset = ASSIST2017_PID_Time(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = None
-        collate = pid_time_collate_fn
-    elif config.dataset_name == "assist2009_pid_diff":
-        dataset = ASSIST2009_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "assist2012_pid_diff":
-        dataset = ASSIST2012_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "assist2017_pid_diff":
-        dataset = ASSIST2017_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "algebra2005_pid_diff":
-        dataset = ALGEBRA2005_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "algebra2006_pid_diff":
-        dataset = ALGEBRA2006_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "ednet_pid_diff":
-        dataset = EDNET_PID_DIFF(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_collate_fn
-    elif config.dataset_name == "assist2009_pid_diff_pt":
-        dataset = ASSIST2009_PID_DIFF_PT(config.max_seq_len)
-        num_q = dataset.num_q
-        num_r = dataset.num_r
-        num_pid = dataset.num_pid
-        num_diff = dataset.num_diff
-        collate = pid_diff_pt_collate_fn
-    else:
-        print("Wrong dataset_name was used...")
+    if dataset is None:
+        dataset = get_dataset(config)
+    dataset, dataset_meta = dataset
+    num_q = dataset.num_q
+    num_r = dataset.num_r
+    # only the pid and diff datasets have these
+    num_pid = getattr(dataset, "num_pid", None)
+    num_diff = getattr(dataset, "num_diff", None)
+    collate = dataset_meta["collate"]
 
     # 2. data chunk
-    # if fivefold = True
+    # if fivefold = True, the idx-th fold of the precomputed splits
     if config.fivefold == True:
+        if fold_splits is None:
+            fold_splits = get_fold_splits(dataset, config)
 
-        first_chunk = Subset(dataset, range( int(len(dataset) * 0.2) ))
-        second_chunk = Subset(dataset, range( int(len(dataset) * 0.2), int(len(dataset)* 0.4) ))
-        third_chunk = Subset(dataset, range( int(len(dataset) * 0.4), int(len(dataset) * 0.6) ))
-        fourth_chunk = Subset(dataset, range( int(len(dataset) * 0.6), int(len(dataset) * 0.8) ))
-        fifth_chunk = Subset(dataset, range( int(len(dataset) * 0.8), int(len(dataset)) ))
-
-        # idx from main
-        # fivefold first
-        if idx == 0:
-            # train_dataset is 0.8 of whole dataset
-            train_dataset = ConcatDataset([second_chunk, third_chunk, fourth_chunk, fifth_chunk])
-
-            # valid_size is 0.1 of train_dataset
-            valid_size = int( len(train_dataset) * config.valid_ratio)
-            # train_size is 0.9 of train_dataset
-            train_size = int( len(train_dataset) ) - valid_size
-            
-            train_dataset, valid_dataset = random_split(
-                train_dataset, [ train_size, valid_size ]
-            )
-
-            # test_dataset is 0.2 of whole dataset
-            test_dataset = first_chunk
-        # fivefold second
-        elif idx == 1:
-            train_dataset = ConcatDataset([first_chunk, third_chunk, fourth_chunk, fifth_chunk])
-            valid_size = int( len(train_dataset) * config.valid_ratio) #train의 0.1
-            train_size = int( len(train_dataset) ) - valid_size #train의 0.9
-            
-            train_dataset, valid_dataset = random_split(
-                train_dataset, [ train_size, valid_size ]
-            )
-            test_dataset = second_chunk
-        # fivefold third
-        elif idx == 2:
-            train_dataset = ConcatDataset([first_chunk, second_chunk, fourth_chunk, fifth_chunk])
-            valid_size = int( len(train_dataset) * config.valid_ratio) #train의 0.1
-            train_size = int( len(train_dataset) ) - valid_size #train의 0.9
-            
-            train_dataset, valid_dataset = random_split(
-                train_dataset, [ train_size, valid_size ]
-            )
-            test_dataset = third_chunk
-        # fivefold fourth
-        elif idx == 3:
-            train_dataset = ConcatDataset([first_chunk, second_chunk, third_chunk, fifth_chunk])
-            valid_size = int( len(train_dataset) * config.valid_ratio) #train의 0.1
-            train_size = int( len(train_dataset) ) - valid_size #train의 0.9
-            
-            train_dataset, valid_dataset = random_split(
-                train_dataset, [ train_size, valid_size ]
-            )
-            test_dataset = fourth_chunk
-        # fivefold fifth
-        elif idx == 4:
-            train_dataset = ConcatDataset([first_chunk, second_chunk, third_chunk, fourth_chunk])
-            valid_size = int( len(train_dataset) * config.valid_ratio) #train의 0.1
-            train_size = int( len(train_dataset) ) - valid_size #train의 0.9
-            
-            train_dataset, valid_dataset = random_split(
-                train_dataset, [ train_size, valid_size ]
-            )
-            test_dataset = fifth_chunk
+        train_dataset = Subset(dataset, fold_splits[idx]["train"])
+        valid_dataset = Subset(dataset, fold_splits[idx]["valid"])
+        test_dataset = Subset(dataset, fold_splits[idx]["test"])
     # fivefold = False
     else:
         train_size = int( len(dataset) * config.train_ratio * (1 - config.valid_ratio))
@@ -305,23 +173,113 @@ def get_loaders(config, idx=None):
             )
 
     # 3. get DataLoader
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size = config.batch_size,
-        shuffle = True, # train_loader use shuffle
-        collate_fn = collate
-    )
-    valid_loader = DataLoader(
-        valid_dataset,
-        batch_size = config.batch_size,
-        shuffle = False, # valid_loader don't use shuffle
-        collate_fn = collate
-    )
-    test_loader = DataLoader(
-        test_dataset,
-        batch_size = config.batch_size,
-        shuffle = False, # test_loader don't use shuffle
-        collate_fn = collate
-    )
-
-    return train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff
\ No newline at end of file
+    # "window": every batch is one gather from the padded windows, no per-sample collate
+    if config.collate == "window":
+        # with length_bucket, windows of similar length are batched together and a batch is padded only to its longest window
+        windows = PaddedWindows(
+            dataset, float_fields=dataset_meta.get("float_fields", ()), trim=config.length_bucket > 0
+        )
+
+        def get_batch_sampler(split_dataset, shuffle):
+            if config.length_bucket > 0:
+                # the lens of the dataset the split indices point to
+                lens = split_dataset.lens if isinstance(split_dataset, PaddedWindows) else windows.lens
+                return LengthBucketBatchSampler(
+                    get_window_indices(split_dataset), lens, config.batch_size, config.length_bucket, shuffle=shuffle
+                )
+            return WindowBatchSampler(get_window_indices(split_dataset), config.batch_size, shuffle=shuffle)
+
+        if config.packing:
+            # with packing, the short training windows share windows, valid and test are not packed
+            packed_windows = PackedWindows(windows, get_window_indices(train_dataset))
+            train_loader = EpochDataLoader(
+                packed_windows,
+                batch_size = None,
+                sampler = get_batch_sampler(packed_windows, shuffle=True),
+                **get_mlm_loader_kwargs(config)
+            )
+        else:
+            train_loader = EpochDataLoader(
+                windows,
+                batch_size = None, # the sampler gives whole batches
+                sampler = get_batch_sampler(train_dataset, shuffle=True), # train_loader use shuffle
+                **get_mlm_loader_kwargs(config)
+            )
+        valid_loader = DataLoader(
+            windows,
+            batch_size = None,
+            sampler = get_batch_sampler(valid_dataset, shuffle=False) # valid_loader don't use shuffle
+        )
+        test_loader = DataLoader(
+            windows,
+            batch_size = None,
+            sampler = get_batch_sampler(test_dataset, shuffle=False) # test_loader don't use shuffle
+        )
+    # "sample": collate the samples of every batch with the collate of the dataset
+    elif config.collate == "sample":
+        train_loader = EpochDataLoader(
+            train_dataset,
+            batch_size = config.batch_size,
+            shuffle = True, # train_loader use shuffle
+            **get_mlm_loader_kwargs(config, collate)
+        )
+        valid_loader = DataLoader(
+            valid_dataset,
+            batch_size = config.batch_size,
+            shuffle = False, # valid_loader don't use shuffle
+            collate_fn = collate
+        )
+        test_loader = DataLoader(
+            test_dataset,
+            batch_size = config.batch_size,
+            shuffle = False, # test_loader don't use shuffle
+            collate_fn = collate
+        )
+    else:
+        raise ValueError("Wrong collate was used: %s (choose from window, sample)" % config.collate)
+
+    return train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff
+
+# collate_fn and workers of the train_loader
+# with mlm_workers, the training masks are drawn in the DataLoader workers while the model trains (see MlmCollate)
+def get_mlm_loader_kwargs(config, collate=None, num_workers=0):
+    if config.mlm_workers > 0:
+        return dict(
+            collate_fn = MlmCollate(collate, seed=config.mlm_seed),
+            num_workers = num_workers or config.mlm_workers
+        )
+
+    return dict(collate_fn = collate, num_workers = num_workers)
+
+# loaders of a stream directory, for corpora larger than memory
+# stream_dir has train, valid and test subdirectories of shards, see dataloaders/streaming_loader.py
+# dataset_name only selects the collate, the order of the fields in the shards has to match it
+def get_streaming_loaders(config):
+    check_window_stride(config)
+    if config.packing or config.fivefold:
+        raise ValueError("packing and fivefold are not supported with --stream_dir")
+
+    collate = DATASETS.get_meta(config.dataset_name)["collate"]
+
+    loaders = []
+    for split in ("train", "valid", "test"):
+        dataset = StreamingWindows(
+            os.path.join(config.stream_dir, split),
+            config.max_seq_len,
+            stride=config.window_stride,
+            shuffle=(split == "train"), # train_loader use shuffle
+            buffer_size=config.stream_buffer,
+            seed=config.split_seed,
+        )
+        # the workers of the stream read the shards, with mlm_workers they also draw the training masks
+        if split == "train":
+            loader_kwargs = get_mlm_loader_kwargs(config, collate, config.stream_workers)
+        else:
+            loader_kwargs = dict(collate_fn = collate, num_workers = config.stream_workers)
+        loaders.append(EpochDataLoader(
+            dataset,
+            batch_size = config.batch_size,
+            **loader_kwargs
+        ))
+
+    return (*loaders, dataset.num_q, dataset.num_r, dataset.num_pid, dataset.num_diff)
@@ -1,330 +1,60 @@
-from models.bidkt import Bidkt
-from models.bert4kt_plus import Bert4ktPlus
-from models.bert4kt_rasch import Bert4ktRasch
-from models.albert4kt_plus import ALBert4ktPlus
-from models.bcaa_kt import BcaaKt
-from models.ma_bert4kt_plus import MonotonicBert4ktPlus
-from models.nma_bert4kt_dualenc_kr import NmaBert4ktDualencKr
-from models.ma_bert4kt_dualenc_kr import MaBert4ktDualencKr
-from models.bigbird4kt_plus import Bigbird4ktPlus
-from models.bert4kt_plus_time import Bert4ktPlusTime
-from models.convbert4kt_plus import ConvBert4ktPlus
-from models.monaconvbert4kt_plus import MonaConvBert4ktPlus
-from models.forgetting_monoconvbert4kt_plus import ForgettingMonoConvBert4ktPlus
-from models.monaconvbert4kt_plus_pt import MonaConvBert4ktPlusPastTrial
-from models.monaconvbert4kt_plus_diff import MonaConvBert4ktPlusDiff
-from models.monaconvbert4kt_plus_diff_pt import MonaConvBert4ktPlusDiffPt
-from models.convbert4kt_plus_diff import ConvBert4ktPlusDiff
-from models.monabert4kt_plus_diff import MonaBert4ktPlusDiff
-from models.bert4kt_plus_diff import Bert4ktPlusDiff
-from models.monaconvbert4kt_rasch import MonaConvBert4ktRasch
-from models.monabert4kt_plus import MonaBert4ktPlus
+from get_modules.registry import Registry
+
+# model_name -> model class, imported only when it is selected
+# extra_args are the arguments that only some models take, besides the common ones
+# packing=True: the model takes the segment ids of packed windows as its mask (see models/mask_utils.py)
+#   only the models whose attention mask blocks <PAD> keys can be packed, the others (bidkt, bert4kt_plus, ...)
+#   mask the rows of the real queries instead, which a packed window can't reproduce per learner
+#   the outputs of these models on the real positions don't depend on the padding either,
+#   so only their batches can be trimmed (--length_bucket, the all-positions evaluation)
+MODELS = Registry("model_name")
+MODELS.register("bidkt", "models.bidkt:Bidkt", extra_args=("attn_backend",))
+MODELS.register("bert4kt_plus", "models.bert4kt_plus:Bert4ktPlus", extra_args=("num_pid", "attn_backend"))
+MODELS.register("bert4kt_rasch", "models.bert4kt_rasch:Bert4ktRasch", extra_args=("num_pid",))
+MODELS.register("albert4kt_plus", "models.albert4kt_plus:ALBert4ktPlus", extra_args=("num_pid", "attn_backend"))
+MODELS.register("ma_bert4kt_plus", "models.ma_bert4kt_plus:MonotonicBert4ktPlus", extra_args=("num_pid",))
+MODELS.register("nma_bert4kt_dualenc_kr", "models.nma_bert4kt_dualenc_kr:NmaBert4ktDualencKr", extra_args=("num_pid",))
+MODELS.register("ma_bert4kt_dualenc_kr", "models.ma_bert4kt_dualenc_kr:MaBert4ktDualencKr", extra_args=("num_pid",))
+MODELS.register("bcaa_kt", "models.bcaa_kt:BcaaKt", extra_args=("num_pid",))
+MODELS.register("bigbird4kt_plus", "models.bigbird4kt_plus:Bigbird4ktPlus", extra_args=("num_pid", "config"))
+MODELS.register("bert4kt_plus_time", "models.bert4kt_plus_time:Bert4ktPlusTime", extra_args=("num_pid",))
+MODELS.register("convbert4kt_plus", "models.convbert4kt_plus:ConvBert4ktPlus", extra_args=("num_pid",))
+# this model is main model of ours
+MODELS.register("monaconvbert4kt_plus", "models.monaconvbert4kt_plus:MonaConvBert4ktPlus", extra_args=("num_pid", "attn_block_size"))
+MODELS.register("monaconvbert4kt_rasch", "models.monaconvbert4kt_rasch:MonaConvBert4ktRasch", extra_args=("num_pid", "attn_block_size"))
+MODELS.register("forgetting_monoconvbert4kt_plus", "models.forgetting_monoconvbert4kt_plus:ForgettingMonoConvBert4ktPlus", extra_args=("num_pid",))
+MODELS.register("monaconvbert4kt_plus_pt", "models.monaconvbert4kt_plus_pt:MonaConvBert4ktPlusPastTrial", extra_args=("num_pid", "attn_block_size"))
+MODELS.register("monaconvbert4kt_plus_diff", "models.monaconvbert4kt_plus_diff:MonaConvBert4ktPlusDiff", extra_args=("num_pid", "num_diff", "attn_block_size"))
+MODELS.register("monaconvbert4kt_plus_diff_pt", "models.monaconvbert4kt_plus_diff_pt:MonaConvBert4ktPlusDiffPt", extra_args=("num_pid", "num_diff", "attn_block_size"))
+MODELS.register("convbert4kt_plus_diff", "models.convbert4kt_plus_diff:ConvBert4ktPlusDiff", extra_args=("num_pid", "num_diff"))
+MODELS.register("monabert4kt_plus_diff", "models.monabert4kt_plus_diff:MonaBert4ktPlusDiff", extra_args=("num_pid", "num_diff", "attn_block_size"), packing=True)
+MODELS.register("monabert4kt_plus", "models.monabert4kt_plus:MonaBert4ktPlus", extra_args=("num_pid", "attn_block_size"), packing=True)
+MODELS.register("bert4kt_plus_diff", "models.bert4kt_plus_diff:Bert4ktPlusDiff", extra_args=("num_pid", "num_diff", "attn_backend"), packing=True)
 
 # get models
 def get_models(num_q, num_r, num_pid, num_diff, device, config):
 
     # choose the models
-    if config.model_name == "bidkt":
-        model = Bidkt(
-            num_q=num_q,
-            num_r=num_r,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "bert4kt_plus":
-        model = Bert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "bert4kt_rasch":
-        model = Bert4ktRasch(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "albert4kt_plus":
-        model = ALBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "ma_bert4kt_plus":
-        model = MonotonicBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "nma_bert4kt_dualenc_kr":
-        model = NmaBert4ktDualencKr(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "ma_bert4kt_dualenc_kr":
-        model = MaBert4ktDualencKr(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "bcaa_kt":
-        model = BcaaKt(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "bigbird4kt_plus":
-        model = Bigbird4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            config=config,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "bert4kt_plus_time":
-        model = Bert4ktPlusTime(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p,
-        ).to(device)
-    elif config.model_name == "convbert4kt_plus":
-        model = ConvBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    # this model is main model of ours
-    elif config.model_name == "monaconvbert4kt_plus":
-        model = MonaConvBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monaconvbert4kt_rasch":
-        model = MonaConvBert4ktRasch(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "forgetting_monoconvbert4kt_plus":
-        model = ForgettingMonoConvBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monaconvbert4kt_plus_pt":
-        model = MonaConvBert4ktPlusPastTrial(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monaconvbert4kt_plus_diff":
-        model = MonaConvBert4ktPlusDiff(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            num_diff=num_diff,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monaconvbert4kt_plus_diff_pt":
-        model = MonaConvBert4ktPlusDiffPt(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            num_diff=num_diff,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "convbert4kt_plus_diff":
-        model = ConvBert4ktPlusDiff(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            num_diff=num_diff,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monabert4kt_plus_diff":
-        model = MonaBert4ktPlusDiff(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            num_diff=num_diff,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "monabert4kt_plus":
-        model = MonaBert4ktPlus(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    elif config.model_name == "bert4kt_plus_diff":
-        model = Bert4ktPlusDiff(
-            num_q=num_q,
-            num_r=num_r,
-            num_pid=num_pid,
-            num_diff=num_diff,
-            hidden_size=config.hidden_size,
-            output_size=config.output_size,
-            num_head=config.num_head,
-            num_encoder=config.num_encoder,
-            max_seq_len=config.max_seq_len,
-            device=device,
-            use_leakyrelu=config.use_leakyrelu,
-            dropout_p=config.dropout_p
-        ).to(device)
-    else:
-        print("Wrong model_name was used...")
+    model_class, model_meta = MODELS.get(config.model_name)
+    extra_args = {
+        "num_pid": num_pid,
+        "num_diff": num_diff,
+        "config": config,
+        "attn_backend": config.attn_backend,
+        "attn_block_size": config.attn_block_size,
+    }
+    model = model_class(
+        num_q=num_q,
+        num_r=num_r,
+        hidden_size=config.hidden_size,
+        output_size=config.output_size,
+        num_head=config.num_head,
+        num_encoder=config.num_encoder,
+        max_seq_len=config.max_seq_len,
+        device=device,
+        use_leakyrelu=config.use_leakyrelu,
+        dropout_p=config.dropout_p,
+        **{arg: extra_args[arg] for arg in model_meta["extra_args"]}
+    ).to(device)
 
-    return model
\ No newline at end of file
+    return model
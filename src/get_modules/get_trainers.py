@@ -1,281 +1,45 @@
-from trainers.bidkt_trainer import BidktTrainer
-from trainers.bert4kt_plus_trainer import Bert4ktPlusTrainer
-from trainers.bert4kt_rasch_trainer import Bert4ktRaschTrainer
-from trainers.albert4kt_plus_trainer import ALBert4ktPlusTrainer
-from trainers.ma_bert4kt_plus_trainer import MonotonicBert4ktPlusTrainer
-from trainers.bcaa_kt_trainer import BcaaKtTrainer
-from trainers.nma_bert4kt_dualenc_kr_trainer import NmaBert4ktDualencKrTrainer
-from trainers.ma_bert4kt_dualenc_kr_trainer import MaBert4ktDualencKrTrainer
-from trainers.bigbird4kt_plus_trainer import Bigbird4ktPlusTrainer
-from trainers.bert4kt_plus_time_trainer import Bert4ktPlusTimeTrainer
-from trainers.convbert4kt_plus_trainer import ConvBert4ktPlusTrainer
-from trainers.monaconvbert4kt_plus_trainer import MonaConvBert4ktPlusTrainer
-from trainers.forgetting_monoconvbert4kt_plus_trainer import ForgettingMonoConvBert4ktPlusTrainer
-from trainers.monaconvbert4kt_plus_pt_trainer import MonaConvBert4ktPlusPastTrialTrainer
-from trainers.monaconvbert4kt_plus_diff_trainer import MonaConvBert4ktPlusDiffTrainer
-from trainers.monaconvbert4kt_plus_diff_pt_trainer import MonaConvBert4ktPlusDiffPtTrainer
-from trainers.convbert4kt_plus_diff_trainer import ConvBert4ktPlusDiffTrainer
-from trainers.monabert4kt_plus_diff_trainer import MonaBert4ktPlusDiffTrainer
-from trainers.bert4kt_plus_diff_trainer import Bert4ktPlusDiffTrainer
-from trainers.monaconvbert4kt_rasch_trainer import MonaConvBert4ktRaschTrainer
-from trainers.monabert4kt_plus_trainer import MonaBert4ktPlusTrainer
+from get_modules.registry import Registry
+
+# model_name -> trainer class, imported only when it is selected
+TRAINERS = Registry("model_name")
+TRAINERS.register("bidkt", "trainers.bidkt_trainer:BidktTrainer")
+TRAINERS.register("bert4kt_plus", "trainers.bert4kt_plus_trainer:Bert4ktPlusTrainer")
+TRAINERS.register("bert4kt_rasch", "trainers.bert4kt_rasch_trainer:Bert4ktRaschTrainer")
+TRAINERS.register("albert4kt_plus", "trainers.albert4kt_plus_trainer:ALBert4ktPlusTrainer")
+TRAINERS.register("ma_bert4kt_plus", "trainers.ma_bert4kt_plus_trainer:MonotonicBert4ktPlusTrainer")
+TRAINERS.register("nma_bert4kt_dualenc_kr", "trainers.nma_bert4kt_dualenc_kr_trainer:NmaBert4ktDualencKrTrainer")
+TRAINERS.register("ma_bert4kt_dualenc_kr", "trainers.ma_bert4kt_dualenc_kr_trainer:MaBert4ktDualencKrTrainer")
+TRAINERS.register("bcaa_kt", "trainers.bcaa_kt_trainer:BcaaKtTrainer")
+TRAINERS.register("bigbird4kt_plus", "trainers.bigbird4kt_plus_trainer:Bigbird4ktPlusTrainer")
+TRAINERS.register("bert4kt_plus_time", "trainers.bert4kt_plus_time_trainer:Bert4ktPlusTimeTrainer")
+TRAINERS.register("convbert4kt_plus", "trainers.convbert4kt_plus_trainer:ConvBert4ktPlusTrainer")
+TRAINERS.register("monaconvbert4kt_plus", "trainers.monaconvbert4kt_plus_trainer:MonaConvBert4ktPlusTrainer")
+TRAINERS.register("monaconvbert4kt_rasch", "trainers.monaconvbert4kt_rasch_trainer:MonaConvBert4ktRaschTrainer")
+TRAINERS.register("forgetting_monoconvbert4kt_plus", "trainers.forgetting_monoconvbert4kt_plus_trainer:ForgettingMonoConvBert4ktPlusTrainer")
+TRAINERS.register("monaconvbert4kt_plus_pt", "trainers.monaconvbert4kt_plus_pt_trainer:MonaConvBert4ktPlusPastTrialTrainer")
+TRAINERS.register("monaconvbert4kt_plus_diff", "trainers.monaconvbert4kt_plus_diff_trainer:MonaConvBert4ktPlusDiffTrainer")
+TRAINERS.register("monaconvbert4kt_plus_diff_pt", "trainers.monaconvbert4kt_plus_diff_pt_trainer:MonaConvBert4ktPlusDiffPtTrainer")
+TRAINERS.register("convbert4kt_plus_diff", "trainers.convbert4kt_plus_diff_trainer:ConvBert4ktPlusDiffTrainer")
+TRAINERS.register("monabert4kt_plus_diff", "trainers.monabert4kt_plus_diff_trainer:MonaBert4ktPlusDiffTrainer")
+TRAINERS.register("monabert4kt_plus", "trainers.monabert4kt_plus_trainer:MonaBert4ktPlusTrainer")
+TRAINERS.register("bert4kt_plus_diff", "trainers.bert4kt_plus_diff_trainer:Bert4ktPlusDiffTrainer")
 
 def get_trainers(model, optimizer, device, num_q, crit, config):
 
     #trainer 실행
-    if config.model_name == "bidkt":
-        trainer = BidktTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bert4kt_plus":
-        trainer = Bert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bert4kt_rasch":
-        trainer = Bert4ktRaschTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "albert4kt_plus":
-        trainer = ALBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "ma_bert4kt_plus":
-        trainer = MonotonicBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "nma_bert4kt_dualenc_kr":
-        trainer = NmaBert4ktDualencKrTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "ma_bert4kt_dualenc_kr":
-        trainer = MaBert4ktDualencKrTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bcaa_kt":
-        trainer = BcaaKtTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bigbird4kt_plus":
-        trainer = Bigbird4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bert4kt_plus_time":
-        trainer = Bert4ktPlusTimeTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "convbert4kt_plus":
-        trainer = ConvBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monaconvbert4kt_plus":
-        trainer = MonaConvBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monaconvbert4kt_rasch":
-        trainer = MonaConvBert4ktRaschTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "forgetting_monoconvbert4kt_plus":
-        trainer = ForgettingMonoConvBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monaconvbert4kt_plus_pt":
-        trainer = MonaConvBert4ktPlusPastTrialTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monaconvbert4kt_plus_diff":
-        trainer = MonaConvBert4ktPlusDiffTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monaconvbert4kt_plus_diff_pt":
-        trainer = MonaConvBert4ktPlusDiffPtTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "convbert4kt_plus_diff":
-        trainer = ConvBert4ktPlusDiffTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monabert4kt_plus_diff":
-        trainer = MonaBert4ktPlusDiffTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "monabert4kt_plus":
-        trainer = MonaBert4ktPlusTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    elif config.model_name == "bert4kt_plus_diff":
-        trainer = Bert4ktPlusDiffTrainer(
-            model=model,
-            optimizer=optimizer,
-            n_epochs=config.n_epochs,
-            device=device,
-            num_q=num_q,
-            crit=crit,
-            max_seq_len=config.max_seq_len,
-            grad_acc=config.grad_acc,
-            grad_acc_iter=config.grad_acc_iter
-        )
-    else:
-        print("wrong model was choosed..")
+    trainer_class, _ = TRAINERS.get(config.model_name)
+    trainer = trainer_class(
+        model=model,
+        optimizer=optimizer,
+        n_epochs=config.n_epochs,
+        device=device,
+        num_q=num_q,
+        crit=crit,
+        max_seq_len=config.max_seq_len,
+        grad_acc=config.grad_acc,
+        grad_acc_iter=config.grad_acc_iter,
+        mlm_seed=config.mlm_seed,
+        auc_bins=config.auc_bins
+    )
 
     return trainer
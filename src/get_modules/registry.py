@@ -0,0 +1,48 @@
+import importlib
+
+class Registry:
+    """
+    Map names used on the command line to lazily imported entry points.
+
+    An entry point is a "module:attribute" string and its module is imported only when the name is looked up,
+    so a run imports the selected dataset, model and trainer instead of all of them.
+
+        :param kind: (str) what the names are, used in the error message, e.g. "model_name"
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self.entries = {}
+
+    def register(self, name, entry_point, **meta):
+        """
+        :param name: (str) name of the component, e.g. "bidkt"
+        :param entry_point: (str) "module:attribute", e.g. "models.bidkt:Bidkt"
+        :param meta: extra information the factory needs, e.g. the collate function of a dataset
+        """
+        self.entries[name] = (entry_point, meta)
+
+    def _lookup(self, name):
+        if name not in self.entries:
+            raise ValueError(
+                "Wrong %s was used: %s (choose from %s)" % (self.kind, name, ", ".join(self.entries))
+            )
+
+        return self.entries[name]
+
+    def get(self, name):
+        """
+        Import and return the entry point registered as name, with its meta.
+        """
+        entry_point, meta = self._lookup(name)
+        module_name, attr_name = entry_point.split(":")
+
+        return getattr(importlib.import_module(module_name), attr_name), meta
+
+    def get_meta(self, name):
+        """
+        Return the meta of name without importing its entry point.
+        """
+        return self._lookup(name)[1]
+
+    def names(self):
+        return list(self.entries)
@@ -0,0 +1,227 @@
+import math
+
+import torch
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+
+class PositionCache():
+    """
+    Position matrices of the monotonic attentions, built once on the device where they are used.
+
+    The matrices of a length n are the top-left n x n block of the ones of any longer length,
+    so only the longest one is kept for every (matrix, dtype, device) and shorter batches get a view of it.
+    Every attention module has its own cache, it is not a buffer and doesn't go into the state_dict.
+    """
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, name, seqlen, dtype, device, build):
+        key = (name, dtype, device)
+        matrix = self.cache.get(key)
+
+        if matrix is None or matrix.size(-1) < seqlen:
+            matrix = build(seqlen, device).to(dtype)
+            self.cache[key] = matrix
+
+        return matrix[..., :seqlen, :seqlen]
+
+    def get_position_effect(self, seqlen, device, dtype=torch.float):
+        """
+        |i - j| of every pair of positions.
+
+            :output position_effect: (torch.Tensor) |position_effect| = (1, 1, seqlen, seqlen)
+        """
+        def build(seqlen, device):
+            x1 = torch.arange(seqlen, device=device).expand(seqlen, -1)
+            x2 = x1.transpose(0, 1).contiguous()
+            return torch.abs(x1 - x2)[None, None, :, :]
+
+        return self.get("position_effect", seqlen, dtype, device, build)
+
+    def get_lower_triu(self, seqlen, device, dtype=torch.float):
+        """
+        1 where j < i (strictly below the diagonal), else 0.
+
+            :output lower_triu: (torch.Tensor) |lower_triu| = (1, 1, seqlen, seqlen)
+        """
+        def build(seqlen, device):
+            return torch.ones(seqlen, seqlen, device=device).tril(diagonal=-1)[None, None, :, :]
+
+        return self.get("lower_triu", seqlen, dtype, device, build)
+
+# attention backends of the multi-head attentions
+# bmm: the heads are concatenated on the batch dimension, bmm -> masked_fill_ -> softmax -> bmm
+# sdpa: (bs, n_heads, n, head_size) and F.scaled_dot_product_attention, so the fused kernels are used (CPU too)
+ATTN_BACKENDS = ("bmm", "sdpa")
+
+def scaled_dot_product_attention(Q, K, V, attn_mask, dropout_p=0.):
+    """
+    F.scaled_dot_product_attention with the masking of the bmm backend.
+
+    masked_fill_ gives every score of a query whose keys are all masked the same value,
+    so such a query attends uniformly to all the keys, where the fused kernels would give NaN.
+    These queries get the mean of V instead.
+
+        :param Q, K, V: (torch.Tensor) |Q| = |K| = |V| = (bs, n_heads, n, head_size)
+        :param attn_mask: (torch.Tensor) True where query i can attend key j, torch.bool
+            |attn_mask| = (bs, 1, n, n) or (bs, 1, 1, n), shared by the heads
+        :param dropout_p: (float) dropout of the attention probabilities, 0 for evaluation
+
+        :output c: (torch.Tensor) |c| = (bs, n_heads, n, head_size)
+    """
+    # |blocked| = (bs, 1, n, 1) or (bs, 1, 1, 1), queries without any key
+    blocked = ~attn_mask.any(dim=-1, keepdim=True)
+
+    c = F.scaled_dot_product_attention(Q, K, V, attn_mask=attn_mask | blocked, dropout_p=dropout_p)
+
+    return torch.where(blocked, V.mean(dim=-2, keepdim=True), c)
+
+# blockwise monotonic attention
+# the monotonic attentions of the mona models compute (bs, n_heads, n, n) scores twice, for the distance (dist_func)
+# and for the softmax, so the memory is quadratic in n. Here the queries are cut into tiles of block_size rows
+# and every tile goes over the keys in tiles of block_size columns, so at most (bs, n_heads, block_size, block_size)
+# scores are alive at a time:
+#   1. the max and sum of the distance softmax of every query, online over the key tiles (no grad)
+#   2. the key tiles from the last one: the distance softmax of the tile, its suffix sums (total - cumsum of dist_func),
+#      the decay, and the masked softmax of the decayed scores with online normalization (running max, sum and output)
+# with grad, a query tile is recomputed in the backward (torch.utils.checkpoint) instead of keeping its tiles
+
+def get_mask_tile(mask, q_start, q_end, k_start, k_end):
+    # |mask| = (bs, 1, 1, n) or (bs, 1, n, n), the key padding mask has no query dimension to cut
+    if mask.size(2) > 1:
+        mask = mask[:, :, q_start:q_end]
+
+    return mask[..., k_start:k_end]
+
+def get_position_effect_tile(q_start, q_end, k_start, k_end, device, dtype):
+    # |i - j| of the queries q_start..q_end-1 and the keys k_start..k_end-1
+    q_pos = torch.arange(q_start, q_end, device=device).unsqueeze(-1)
+    k_pos = torch.arange(k_start, k_end, device=device).unsqueeze(0)
+
+    return torch.abs(q_pos - k_pos).to(dtype)
+
+def monotonic_attention_tile(Q, K, V, mask, gamma, dropout, q_start, block_size):
+    """
+    Monotonic attention of one tile of queries, see blockwise_monotonic_attention.
+
+        :param Q: (torch.Tensor) |Q| = (bs, n_heads, q_len, head_size), queries q_start..q_start+q_len-1
+        :param q_start: (int) position of the first query of the tile
+
+        :output c: (torch.Tensor) |c| = (bs, n_heads, q_len, head_size)
+    """
+    n, q_end = K.size(2), q_start + Q.size(2)
+    scale = math.sqrt(Q.size(-1))
+    k_starts = list(range(0, n, block_size))
+
+    def get_scores(k_start, k_end):
+        scores = torch.matmul(Q, K[:, :, k_start:k_end].transpose(-1, -2)) / scale
+        tile_mask = get_mask_tile(mask, q_start, q_end, k_start, k_end)
+        return scores, tile_mask
+
+    # 1. max and sum of the distance softmax, masked_fill_(-1e32) like dist_func
+    with torch.no_grad():
+        dist_max = Q.new_full(Q.size()[:-1] + (1,), -float("inf"))
+        dist_sum = Q.new_zeros(Q.size()[:-1] + (1,))
+        for k_start in k_starts:
+            scores, tile_mask = get_scores(k_start, min(k_start + block_size, n))
+            scores = scores.masked_fill(tile_mask == 0, -1e32)
+            new_max = torch.maximum(dist_max, scores.amax(dim=-1, keepdim=True))
+            dist_sum = dist_sum * (dist_max - new_max).exp() + (scores - new_max).exp().sum(dim=-1, keepdim=True)
+            dist_max = new_max
+
+    # 2. from the last key tile to the first one, so the suffix sums of the distance softmax are carried over
+    suffix = Q.new_zeros(Q.size()[:-1] + (1,))
+    out_max = Q.new_full(Q.size()[:-1] + (1,), -float("inf"))
+    out_sum = Q.new_zeros(Q.size()[:-1] + (1,))
+    out = torch.zeros_like(Q)
+    for k_start in reversed(k_starts):
+        k_end = min(k_start + block_size, n)
+        scores, tile_mask = get_scores(k_start, k_end)
+        # |scores| = (bs, n_heads, q_len, k_len)
+
+        with torch.no_grad():
+            dist_probs = (scores.masked_fill(tile_mask == 0, -1e32) - dist_max).exp() / dist_sum
+            dist_probs = dist_probs * tile_mask.float()
+            # total - cumsum of dist_func = the sum of the probabilities of the later keys
+            later = dist_probs.flip(-1).cumsum(dim=-1).flip(-1) - dist_probs + suffix
+            suffix = suffix + dist_probs.sum(dim=-1, keepdim=True)
+
+            position_effect = get_position_effect_tile(q_start, q_end, k_start, k_end, Q.device, Q.dtype)
+            dist_scores = torch.clamp(later * position_effect, min=0.0).sqrt()
+
+        total_effect = torch.clamp(
+            torch.clamp((dist_scores * gamma).exp(), min=1e-5), max=1e5
+        )
+        # dist_func masks the scores in place before they are decayed
+        scores = scores.masked_fill(tile_mask == 0, -1e32) * total_effect
+        scores = scores.masked_fill(tile_mask == 0, -1e8)
+
+        # online softmax
+        new_max = torch.maximum(out_max, scores.detach().amax(dim=-1, keepdim=True))
+        rescale = (out_max - new_max).exp()
+        weights = (scores - new_max).exp()
+        out_sum = out_sum * rescale + weights.sum(dim=-1, keepdim=True)
+        # dropout of the probabilities, the normalization is linear
+        out = out * rescale + torch.matmul(dropout(weights), V[:, :, k_start:k_end])
+        out_max = new_max
+
+    return out / out_sum
+
+def blockwise_monotonic_attention(Q, K, V, mask, gamma, dropout, block_size):
+    """
+    Monotonic attention of the mona models, with O(n * block_size) memory instead of O(n ^ 2).
+
+    The same outputs as the full path (dist_func, decay, masked softmax, dropout, matmul) up to
+    the order of the floating point sums.
+
+        :param Q, K, V: (torch.Tensor) |Q| = |K| = |V| = (bs, n_heads, n, head_size)
+        :param mask: (torch.Tensor) |mask| = (bs, 1, 1, n) or (bs, 1, n, n), see models.mask_utils.get_extended_attention_mask
+        :param gamma: (torch.Tensor) |gamma| = (1, n_heads, 1, 1), negative decay rate
+        :param dropout: (nn.Dropout) dropout of the attention probabilities
+        :param block_size: (int) rows and columns of a tile
+
+        :output c: (torch.Tensor) |c| = (bs, n_heads, n, head_size)
+    """
+    n = Q.size(2)
+    use_checkpoint = torch.is_grad_enabled() and (Q.requires_grad or gamma.requires_grad)
+
+    outputs = []
+    for q_start in range(0, n, block_size):
+        q_end = min(q_start + block_size, n)
+        if use_checkpoint:
+            c = checkpoint(
+                monotonic_attention_tile, Q[:, :, q_start:q_end], K, V, mask, gamma, dropout, q_start, block_size,
+                use_reentrant=False,
+            )
+        else:
+            c = monotonic_attention_tile(Q[:, :, q_start:q_end], K, V, mask, gamma, dropout, q_start, block_size)
+        outputs.append(c)
+
+    return torch.cat(outputs, dim=2)
+
+def span_dynamic_conv(value, kernel):
+    """
+    Span-based dynamic convolution of the ConvBERT attentions: every position mixes the values of the
+    conv_kernel_size positions around it with its own softmaxed kernel of every head.
+
+    nn.functional.unfold materialized (bs, all_head_size * conv_kernel_size, n), conv_kernel_size times the values.
+    Here the kernels are applied to conv_kernel_size shifted views of the zero padded values, so there is only one padded copy.
+
+        :param value: (torch.Tensor) |value| = (bs, n, n_heads, head_size)
+        :param kernel: (torch.Tensor) |kernel| = (bs, n, n_heads, conv_kernel_size), softmaxed, conv_kernel_size is odd
+
+        :output out: (torch.Tensor) |out| = (bs, n, n_heads, head_size)
+    """
+    n, kernel_size = value.size(1), kernel.size(-1)
+    pad = (kernel_size - 1) // 2
+
+    # zeros before and after the sequence, like the padding of unfold
+    value = F.pad(value, (0, 0, 0, 0, pad, pad))
+    # |value| = (bs, n + 2 * pad, n_heads, head_size)
+
+    # position t gets kernel[t, k] * value[t + k - pad]
+    out = value[:, :n] * kernel[..., :1]
+    for k in range(1, kernel_size):
+        out.addcmul_(value[:, k:k + n], kernel[..., k:k + 1])
+
+    return out
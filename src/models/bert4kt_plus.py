@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 
+from models.attention_utils import scaled_dot_product_attention
+
 
 class Attention(nn.Module):
 
@@ -19,9 +21,10 @@ class Attention(nn.Module):
 
         # |w| = (batch_size, m, n)
         if mask is not None:
-            assert w.size() == mask.size()
+            # |w| = (n_splits * batch_size, m, n) is head-major, so the (batch_size, m, n) mask is shared by the heads
+            assert w.size(1) == mask.size(1) and w.size(2) == mask.size(2)
             # mask를 -float('inf')로 만들어두니 overflow 문제 발생
-            w.masked_fill_(mask, -1e8)
+            w.view(-1, *mask.size()).masked_fill_(mask, -1e8)
 
         w = self.softmax(w / (dk**.5)) #attention값
         c = torch.bmm(w, V) #attention값과 Value값 행렬곱
@@ -32,11 +35,13 @@ class Attention(nn.Module):
 
 class MultiHead(nn.Module):
 
-    def __init__(self, hidden_size, n_splits):
+    def __init__(self, hidden_size, n_splits, attn_backend="bmm"):
         super().__init__()
 
         self.hidden_size = hidden_size
         self.n_splits = n_splits
+        # bmm or sdpa, see models.attention_utils
+        self.attn_backend = attn_backend
 
         # Note that we don't have to declare each linear layer, separately.
         self.Q_linear = nn.Linear(hidden_size, hidden_size, bias=False)
@@ -50,6 +55,9 @@ class MultiHead(nn.Module):
         # |Q| = |K| = |V| = (bs, n, hs)
         # |mask| = (bs, n, bs)
 
+        if self.attn_backend == "sdpa":
+            return self.sdpa_forward(Q, K, V, mask)
+
         # 마지막 차원을 split함, 그러면 QWs는 리스트형태로 쌓이게 됨
         QWs = self.Q_linear(Q).split(self.hidden_size // self.n_splits, dim=-1)
         KWs = self.K_linear(K).split(self.hidden_size // self.n_splits, dim=-1)
@@ -67,10 +75,8 @@ class MultiHead(nn.Module):
         # |QWs| = (batch_size * n_splits, m, hidden_size / n_splits)
         # |KWs| = |VWs| = (batch_size * n_splits, n, hidden_size / n_splits)
 
-        # 마스크도 위의 cat처럼 같은 차원으로 만들기
-        if mask is not None:
-            mask = torch.cat([mask for _ in range(self.n_splits)], dim=0)
-            # |mask| = (batch_size * n_splits, m, n)
+        # 마스크는 cat하지 않고 Attention에서 head 차원으로 broadcast함
+        # |mask| = (batch_size, m, n)
 
         c = self.attn(
             QWs, KWs, VWs,
@@ -88,6 +94,32 @@ class MultiHead(nn.Module):
 
         return c
 
+    def sdpa_forward(self, Q, K, V, mask=None):
+        # the heads stay in their own dimension, no cat on the batch dimension and no per-head copies of the mask
+        batch_size, m, n = Q.size(0), Q.size(1), K.size(1)
+        dk = self.hidden_size // self.n_splits
+
+        QWs = self.Q_linear(Q).view(batch_size, m, self.n_splits, dk).transpose(1, 2)
+        KWs = self.K_linear(K).view(batch_size, n, self.n_splits, dk).transpose(1, 2)
+        VWs = self.V_linear(V).view(batch_size, n, self.n_splits, dk).transpose(1, 2)
+        # |QWs| = (batch_size, n_splits, m, hidden_size / n_splits)
+        # |KWs| = |VWs| = (batch_size, n_splits, n, hidden_size / n_splits)
+
+        if mask is None:
+            mask = Q.new_zeros((batch_size, m, n), dtype=torch.bool)
+        # True of mask is masked_fill_ of the bmm backend, True of attn_mask is attended
+        attn_mask = ~mask.unsqueeze(1)
+        # |attn_mask| = (batch_size, 1, m, n)
+
+        c = scaled_dot_product_attention(QWs, KWs, VWs, attn_mask)
+        # |c| = (batch_size, n_splits, m, hidden_size / n_splits)
+
+        # heads are concatenated in the same order as c.split of the bmm backend
+        c = self.linear(c.transpose(1, 2).reshape(batch_size, m, self.hidden_size))
+        # |c| = (batch_size, m, hidden_size)
+
+        return c
+
 
 class EncoderBlock(nn.Module):
 
@@ -97,12 +129,13 @@ class EncoderBlock(nn.Module):
         n_splits,
         use_leakyrelu,
         dropout_p=.1,
+        attn_backend="bmm",
     ):
         super().__init__()
 
         self.use_leakyrelu = use_leakyrelu
 
-        self.attn = MultiHead(hidden_size, n_splits)
+        self.attn = MultiHead(hidden_size, n_splits, attn_backend)
         self.attn_norm = nn.LayerNorm(hidden_size) #attention을 위한 layerNorm
         self.attn_dropout = nn.Dropout(dropout_p)
 
@@ -164,6 +197,7 @@ class Bert4ktPlus(nn.Module):
         device,
         use_leakyrelu,
         dropout_p=.1,
+        attn_backend="bmm",
     ):
         self.num_q = num_q
         self.num_r = num_r + 2 # <PAD>와 <MASK>를 추가한만큼의 Emb값이 필요, 여기에 추가로 1을 더 더해줌
@@ -177,6 +211,7 @@ class Bert4ktPlus(nn.Module):
         self.device = device
         self.use_leakyrelu = use_leakyrelu
         self.dropout_p = dropout_p
+        self.attn_backend = attn_backend
 
         super().__init__()
 
@@ -196,6 +231,7 @@ class Bert4ktPlus(nn.Module):
                 num_head,
                 self.use_leakyrelu,
                 dropout_p,
+                self.attn_backend,
               ) for _ in range(num_encoder)],
         )
 
@@ -19,9 +19,10 @@ class Attention(nn.Module):
 
         # |w| = (batch_size, m, n)
         if mask is not None:
-            assert w.size() == mask.size()
+            # |w| = (n_splits * batch_size, m, n) is head-major, so the (batch_size, m, n) mask is shared by the heads
+            assert w.size(1) == mask.size(1) and w.size(2) == mask.size(2)
             # mask를 -float('inf')로 만들어두니 overflow 문제 발생
-            w.masked_fill_(mask, -1e8)
+            w.view(-1, *mask.size()).masked_fill_(mask, -1e8)
 
         w = self.softmax(w / (dk**.5)) #attention값
         c = torch.bmm(w, V) #attention값과 Value값 행렬곱
@@ -67,10 +68,8 @@ class MultiHead(nn.Module):
         # |QWs| = (batch_size * n_splits, m, hidden_size / n_splits)
         # |KWs| = |VWs| = (batch_size * n_splits, n, hidden_size / n_splits)
 
-        # 마스크도 위의 cat처럼 같은 차원으로 만들기
-        if mask is not None:
-            mask = torch.cat([mask for _ in range(self.n_splits)], dim=0)
-            # |mask| = (batch_size * n_splits, m, n)
+        # 마스크는 cat하지 않고 Attention에서 head 차원으로 broadcast함
+        # |mask| = (batch_size, m, n)
 
         c = self.attn(
             QWs, KWs, VWs,
@@ -3,6 +3,9 @@ import torch.nn as nn
 
 import math
 
+from models.mask_utils import get_extended_attention_mask
+from models.attention_utils import span_dynamic_conv
+
 # SeparableConv1D
 class SeparableConv1D(nn.Module):
     def __init__(self, input_filters, output_filters, kernel_size):
@@ -107,36 +110,19 @@ class ConvBertSelfAttention(nn.Module):
         # |conv_attn_layer| = (bs, n, hs/2(all_attn_h_size))
         conv_kernel_layer = self.conv_kernel_layer(conv_attn_layer)
         # |conv_kernel_layer| = (bs, n, (n_attn_h * conv_kernel_size) = (64, 100, 8 * 9) = (64, 100, 72)
-        conv_kernel_layer = torch.reshape(conv_kernel_layer, [-1, self.conv_kernel_size, 1])
-        # |conv_kernel_layer| = (51200, 9, 1)
-        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=1)
-        # |conv_kernel_layer| = (51200, 9, 1), 각 head별 확률값들을 도출하는 듯
+        conv_kernel_layer = torch.reshape(conv_kernel_layer, [batch_size, -1, self.num_attention_heads, self.conv_kernel_size])
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size) = (64, 100, 8, 9)
+        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=-1)
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size), 각 head별 확률값들을 도출하는 듯
 
         # Q X K와 V가 결합되는 부분
         conv_out_layer = self.conv_out_layer(V)
         # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.all_head_size])
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = conv_out_layer.transpose(1, 2).contiguous().unsqueeze(-1)
-        # |conv_out_layer| = (bs, hs/2(all_attn_h_size), n, 1)
-        # unfold 참고 -> #https://www.facebook.com/groups/PyTorchKR/posts/1685133764959631/
-        conv_out_layer = nn.functional.unfold( 
-            conv_out_layer,
-            kernel_size=[self.conv_kernel_size, 1],
-            dilation=1,
-            padding=[(self.conv_kernel_size - 1) // 2, 0],
-            stride=1,
-        )
-        # |conv_out_layer| = (64, 2304, 100)
-        conv_out_layer = conv_out_layer.transpose(1, 2).reshape(
-            batch_size, -1, self.all_head_size, self.conv_kernel_size
-        )
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size), conv_kernal_size)
-        conv_out_layer = torch.reshape(conv_out_layer, [-1, self.attention_head_size, self.conv_kernel_size])
-        # |conv_out_layer| = (51200, 32, 9)
-        # Q X K와 V가 결합되는 부분
-        conv_out_layer = torch.matmul(conv_out_layer, conv_kernel_layer)
-        # |conv_out_layer| = (51200, 32, 1)
+        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.num_attention_heads, self.attention_head_size])
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
+        # the kernel of every position over the shifted values, without unfold (see span_dynamic_conv)
+        conv_out_layer = span_dynamic_conv(conv_out_layer, conv_kernel_layer)
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         conv_out_layer = torch.reshape(conv_out_layer, [-1, self.all_head_size])
         # |conv_out_layer| = (6400, 256)
 
@@ -148,9 +134,8 @@ class ConvBertSelfAttention(nn.Module):
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
         # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
 
-        # |mask| = (bs, n)
-        attention_mask = self.get_extended_attention_mask(mask)
-        # |attention_mask| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
         # 기존 코드에서는 원하는 위치는 0, 마스크 위치에는 -10000.0을 두어서 처리하려 함
         # attention_scores = attention_scores + attention_mask
         # 여기서는 attention_mask를 아래처럼 처리함
@@ -191,19 +176,6 @@ class ConvBertSelfAttention(nn.Module):
         return outputs
 
 
-    @torch.no_grad()
-    def get_extended_attention_mask(self, mask):
-        # |mask| = (bs, n)
-        mask_shape = mask.size() + (mask.size(1), self.num_attention_heads)
-        # mask_shape = (bs, n, n, n_attn_head)
-        mask_enc = mask.unsqueeze(-1).expand(mask.size(0), mask.size(1), mask.size(1) * self.num_attention_heads).bool()
-        #|mask_enc| = (bs, n, n * n_attn_head)
-
-        mask_enc = mask_enc.view(*mask_shape)
-        #|mask_enc| = (bs, n, n, n_attn_head) = (64, 100, 100, 8)
-
-        return mask_enc.permute(0, 3, 2, 1)
-
     # attention 계산을 위해 마지막 차원을 n_attn_head의 수만큼 나누고, 새로운 차원으로 만들어줌
     def transpose_for_scores(self, x):
         # |x| = (bs, n, hs/2(all_attn_h_size))
@@ -384,9 +356,11 @@ class ConvBert4ktPlus(nn.Module):
         z = self.emb_dropout(emb)
         # |z| = (bs, n, emb_size)
 
-        # |mask_enc| = (bs, n, n)
         # |z| = (bs, n, emb_size)
-        z, _ = self.encoder(z, mask)
+        # one key padding mask for all the encoder blocks and heads, a view of mask
+        mask_enc = get_extended_attention_mask(mask)
+        # |mask_enc| = (bs, 1, 1, n)
+        z, _ = self.encoder(z, mask_enc)
         # |z| = (bs, n, hs)
 
         y_hat = self.generator(z)
@@ -4,6 +4,9 @@ import numpy as np
 import math
 import torch.nn.functional as F
 
+from models.mask_utils import get_extended_attention_mask
+from models.attention_utils import span_dynamic_conv
+
 # SeparableConv1D
 class SeparableConv1D(nn.Module):
     def __init__(self, input_filters, output_filters, kernel_size):
@@ -112,36 +115,19 @@ class ConvolutionalMultiheadAttention(nn.Module):
         # |conv_attn_layer| = (bs, n, hs/2(all_attn_h_size))
         conv_kernel_layer = self.conv_kernel_layer(conv_attn_layer)
         # |conv_kernel_layer| = (bs, n, (n_attn_h * conv_kernel_size) = (64, 100, 8 * 9) = (64, 100, 72)
-        conv_kernel_layer = torch.reshape(conv_kernel_layer, [-1, self.conv_kernel_size, 1])
-        # |conv_kernel_layer| = (51200, 9, 1)
-        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=1)
-        # |conv_kernel_layer| = (51200, 9, 1), 각 head별 확률값들을 도출하는 듯
+        conv_kernel_layer = torch.reshape(conv_kernel_layer, [batch_size, -1, self.num_attention_heads, self.conv_kernel_size])
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size) = (64, 100, 8, 9)
+        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=-1)
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size), 각 head별 확률값들을 도출하는 듯
 
         # q X k is matmul with v
         conv_out_layer = self.conv_out_layer(V)
         # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.all_head_size])
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = conv_out_layer.transpose(1, 2).contiguous().unsqueeze(-1)
-        # |conv_out_layer| = (bs, hs/2(all_attn_h_size), n, 1)
-        # unfold 참고 -> #https://www.facebook.com/groups/PyTorchKR/posts/1685133764959631/
-        conv_out_layer = nn.functional.unfold( 
-            conv_out_layer,
-            kernel_size=[self.conv_kernel_size, 1],
-            dilation=1,
-            padding=[(self.conv_kernel_size - 1) // 2, 0],
-            stride=1,
-        )
-        # |conv_out_layer| = (64, 2304, 100)
-        conv_out_layer = conv_out_layer.transpose(1, 2).reshape(
-            batch_size, -1, self.all_head_size, self.conv_kernel_size
-        )
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size), conv_kernal_size)
-        conv_out_layer = torch.reshape(conv_out_layer, [-1, self.attention_head_size, self.conv_kernel_size])
-        # |conv_out_layer|, default = (51200, 32, 9)
-        # matmul(q X k, v)
-        conv_out_layer = torch.matmul(conv_out_layer, conv_kernel_layer)
-        # |conv_out_layer|, default = (51200, 32, 1)
+        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.num_attention_heads, self.attention_head_size])
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
+        # the kernel of every position over the shifted values, without unfold (see span_dynamic_conv)
+        conv_out_layer = span_dynamic_conv(conv_out_layer, conv_kernel_layer)
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         conv_out_layer = torch.reshape(conv_out_layer, [-1, self.all_head_size])
         # |conv_out_layer|, default = (6400, 256)
 
@@ -153,9 +139,8 @@ class ConvolutionalMultiheadAttention(nn.Module):
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
         # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
 
-        # |mask| = (bs, n)
-        attention_mask = self.get_extended_attention_mask(mask)
-        # |attention_mask| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
         attention_scores = attention_scores.masked_fill_(attention_mask==0, -1e8)
         # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
 
@@ -190,21 +175,6 @@ class ConvolutionalMultiheadAttention(nn.Module):
         # |outputs| = (bs, n, hs)
         return outputs
 
-    # this is for attention mask
-    @torch.no_grad()
-    def get_extended_attention_mask(self, mask):
-        # |mask| = (bs, n)
-        mask_shape = mask.size() + (mask.size(1), self.num_attention_heads)
-        # mask_shape = (bs, n, n, n_attn_head)
-        mask_enc = mask.unsqueeze(-1).expand(mask.size(0), mask.size(1), mask.size(1) * self.num_attention_heads).bool()
-        # |mask_enc| = (bs, n, n * n_attn_head)
-
-        mask_enc = mask_enc.view(*mask_shape)
-        # |mask_enc| = (bs, n, n, n_attn_head), default = (64, 100, 100, 8)
-
-        return mask_enc.permute(0, 3, 2, 1)
-        # |mask_enc| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
     # for attention, last dim will be divied to n_attn_head, and get a new shape
     def transpose_for_scores(self, x):
         # |x| = (bs, n, hs/2(all_attn_h_size))
@@ -386,9 +356,11 @@ class ConvBert4ktPlusDiff(nn.Module):
         z = self.emb_dropout(emb)
         # |z| = (bs, n, emb_size)
 
-        # |mask_enc| = (bs, n, n)
         # |z| = (bs, n, emb_size)
-        z, _ = self.encoder(z, mask)
+        # one key padding mask for all the encoder blocks and heads, a view of mask
+        mask_enc = get_extended_attention_mask(mask)
+        # |mask_enc| = (bs, 1, 1, n)
+        z, _ = self.encoder(z, mask_enc)
         # |z| = (bs, n, hs)
 
         y_hat = self.generator(z)
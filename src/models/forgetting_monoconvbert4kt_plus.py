@@ -4,6 +4,9 @@ import numpy as np
 import math
 import torch.nn.functional as F
 
+from models.mask_utils import get_extended_attention_mask
+from models.attention_utils import PositionCache, span_dynamic_conv
+
 # SeparableConv1D
 class SeparableConv1D(nn.Module):
     def __init__(self, input_filters, output_filters, kernel_size):
@@ -37,6 +40,8 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
     # hidden % n_splits == 0
     def __init__(self, hidden_size, n_splits, dropout_p, head_ratio=2, conv_kernel_size=9):
         super().__init__()
+        # position matrices of the distance, built once per device (see PositionCache)
+        self.position_cache = PositionCache()
 
         #n_splits = 16, head_ratio = 2
         new_num_attention_heads = n_splits // head_ratio
@@ -112,36 +117,19 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
         # |conv_attn_layer| = (bs, n, hs/2(all_attn_h_size))
         conv_kernel_layer = self.conv_kernel_layer(conv_attn_layer)
         # |conv_kernel_layer| = (bs, n, (n_attn_h * conv_kernel_size) = (64, 100, 8 * 9) = (64, 100, 72)
-        conv_kernel_layer = torch.reshape(conv_kernel_layer, [-1, self.conv_kernel_size, 1])
-        # |conv_kernel_layer| = (51200, 9, 1)
-        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=1)
-        # |conv_kernel_layer| = (51200, 9, 1), 각 head별 확률값들을 도출하는 듯
+        conv_kernel_layer = torch.reshape(conv_kernel_layer, [batch_size, -1, self.num_attention_heads, self.conv_kernel_size])
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size) = (64, 100, 8, 9)
+        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=-1)
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size), 각 head별 확률값들을 도출하는 듯
 
         # Q X K와 V가 결합되는 부분
         conv_out_layer = self.conv_out_layer(V)
         # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.all_head_size])
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = conv_out_layer.transpose(1, 2).contiguous().unsqueeze(-1)
-        # |conv_out_layer| = (bs, hs/2(all_attn_h_size), n, 1)
-        # unfold 참고 -> #https://www.facebook.com/groups/PyTorchKR/posts/1685133764959631/
-        conv_out_layer = nn.functional.unfold( 
-            conv_out_layer,
-            kernel_size=[self.conv_kernel_size, 1],
-            dilation=1,
-            padding=[(self.conv_kernel_size - 1) // 2, 0],
-            stride=1,
-        )
-        # |conv_out_layer| = (64, 2304, 100)
-        conv_out_layer = conv_out_layer.transpose(1, 2).reshape(
-            batch_size, -1, self.all_head_size, self.conv_kernel_size
-        )
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size), conv_kernal_size)
-        conv_out_layer = torch.reshape(conv_out_layer, [-1, self.attention_head_size, self.conv_kernel_size])
-        # |conv_out_layer| = (51200, 32, 9)
-        # Q X K와 V가 결합되는 부분
-        conv_out_layer = torch.matmul(conv_out_layer, conv_kernel_layer)
-        # |conv_out_layer| = (51200, 32, 1)
+        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.num_attention_heads, self.attention_head_size])
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
+        # the kernel of every position over the shifted values, without unfold (see span_dynamic_conv)
+        conv_out_layer = span_dynamic_conv(conv_out_layer, conv_kernel_layer)
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         conv_out_layer = torch.reshape(conv_out_layer, [-1, self.all_head_size])
         # |conv_out_layer| = (6400, 256)
 
@@ -181,9 +169,8 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
         attention_scores = attention_scores * total_effect
         # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
 
-        # |mask| = (bs, n)
-        attention_mask = self.get_extended_attention_mask(mask)
-        # |attention_mask| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
         # 기존 코드에서는 원하는 위치는 0, 마스크 위치에는 -10000.0을 두어서 처리하려 함
         # attention_scores = attention_scores + attention_mask
         # 여기서는 attention_mask를 아래처럼 처리함
@@ -229,10 +216,8 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
         scores = attention_scores
         bs, head, seqlen = scores.size(0), scores.size(1), scores.size(2)
 
-        x1 = torch.arange(seqlen).expand(seqlen, -1)
-        x2 = x1.transpose(0, 1).contiguous()
-
-        attention_mask = self.get_extended_attention_mask(mask)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
 
         scores_ = scores.masked_fill_(attention_mask == 0, -1e32)
 
@@ -244,11 +229,8 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
         # [batch_size, 8, seqlen, 1]
         disttotal_scores = torch.sum(scores_, dim=-1, keepdim=True)
 
-        device = distcum_scores.get_device()
-        position_effect = torch.abs(x1 - x2)[None, None, :, :].type(
-            torch.FloatTensor
-        )  # [1, 1, seqlen, seqlen]
-        position_effect = position_effect.to(device)
+        # |position_effect| = (1, 1, seqlen, seqlen), cached on the device of the scores
+        position_effect = self.position_cache.get_position_effect(seqlen, distcum_scores.device)
         # [batch_size, 8, seqlen, seqlen] positive distance
         # dist_score => d(t, tau)
 
@@ -263,7 +245,8 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
     @torch.no_grad()
     def forgetting_func(self, td, mask):
 
-        attention_mask = self.get_extended_attention_mask(mask)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
 
         td = F.normalize(td, dim=-1)
         td_scores = self.get_extended_attention_td(td)
@@ -275,19 +258,12 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
         bs, head, seqlen = td_scores.size(0), td_scores.size(1), td_scores.size(2)
         td_scores_ = td_scores.masked_fill_(attention_mask == 0, -1e4)
 
-        device = td_scores_.get_device()
-
         # decay
         tdcum_scores = torch.cumsum(td_scores_, dim=-1)
         tdtotal_scores = torch.sum(td_scores_, dim=-1, keepdim=True)
 
-        x1 = torch.arange(seqlen).expand(seqlen, -1)
-        x2 = x1.transpose(0, 1).contiguous()
-
-        position_effect = torch.abs(x1 - x2)[None, None, :, :].type(
-            torch.FloatTensor
-        )  # [1, 1, seqlen, seqlen]
-        position_effect = position_effect.to(device)
+        # |position_effect| = (1, 1, seqlen, seqlen), cached on the device of the scores
+        position_effect = self.position_cache.get_position_effect(seqlen, td_scores_.device)
 
         dist_scores = torch.clamp(
             (tdtotal_scores - tdcum_scores) * position_effect, min=0.0
@@ -295,35 +271,13 @@ class ForgettingMonotonicConvBertSelfAttention(nn.Module):
 
         td_scores = dist_scores.sqrt().detach()
         
-        # Make lower_triu for masking
-        one_vectors = np.ones(shape=(bs, head, seqlen, seqlen))
-        # upper_triu
-        upper_triu = np.triu(one_vectors)
-        # reverse
-        upper_triu_bool = upper_triu == 0
-        # lower_triu
-        lower_triu = upper_triu_bool.astype(float)
-        lower_triu = torch.Tensor(lower_triu).to(device)
+        # lower_triu for masking, 1 where j < i
+        lower_triu = self.position_cache.get_lower_triu(seqlen, td_scores.device)
 
         td_scores = td_scores * lower_triu
 
         return td_scores
 
-    @torch.no_grad()
-    def get_extended_attention_mask(self, mask):
-        # |mask| = (bs, n)
-
-        mask_shape = mask.size() + (mask.size(1), self.num_attention_heads)
-        # mask_shape = (bs, n, n, n_attn_head)
-        mask_enc = mask.unsqueeze(-1).expand(mask.size(0), mask.size(1), mask.size(1) * self.num_attention_heads).bool()
-        #|mask_enc| = (bs, n, n * n_attn_head)
-
-        mask_enc = mask_enc.view(*mask_shape)
-        #|mask_enc| = (bs, n, n, n_attn_head) = (64, 100, 100, 8)
-
-        return mask_enc.permute(0, 3, 2, 1)
-        #|mask_enc| = (bs, n_attn_head, n, n)
-
     @torch.no_grad()
     def get_extended_attention_td(self, td):
         # |td| = (bs, n)
@@ -515,8 +469,11 @@ class ForgettingMonoConvBert4ktPlus(nn.Module):
         # z, _ = self.encoder(z, td_n, mask)
         # # |z| = (bs, n, hs)
 
+        # one key padding mask for all the encoder blocks and heads, a view of mask
+        mask_enc = get_extended_attention_mask(mask)
+        # |mask_enc| = (bs, 1, 1, n)
         for block in self.encoder:
-            z, _ = block(z, td, mask)
+            z, _ = block(z, td, mask_enc)
 
         y_hat = self.generator(z)
         #|y_hat| = (bs, n, output_size=1)
@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 
+from models.attention_utils import PositionCache
+
 #non-MonotonicAttnetion
 #using dual encoder and knowledge retriever
 
@@ -8,6 +10,8 @@ class MonotonicAttention(nn.Module):
 
     def __init__(self, device, dropout_p):
         super().__init__()
+        # position matrices of the distance, built once per device (see PositionCache)
+        self.position_cache = PositionCache()
 
         self.dropout = nn.Dropout(dropout_p)
         self.device = device
@@ -19,15 +23,16 @@ class MonotonicAttention(nn.Module):
     def forward(self, Q, K, V, mask=None, dk=64):
         # |Q| = (batch_size * n_splits, m, hidden_size / n_splits)
         # |K| = |V| = (batch_size * n_splits, m, hidden_size / n_splits)
-        # |mask| = (batch_size * n_splits, m, hidden_size / n_splits)
+        # |mask| = (batch_size, m, n), shared by the n_splits heads
 
         # w = attention energy
         w = torch.bmm(Q, K.transpose(1, 2))
         # |w| = (batch_size, n, n)
         if mask is not None:
-            assert w.size() == mask.size()
+            # |w| = (n_splits * batch_size, m, n) is head-major, so the (batch_size, m, n) mask is shared by the heads
+            assert w.size(1) == mask.size(1) and w.size(2) == mask.size(2)
             # mask를 -float('inf')로 만들어두니 overflow 문제 발생
-            w.masked_fill_(mask, -1e8)
+            w.view(-1, *mask.size()).masked_fill_(mask, -1e8)
 
         # distance score, no_grad()
         d = self.distance_func(w, dk)
@@ -57,12 +62,10 @@ class MonotonicAttention(nn.Module):
         score = self.softmax(w)
         #score = score * mask.float().to(device) -> 원문인데, 필요있을까?
 
-        x1 = torch.arange(w.size(2)).expand(w.size(2), -1).to(self.device)
-        x2 = x1.transpose(0, 1).contiguous()
-
         distcum_score = torch.cumsum(score, dim=-1)
         disttotal_score = torch.sum( score, dim=-1, keepdim=True)
-        position_effect = torch.abs(x1-x2)[None, :, :].type(torch.FloatTensor).to(self.device)
+        # |position_effect| = (1, n, n), cached on the device of w
+        position_effect = self.position_cache.get_position_effect(w.size(2), w.device)[0]
 
         dist_score = torch.clamp(
             (disttotal_score - distcum_score) * position_effect, min=0.
@@ -108,10 +111,8 @@ class MultiHead(nn.Module):
         # |QWs| = (batch_size * n_splits, m, hidden_size / n_splits)
         # |KWs| = |VWs| = (batch_size * n_splits, n, hidden_size / n_splits)
 
-        # 마스크도 위의 cat처럼 같은 차원으로 만들기
-        if mask is not None:
-            mask = torch.cat([mask for _ in range(self.n_splits)], dim=0)
-            # |mask| = (batch_size * n_splits, m, n)
+        # 마스크는 cat하지 않고 Attention에서 head 차원으로 broadcast함
+        # |mask| = (batch_size, m, n)
 
         c = self.attn(
             QWs, KWs, VWs,
@@ -0,0 +1,59 @@
+import torch
+
+# masks of packed windows
+# with --packing, several short learners share one window and the mask of a batch is not a bool tensor
+# but the segment id of every position: 0 is <PAD>, 1, 2, ... are the learners in the window.
+# a bool mask (not packed) is kept as it is, so the models behave exactly as before for it.
+
+def is_packed(mask):
+    return mask.dtype != torch.bool
+
+def get_positions(mask):
+    """
+    Position of every interaction for emb_p.
+    For packed windows the position restarts at 0 at the beginning of every segment.
+
+        :param mask: (torch.Tensor) |mask| = (bs, n), bool mask or segment ids
+
+        :output pos: (torch.Tensor) |pos| = (bs, n), torch.long
+    """
+    bs, n = mask.size()
+    pos = torch.arange(n, dtype=torch.long, device=mask.device).unsqueeze(0).expand(bs, n)
+
+    if not is_packed(mask):
+        return pos
+
+    # the first position of every segment, the segments are contiguous
+    seg_start = torch.ones_like(mask, dtype=torch.bool)
+    seg_start[:, 1:] = mask[:, 1:] != mask[:, :-1]
+    # |seg_start_pos| = (bs, n), where the segment of every position begins
+    seg_start_pos = torch.cummax(torch.where(seg_start, pos, torch.zeros_like(pos)), dim=1).values
+
+    return pos - seg_start_pos
+
+def get_segment_pair_mask(mask):
+    """
+    Block-diagonal attention mask of packed windows.
+
+        :param mask: (torch.Tensor) |mask| = (bs, n), segment ids, 0 is <PAD>
+
+        :output pair_mask: (torch.Tensor) |pair_mask| = (bs, n, n), True where position i can attend position j,
+            i.e. j is not <PAD> and i, j belong to the same learner
+    """
+    return (mask.unsqueeze(-1) == mask.unsqueeze(1)) & (mask != 0).unsqueeze(1)
+
+def get_extended_attention_mask(mask):
+    """
+    Attention mask of the multi-head attentions, built once in the forward of the model
+    and shared by every encoder block, head and distance function without copies.
+
+        :param mask: (torch.Tensor) |mask| = (bs, n), bool mask or segment ids
+
+        :output mask_enc: (torch.Tensor) True where query i can attend key j, torch.bool
+            |mask_enc| = (bs, 1, 1, n), a view of mask: the keys that are not <PAD>
+            |mask_enc| = (bs, 1, n, n) for packed windows: the keys of the same learner
+    """
+    if is_packed(mask):
+        return get_segment_pair_mask(mask).unsqueeze(1)
+
+    return mask.bool()[:, None, None, :]
@@ -4,6 +4,9 @@ import numpy as np
 import math
 import torch.nn.functional as F
 
+from models.mask_utils import get_positions, get_extended_attention_mask
+from models.attention_utils import PositionCache, blockwise_monotonic_attention
+
 # SeparableConv1D
 class SeparableConv1D(nn.Module):
     def __init__(self, input_filters, output_filters, kernel_size):
@@ -36,8 +39,12 @@ class SeparableConv1D(nn.Module):
 # Combined the Monotonic Attention and Span Dynamic Convolutional Attention
 class MonotonicMultiheadAttention(nn.Module):
     # hidden % n_splits == 0
-    def __init__(self, hidden_size, n_splits, dropout_p, head_ratio=2, conv_kernel_size=9):
+    def __init__(self, hidden_size, n_splits, dropout_p, head_ratio=2, conv_kernel_size=9, attn_block_size=0):
         super().__init__()
+        # 0: full (bs, n_attn_head, n, n) scores, k: k x k tiles for long histories (see blockwise_monotonic_attention)
+        self.attn_block_size = attn_block_size
+        # position matrices of the distance, built once per device (see PositionCache)
+        self.position_cache = PositionCache()
         # default: n_splits = 16, head_ratio = 2
         
         new_num_attention_heads = n_splits // head_ratio
@@ -109,41 +116,49 @@ class MonotonicMultiheadAttention(nn.Module):
         ###################
         # self_attn layer #
         ###################
-        attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        attention_scores = attention_scores / math.sqrt(self.attention_head_size)
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
-        #####################
-        # distance function # 
-        #####################
-        dist_scores = self.dist_func(attention_scores, mask)
-        # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        m = nn.Softplus()
-        # gamma is learnable decay rate parameter
-        gamma = -1.0 * m(self.gammas).unsqueeze(0)
-        # Now after do exp(gamma * distance) and then clamp to 1e-5 to 1e-5
-        total_effect = torch.clamp(
-            torch.clamp((dist_scores * gamma).exp(), min=1e-5), max=1e5
-        )
-        # |total_effect| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
-        attention_scores = attention_scores * total_effect
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+        if self.attn_block_size > 0:
+            # the same attention tile by tile, the memory is linear in n
+            gamma = -1.0 * F.softplus(self.gammas).unsqueeze(0)
+            context_layer = blockwise_monotonic_attention(
+                query_layer, key_layer, value_layer, mask, gamma, self.dropout, self.attn_block_size
+            )
+            # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
+        else:
+            attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+            attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            #####################
+            # distance function # 
+            #####################
+            dist_scores = self.dist_func(attention_scores, mask)
+            # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+            m = nn.Softplus()
+            # gamma is learnable decay rate parameter
+            gamma = -1.0 * m(self.gammas).unsqueeze(0)
+            # Now after do exp(gamma * distance) and then clamp to 1e-5 to 1e-5
+            total_effect = torch.clamp(
+                torch.clamp((dist_scores * gamma).exp(), min=1e-5), max=1e5
+            )
+            # |total_effect| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            attention_scores = attention_scores * total_effect
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+            attention_mask = mask
+            attention_scores = attention_scores.masked_fill_(attention_mask==0, -1e8)
+            # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+
+            attention_probs = nn.functional.softmax(attention_scores, dim=-1)
+            # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+            attention_probs = self.dropout(attention_probs)
+            # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+
+            context_layer = torch.matmul(attention_probs, value_layer)
+            # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
 
-        # |mask| = (bs, n)
-        attention_mask = self.get_extended_attention_mask(mask)
-        # |attention_mask| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        attention_scores = attention_scores.masked_fill_(attention_mask==0, -1e8)
-        # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
-
-        attention_probs = nn.functional.softmax(attention_scores, dim=-1)
-        # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
-        attention_probs = self.dropout(attention_probs)
-        # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
-
-        context_layer = torch.matmul(attention_probs, value_layer)
-        # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
         context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
         # |context_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         
@@ -172,10 +187,8 @@ class MonotonicMultiheadAttention(nn.Module):
         scores = attention_scores
         bs, head, seqlen = scores.size(0), scores.size(1), scores.size(2)
 
-        x1 = torch.arange(seqlen).expand(seqlen, -1)
-        x2 = x1.transpose(0, 1).contiguous()
-
-        attention_mask = self.get_extended_attention_mask(mask)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
 
         scores_ = scores.masked_fill_(attention_mask == 0, -1e32)
 
@@ -199,12 +212,8 @@ class MonotonicMultiheadAttention(nn.Module):
                     [3, 2, 1, 0, 1],
                     [4, 3, 2, 1, 0]])
         """     
-        device = distcum_scores.get_device()
-        position_effect = torch.abs(x1 - x2)[None, None, :, :].type(
-            torch.FloatTensor
-        ) 
-        # |position_effect| = (1, 1, seqlen, seqlen)
-        position_effect = position_effect.to(device)
+        # |position_effect| = (1, 1, seqlen, seqlen), cached on the device of the scores
+        position_effect = self.position_cache.get_position_effect(seqlen, distcum_scores.device)
         
         # dist_score => d(t, tau)
         dist_scores = torch.clamp(
@@ -216,21 +225,6 @@ class MonotonicMultiheadAttention(nn.Module):
         # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
         return dist_scores
 
-    # this is for attention mask
-    @torch.no_grad()
-    def get_extended_attention_mask(self, mask):
-        # |mask| = (bs, n)
-        mask_shape = mask.size() + (mask.size(1), self.num_attention_heads)
-        # mask_shape = (bs, n, n, n_attn_head)
-        mask_enc = mask.unsqueeze(-1).expand(mask.size(0), mask.size(1), mask.size(1) * self.num_attention_heads).bool()
-        # |mask_enc| = (bs, n, n * n_attn_head)
-
-        mask_enc = mask_enc.view(*mask_shape)
-        # |mask_enc| = (bs, n, n, n_attn_head), default = (64, 100, 100, 8)
-
-        return mask_enc.permute(0, 3, 2, 1)
-        # |mask_enc| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
     # for attention, last dim will be divied to n_attn_head, and get a new shape
     def transpose_for_scores(self, x):
         # |x| = (bs, n, hs/2(all_attn_h_size))
@@ -259,12 +253,13 @@ class EncoderBlock(nn.Module):
         use_leakyrelu,
         max_seq_len,
         dropout_p=.1,
+        attn_block_size=0,
     ):
         super().__init__()
 
         self.use_leakyrelu = use_leakyrelu
 
-        self.attn = MonotonicMultiheadAttention(hidden_size, n_splits, dropout_p)
+        self.attn = MonotonicMultiheadAttention(hidden_size, n_splits, dropout_p, attn_block_size=attn_block_size)
         self.attn_norm = nn.LayerNorm(hidden_size)
         self.attn_dropout = nn.Dropout(dropout_p)
 
@@ -341,6 +336,7 @@ class MonaBert4ktPlusDiff(nn.Module):
         device,
         use_leakyrelu,
         dropout_p=.1,
+        attn_block_size=0,
     ):
         self.num_q = num_q
         self.num_r = num_r + 2 # '+2' is for 1(correct), 0(incorrect), <PAD>, <MASK>
@@ -355,6 +351,7 @@ class MonaBert4ktPlusDiff(nn.Module):
         self.device = device
         self.use_leakyrelu = use_leakyrelu
         self.dropout_p = dropout_p
+        self.attn_block_size = attn_block_size
 
         super().__init__()
 
@@ -378,6 +375,7 @@ class MonaBert4ktPlusDiff(nn.Module):
                 self.use_leakyrelu,
                 self.max_seq_len,
                 dropout_p,
+                self.attn_block_size,
               ) for _ in range(num_encoder)],
         )
 
@@ -388,12 +386,11 @@ class MonaBert4ktPlusDiff(nn.Module):
         )
 
     # Learnable Positional embedding
-    def _positional_embedding(self, q):
+    def _positional_embedding(self, q, mask):
         # |q| = (bs, n)
         # |r| = (bs, n)
-        seq_len = q.size(1)
-        # seq_len = (n,)
-        pos = torch.arange(seq_len, dtype=torch.long).unsqueeze(0).expand_as(q).to(self.device)
+        # positions restart at every learner of a packed window
+        pos = get_positions(mask).to(self.device)
         # |pos| = (bs, n)
         
         pos_emb = self.emb_p(pos)
@@ -406,15 +403,17 @@ class MonaBert4ktPlusDiff(nn.Module):
         # |r| = (bs, n)
         # |mask| = (bs, n)
 
-        emb = self.emb_q(q) + self.emb_r(r) + self.emb_pid(pid) + self.emb_diff(diff) + self._positional_embedding(q)
+        emb = self.emb_q(q) + self.emb_r(r) + self.emb_pid(pid) + self.emb_diff(diff) + self._positional_embedding(q, mask)
         # |emb| = (bs, n, emb_size)
 
         z = self.emb_dropout(emb)
         # |z| = (bs, n, emb_size)
 
-        # |mask_enc| = (bs, n, n)
         # |z| = (bs, n, emb_size)
-        z, _ = self.encoder(z, mask)
+        # one key padding mask for all the encoder blocks and heads, a view of mask
+        mask_enc = get_extended_attention_mask(mask)
+        # |mask_enc| = (bs, 1, 1, n), (bs, 1, n, n) for packed windows
+        z, _ = self.encoder(z, mask_enc)
         # |z| = (bs, n, hs)
 
         y_hat = self.generator(z)
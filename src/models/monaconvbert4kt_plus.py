@@ -4,6 +4,9 @@ import numpy as np
 import math
 import torch.nn.functional as F
 
+from models.mask_utils import get_extended_attention_mask
+from models.attention_utils import PositionCache, blockwise_monotonic_attention, span_dynamic_conv
+
 # SeparableConv1D
 class SeparableConv1D(nn.Module):
     def __init__(self, input_filters, output_filters, kernel_size):
@@ -36,8 +39,12 @@ class SeparableConv1D(nn.Module):
 # Combined the Monotonic Attention and Span Dynamic Convolutional Attention
 class MonotonicConvolutionalMultiheadAttention(nn.Module):
     # hidden % n_splits == 0
-    def __init__(self, hidden_size, n_splits, dropout_p, head_ratio=2, conv_kernel_size=9):
+    def __init__(self, hidden_size, n_splits, dropout_p, head_ratio=2, conv_kernel_size=9, attn_block_size=0):
         super().__init__()
+        # 0: full (bs, n_attn_head, n, n) scores, k: k x k tiles for long histories (see blockwise_monotonic_attention)
+        self.attn_block_size = attn_block_size
+        # position matrices of the distance, built once per device (see PositionCache)
+        self.position_cache = PositionCache()
         # default: n_splits = 16, head_ratio = 2
         
         new_num_attention_heads = n_splits // head_ratio
@@ -112,77 +119,68 @@ class MonotonicConvolutionalMultiheadAttention(nn.Module):
         # |conv_attn_layer| = (bs, n, hs/2(all_attn_h_size))
         conv_kernel_layer = self.conv_kernel_layer(conv_attn_layer)
         # |conv_kernel_layer| = (bs, n, (n_attn_h * conv_kernel_size) = (64, 100, 8 * 9) = (64, 100, 72)
-        conv_kernel_layer = torch.reshape(conv_kernel_layer, [-1, self.conv_kernel_size, 1])
-        # |conv_kernel_layer| = (51200, 9, 1)
-        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=1)
-        # |conv_kernel_layer| = (51200, 9, 1), 각 head별 확률값들을 도출하는 듯
+        conv_kernel_layer = torch.reshape(conv_kernel_layer, [batch_size, -1, self.num_attention_heads, self.conv_kernel_size])
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size) = (64, 100, 8, 9)
+        conv_kernel_layer = torch.softmax(conv_kernel_layer, dim=-1)
+        # |conv_kernel_layer| = (bs, n, n_attn_head, conv_kernel_size), 각 head별 확률값들을 도출하는 듯
 
         # q X k is matmul with v
         conv_out_layer = self.conv_out_layer(V)
         # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.all_head_size])
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size))
-        conv_out_layer = conv_out_layer.transpose(1, 2).contiguous().unsqueeze(-1)
-        # |conv_out_layer| = (bs, hs/2(all_attn_h_size), n, 1)
-        # unfold 참고 -> #https://www.facebook.com/groups/PyTorchKR/posts/1685133764959631/
-        conv_out_layer = nn.functional.unfold( 
-            conv_out_layer,
-            kernel_size=[self.conv_kernel_size, 1],
-            dilation=1,
-            padding=[(self.conv_kernel_size - 1) // 2, 0],
-            stride=1,
-        )
-        # |conv_out_layer| = (64, 2304, 100)
-        conv_out_layer = conv_out_layer.transpose(1, 2).reshape(
-            batch_size, -1, self.all_head_size, self.conv_kernel_size
-        )
-        # |conv_out_layer| = (bs, n, hs/2(all_attn_h_size), conv_kernal_size)
-        conv_out_layer = torch.reshape(conv_out_layer, [-1, self.attention_head_size, self.conv_kernel_size])
-        # |conv_out_layer|, default = (51200, 32, 9)
-        # matmul(q X k, v)
-        conv_out_layer = torch.matmul(conv_out_layer, conv_kernel_layer)
-        # |conv_out_layer|, default = (51200, 32, 1)
+        conv_out_layer = torch.reshape(conv_out_layer, [batch_size, -1, self.num_attention_heads, self.attention_head_size])
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
+        # the kernel of every position over the shifted values, without unfold (see span_dynamic_conv)
+        conv_out_layer = span_dynamic_conv(conv_out_layer, conv_kernel_layer)
+        # |conv_out_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         conv_out_layer = torch.reshape(conv_out_layer, [-1, self.all_head_size])
         # |conv_out_layer|, default = (6400, 256)
 
         ###################
         # self_attn layer #
         ###################
-        attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        attention_scores = attention_scores / math.sqrt(self.attention_head_size)
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
-        #####################
-        # distance function #
-        #####################
-        dist_scores = self.dist_func(attention_scores, mask)
-        # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        m = nn.Softplus()
-        # gamma is learnable decay rate parameter
-        gamma = -1.0 * m(self.gammas).unsqueeze(0)
-        # Now after do exp(gamma * distance) and then clamp to 1e-5 to 1e-5
-        total_effect = torch.clamp(
-            torch.clamp((dist_scores * gamma).exp(), min=1e-5), max=1e5
-        )
-        # |total_effect| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
-        attention_scores = attention_scores * total_effect
-        # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
-        # |mask| = (bs, n)
-        attention_mask = self.get_extended_attention_mask(mask)
-        # |attention_mask| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-        attention_scores = attention_scores.masked_fill_(attention_mask==0, -1e8)
-        # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+        if self.attn_block_size > 0:
+            # the same attention tile by tile, the memory is linear in n
+            gamma = -1.0 * F.softplus(self.gammas).unsqueeze(0)
+            context_layer = blockwise_monotonic_attention(
+                query_layer, key_layer, value_layer, mask, gamma, self.dropout, self.attn_block_size
+            )
+            # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
+        else:
+            attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+            attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            #####################
+            # distance function #
+            #####################
+            dist_scores = self.dist_func(attention_scores, mask)
+            # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+            m = nn.Softplus()
+            # gamma is learnable decay rate parameter
+            gamma = -1.0 * m(self.gammas).unsqueeze(0)
+            # Now after do exp(gamma * distance) and then clamp to 1e-5 to 1e-5
+            total_effect = torch.clamp(
+                torch.clamp((dist_scores * gamma).exp(), min=1e-5), max=1e5
+            )
+            # |total_effect| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            attention_scores = attention_scores * total_effect
+            # |attention_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
+
+            # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+            attention_mask = mask
+            attention_scores = attention_scores.masked_fill_(attention_mask==0, -1e8)
+            # |attention_scores| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+
+            attention_probs = nn.functional.softmax(attention_scores, dim=-1)
+            # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+            attention_probs = self.dropout(attention_probs)
+            # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
+
+            context_layer = torch.matmul(attention_probs, value_layer)
+            # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
 
-        attention_probs = nn.functional.softmax(attention_scores, dim=-1)
-        # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
-        attention_probs = self.dropout(attention_probs)
-        # |attention_probs| = (bs, n_attn_head, n, n) = (64, 8, 100, 100)
-
-        context_layer = torch.matmul(attention_probs, value_layer)
-        # |context_layer| = (bs, n_attn_head, n, attn_head_size) = (64, 8, 100, 32)
         context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
         # |context_layer| = (bs, n, n_attn_head, attn_head_size) = (64, 100, 8, 32)
         
@@ -215,10 +213,8 @@ class MonotonicConvolutionalMultiheadAttention(nn.Module):
         scores = attention_scores
         bs, head, seqlen = scores.size(0), scores.size(1), scores.size(2)
 
-        x1 = torch.arange(seqlen).expand(seqlen, -1)
-        x2 = x1.transpose(0, 1).contiguous()
-
-        attention_mask = self.get_extended_attention_mask(mask)
+        # |mask| = (bs, 1, 1, n) or (bs, 1, n, n) for packed windows, see models.mask_utils.get_extended_attention_mask
+        attention_mask = mask
 
         scores_ = scores.masked_fill_(attention_mask == 0, -1e32)
 
@@ -242,12 +238,8 @@ class MonotonicConvolutionalMultiheadAttention(nn.Module):
                     [3, 2, 1, 0, 1],
                     [4, 3, 2, 1, 0]])
         """     
-        device = distcum_scores.get_device()
-        position_effect = torch.abs(x1 - x2)[None, None, :, :].type(
-            torch.FloatTensor
-        ) 
-        # |position_effect| = (1, 1, seqlen, seqlen)
-        position_effect = position_effect.to(device)
+        # |position_effect| = (1, 1, seqlen, seqlen), cached on the device of the scores
+        position_effect = self.position_cache.get_position_effect(seqlen, distcum_scores.device)
         
         # dist_score => d(t, tau)
         dist_scores = torch.clamp(
@@ -259,21 +251,6 @@ class MonotonicConvolutionalMultiheadAttention(nn.Module):
         # |dist_scores| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
         return dist_scores
 
-    # this is for attention mask
-    @torch.no_grad()
-    def get_extended_attention_mask(self, mask):
-        # |mask| = (bs, n)
-        mask_shape = mask.size() + (mask.size(1), self.num_attention_heads)
-        # mask_shape = (bs, n, n, n_attn_head)
-        mask_enc = mask.unsqueeze(-1).expand(mask.size(0), mask.size(1), mask.size(1) * self.num_attention_heads).bool()
-        # |mask_enc| = (bs, n, n * n_attn_head)
-
-        mask_enc = mask_enc.view(*mask_shape)
-        # |mask_enc| = (bs, n, n, n_attn_head), default = (64, 100, 100, 8)
-
-        return mask_enc.permute(0, 3, 2, 1)
-        # |mask_enc| = (bs, n_attn_head, n, n), default = (64, 8, 100, 100)
-
     # for attention, last dim will be divied to n_attn_head, and get a new shape
     def transpose_for_scores(self, x):
         # |x| = (bs, n, hs/2(all_attn_h_size))
@@ -302,12 +279,13 @@ class EncoderBlock(nn.Module):
         use_leakyrelu,
         max_seq_len,
         dropout_p=.1,
+        attn_block_size=0,
     ):
         super().__init__()
 
         self.use_leakyrelu = use_leakyrelu
 
-        self.attn = MonotonicConvolutionalMultiheadAttention(hidden_size, n_splits, dropout_p)
+        self.attn = MonotonicConvolutionalMultiheadAttention(hidden_size, n_splits, dropout_p, attn_block_size=attn_block_size)
         self.attn_norm = nn.LayerNorm(hidden_size)
         self.attn_dropout = nn.Dropout(dropout_p)
 
@@ -383,6 +361,7 @@ class MonaConvBert4ktPlus(nn.Module):
         device,
         use_leakyrelu,
         dropout_p=.1,
+        attn_block_size=0,
     ):
         self.num_q = num_q
         self.num_r = num_r + 2 # '+2' is for 1(correct), 0(incorrect), <PAD>, <MASK>
@@ -396,6 +375,7 @@ class MonaConvBert4ktPlus(nn.Module):
         self.device = device
         self.use_leakyrelu = use_leakyrelu
         self.dropout_p = dropout_p
+        self.attn_block_size = attn_block_size
 
         super().__init__()
 
@@ -416,6 +396,7 @@ class MonaConvBert4ktPlus(nn.Module):
                 self.use_leakyrelu,
                 self.max_seq_len,
                 dropout_p,
+                self.attn_block_size,
               ) for _ in range(num_encoder)],
         )
 
@@ -450,9 +431,11 @@ class MonaConvBert4ktPlus(nn.Module):
         z = self.emb_dropout(emb)
         # |z| = (bs, n, emb_size)
 
-        # |mask_enc| = (bs, n, n)
         # |z| = (bs, n, emb_size)
-        z, _ = self.encoder(z, mask)
+        # one key padding mask for all the encoder blocks and heads, a view of mask
+        mask_enc = get_extended_attention_mask(mask)
+        # |mask_enc| = (bs, 1, 1, n)
+        z, _ = self.encoder(z, mask_enc)
         # |z| = (bs, n, hs)
 
         y_hat = self.generator(z)
@@ -4,16 +4,76 @@
 from argparse import ArgumentParser
 import numpy as np
 import pandas as pd
-from scipy.sparse import csr_matrix
+from scipy.sparse import coo_matrix
 from scipy import sparse
 import os
+import json
+import shutil
 import pickle
-import time
 import re
+from functools import partial
+from multiprocessing import Pool
 
 # Please specify your dataset Path
 BASE_PATH = "../datasets/"
 
+
+def build_q_matrix(item_ids, skill_ids, num_items, num_skills):
+    """
+    Build the item-skill Q-matrix straight from the (item, skill) pairs, without a dense matrix.
+
+        :param item_ids: (np.ndarray) item index of every pair
+        :param skill_ids: (np.ndarray) skill index of every pair, duplicated pairs are allowed
+        :param num_items: (int) number of rows
+        :param num_skills: (int) number of columns
+
+        :output Q_mat: (csr_matrix) |Q_mat| = (num_items, num_skills), 1 where the item has the skill
+    """
+    # deduplicate the pairs as single int64 keys
+    pair_keys = np.unique(
+        np.asarray(item_ids, dtype=np.int64) * num_skills + np.asarray(skill_ids, dtype=np.int64)
+    )
+    rows, cols = pair_keys // num_skills, pair_keys % num_skills
+
+    Q_mat = coo_matrix(
+        (np.ones(len(pair_keys)), (rows, cols)), shape=(num_items, num_skills)
+    ).tocsr()
+    Q_mat.sort_indices()
+
+    return Q_mat
+
+
+def get_skill_combination_ids(Q_mat):
+    """
+    Give the same id to items that have the same set of skills.
+
+    Every sparse row is hashed by its skill indices, so memory is proportional to the non-zeros.
+    The ids are numbered in the same order as np.unique(Q_mat.toarray(), axis=0, return_inverse=True)[1].
+
+        :param Q_mat: (csr_matrix) item-skill Q-matrix with sorted indices
+
+        :output unique_skill_ids: (np.ndarray) skill combination id of every item
+    """
+    indptr, indices = Q_mat.indptr, Q_mat.indices
+
+    combo2idx = {}
+    combo_ids = np.array(
+        [
+            combo2idx.setdefault(tuple(indices[start:end]), len(combo2idx))
+            for start, end in zip(indptr[:-1], indptr[1:])
+        ],
+        dtype=np.int64,
+    )
+
+    # dense rows compare lexicographically, i.e. the row with the smallest differing skill is larger
+    # and a row is larger than its prefix, which is the tuple order on the negated indices
+    combos = sorted(combo2idx, key=lambda combo: tuple(-c for c in combo))
+    rank = np.empty(len(combos), dtype=np.int64)
+    for new_idx, combo in enumerate(combos):
+        rank[combo2idx[combo]] = new_idx
+
+    return rank[combo_ids]
+
 def prepare_assistments(
     data_name: str, min_user_inter_num: int, remove_nan_skills: bool
 ):
@@ -84,9 +144,9 @@ def prepare_assistments(
         pickle.dump(dict(zip(df["skill_id"], df["skill_name"])), f)
 
     # Build Q-matrix
-    Q_mat = np.zeros((len(df["item_id"].unique()), len(df["skill_id"].unique())))
-    for item_id, skill_id in df[["item_id", "skill_id"]].values:
-        Q_mat[item_id, skill_id] = 1
+    Q_mat = build_q_matrix(
+        df["item_id"].values, df["skill_id"].values, df["item_id"].nunique(), df["skill_id"].nunique()
+    )
 
     # Remove row duplicates due to multiple skills for one item
     if data_name == "assistments09":
@@ -100,7 +160,7 @@ def prepare_assistments(
     print("# Interactions: {}".format(len(df)))
 
     # Get unique skill id from combination of all skill ids
-    unique_skill_ids = np.unique(Q_mat, axis=0, return_inverse=True)[1]
+    unique_skill_ids = get_skill_combination_ids(Q_mat)
     df["skill_id"] = unique_skill_ids[df["item_id"]]
 
     print("# Preprocessed Skills: {}".format(df["skill_id"].nunique()))
@@ -121,9 +181,9 @@ def prepare_assistments(
 
     # Save data
     with open(os.path.join(data_path, "question_skill_rel.pkl"), "wb") as f:
-        pickle.dump(csr_matrix(Q_mat), f)
+        pickle.dump(Q_mat, f)
 
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
     df.to_csv(os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False)
 
 
@@ -182,7 +242,7 @@ def prepare_kddcup10(
     for kc_str in df[kc_col_name].unique():
         for kc in kc_str.split("~~"):
             kc_list.append(kc)
-    kc_set = set(kc_list)
+    kc_set = sorted(set(kc_list))
     kc2idx = {kc: i for i, kc in enumerate(kc_set)}
 
     df["user_id"] = np.unique(df["user_id"], return_inverse=True)[1]
@@ -193,14 +253,15 @@ def prepare_kddcup10(
     print("# Items: {}".format(df["item_id"].nunique()))
     print("# Interactions: {}".format(len(df)))
 
-    # Build Q-matrix
-    Q_mat = np.zeros((len(df["item_id"].unique()), len(kc_set)))
-    for item_id, kc_str in df[["item_id", kc_col_name]].values:
-        for kc in kc_str.split("~~"):
-            Q_mat[item_id, kc2idx[kc]] = 1
+    # Build Q-matrix from the unique (item, KC) pairs
+    item_kc_df = df[["item_id", kc_col_name]].drop_duplicates()
+    item_kc_df = item_kc_df.assign(kc=item_kc_df[kc_col_name].str.split("~~")).explode("kc")
+    Q_mat = build_q_matrix(
+        item_kc_df["item_id"].values, item_kc_df["kc"].map(kc2idx).values, df["item_id"].nunique(), len(kc_set)
+    )
 
     # Get unique skill id from combination of all skill ids
-    unique_skill_ids = np.unique(Q_mat, axis=0, return_inverse=True)[1]
+    unique_skill_ids = get_skill_combination_ids(Q_mat)
     df["skill_id"] = unique_skill_ids[df["item_id"]]
 
     print("# Preprocessed Skills: {}".format(df["skill_id"].nunique()))
@@ -217,9 +278,9 @@ def prepare_kddcup10(
 
     # Save data
     with open(os.path.join(data_path, "question_skill_rel.pkl"), "wb") as f:
-        pickle.dump(csr_matrix(Q_mat), f)
+        pickle.dump(Q_mat, f)
 
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
     df.to_csv(os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False)
 
 
@@ -235,12 +296,12 @@ def prepare_statics():
     print("# Interactions: {}".format(len(df)))
 
     # Build Q-matrix
-    Q_mat = np.zeros((len(df["item_id"].unique()), len(df["skill_id"].unique())))
     print(df["item_id"].min())  # --> 1
-    for item_id, skill_id in df[["item_id", "skill_id"]].values:
-        Q_mat[item_id, skill_id] = 1
+    Q_mat = build_q_matrix(
+        df["item_id"].values, df["skill_id"].values, df["item_id"].nunique(), df["skill_id"].nunique()
+    )
 
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
     df.to_csv(os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False)
 
 
@@ -270,79 +331,79 @@ def prepare_spanish():
     df.reset_index(inplace=True, drop=True)
 
     # Build Q-matrix
-    Q_mat = np.zeros((len(df["item_id"].unique()), len(df["skill_id"].unique())))
-    for item_id, skill_id in df[["item_id", "skill_id"]].values:
-        Q_mat[item_id, skill_id] = 1
+    Q_mat = build_q_matrix(
+        df["item_id"].values, df["skill_id"].values, df["item_id"].nunique(), df["skill_id"].nunique()
+    )
 
     # Sort data by users, preserving temporal order for each user
     df = pd.concat([u_df for _, u_df in df.groupby("user_id")])
 
     # Save data
     with open(os.path.join(data_path, "question_skill_rel.pkl"), "wb") as f:
-        pickle.dump(csr_matrix(Q_mat), f)
+        pickle.dump(Q_mat, f)
 
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
     df.to_csv(os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False)
 
 
-def prepare_slepemapy(min_user_inter_num):
+def build_slepemapy_df(data_path, min_user_inter_num, seed, max_user_num=None):
     """
+    Read answer.csv of Slepemapy and build the shuffled interaction log.
+
     This is forked from:
     https://github.com/THUwangcy/HawkesKT/blob/main/data/Preprocess.ipynb
-    """
 
-    data_path = os.path.join(BASE_PATH, "slepemapy")
+        :param data_path: (str) directory of answer.csv
+        :param min_user_inter_num: (int) Users whose number of interactions is less than min_user_inter_num will be removed
+        :param seed: (int) seed of the user shuffle
+        :param max_user_num: (int) if given, only the first max_user_num users after the shuffle are kept
+
+        :output user_wise_df_cz: (pd.DataFrame) users in shuffled order, each user sorted by timestamp
+    """
     data_df_cz = pd.read_csv(os.path.join(data_path, "answer.csv"), sep=";")
 
     # 1. place_answered is NaN
     print("raw data:", len(data_df_cz))
-    filter_df_cz = data_df_cz[~data_df_cz["place_answered"].isna()]
+    filter_df_cz = data_df_cz[~data_df_cz["place_answered"].isna()].rename(columns={"user": "user_id"})
     print("drop nan:", len(filter_df_cz))
 
     # 2. define skill, problem, label
-    filter_df_cz.rename(columns={"user": "user_id"}, inplace=True)
-    filter_df_cz["correct"] = data_df_cz["place_asked"].astype(float) == data_df_cz[
+    filter_df_cz["correct"] = filter_df_cz["place_asked"].astype(float) == filter_df_cz[
         "place_answered"
     ].astype(float)
-    filter_df_cz["dwell_time"] = filter_df_cz["response_time"].apply(
-        lambda t: t / 1000.0
-    )
-    filter_df_cz["timestamp"] = filter_df_cz["inserted"].apply(
-        lambda t: time.mktime(time.strptime(t, "%Y-%m-%d %H:%M:%S"))
-    )
+    filter_df_cz["dwell_time"] = filter_df_cz["response_time"] / 1000.0
+    # seconds since the epoch, parsed in one vectorized pass
+    filter_df_cz["timestamp"] = (
+        pd.to_datetime(filter_df_cz["inserted"], format="%Y-%m-%d %H:%M:%S") - pd.Timestamp(0)
+    ) // pd.Timedelta(seconds=1)
     filter_df_cz["skill_id"] = filter_df_cz["place_asked"] - 1
     filter_df_cz["problem_id"] = filter_df_cz["skill_id"] * 2 + filter_df_cz["type"] - 1
 
     # 3. sequence length is not in a proper range
-    user_wise_lst = list()
-    for user, user_df in filter_df_cz.groupby("user_id"):
-        if len(user_df) >= min_user_inter_num:
-            df = user_df.sort_values(by=["timestamp"])  # assure the sequence order
-            user_wise_lst.append(df)
-
-    # 4. shuffle
-    np.random.shuffle(user_wise_lst)
-    user_wise_df_cz = pd.concat(user_wise_lst).reset_index(drop=True)
+    user_size = filter_df_cz.groupby("user_id")["user_id"].transform("size")
+    filter_df_cz = filter_df_cz[user_size.values >= min_user_inter_num]
+
+    # 4. shuffle the users with a fixed seed, then one stable sort by (shuffled user, timestamp)
+    user_list, user_idx = np.unique(filter_df_cz["user_id"].values, return_inverse=True)
+    user_rank = np.random.default_rng(seed).permutation(len(user_list))[user_idx]
+    if max_user_num is not None:
+        filter_df_cz, user_rank = filter_df_cz[user_rank < max_user_num], user_rank[user_rank < max_user_num]
+    order = np.lexsort((filter_df_cz["timestamp"].values, user_rank))
+
+    user_wise_df_cz = filter_df_cz.iloc[order].reset_index(drop=True)
     user_wise_df_cz = user_wise_df_cz[
         ["user_id", "skill_id", "problem_id", "dwell_time", "timestamp", "correct"]
     ]
     print("drop < {}:".format(min_user_inter_num), len(user_wise_df_cz))
-    user_wise_df_cz.head()
 
-    # user re-index
-    user_ids = list(user_wise_df_cz["user_id"].unique())
-    user_dict = dict(zip(user_ids, range(1, len(user_ids) + 1)))
-    user_wise_df_cz["user_id"] = user_wise_df_cz["user_id"].apply(
-        lambda x: user_dict[x]
-    )
-    user_wise_df_cz.head()
+    # user re-index, in the shuffled order starting from 1
+    user_wise_df_cz["user_id"] = user_rank[order] + 1
 
     # Adujust dtypes
     user_wise_df_cz = user_wise_df_cz.astype(
         {"correct": np.float64, "dwell_time": np.float64, "timestamp": np.float64}
     )
-    user_wise_df_cz.dtypes
-    user_wise_df_cz.rename(columns={"problem_id": "item_id"}, inplace=True)
+    user_wise_df_cz = user_wise_df_cz.rename(columns={"problem_id": "item_id"})
 
     # item, skill re-index
     user_wise_df_cz["item_id"] = np.unique(
@@ -352,101 +413,177 @@ def prepare_slepemapy(min_user_inter_num):
         user_wise_df_cz["skill_id"], return_inverse=True
     )[1]
 
+    return user_wise_df_cz
+
+
+def prepare_slepemapy(min_user_inter_num, seed=0):
+    """
+    Preprocess Slepemapy dataset
+
+        :param min_user_inter_num: (int) Users whose number of interactions is less than min_user_inter_num will be removed
+        :param seed: (int) seed of the user shuffle
+    """
+    data_path = os.path.join(BASE_PATH, "slepemapy")
+    user_wise_df_cz = build_slepemapy_df(data_path, min_user_inter_num, seed)
+
     # Build Q-matrix
-    Q_mat = np.zeros(
-        (user_wise_df_cz["item_id"].nunique(), user_wise_df_cz["skill_id"].nunique())
+    Q_mat = build_q_matrix(
+        user_wise_df_cz["item_id"].values,
+        user_wise_df_cz["skill_id"].values,
+        user_wise_df_cz["item_id"].nunique(),
+        user_wise_df_cz["skill_id"].nunique(),
     )
-    for item_id, skill_id in user_wise_df_cz[["item_id", "skill_id"]].values:
-        Q_mat[item_id, skill_id] = 1
 
     # Save
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
     user_wise_df_cz.to_csv(
         os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False
     )
 
 
-def prepare_sampled_slepemapy(min_user_inter_num):
+def prepare_sampled_slepemapy(min_user_inter_num, seed=0):
     """
-    This is forked from:
-    https://github.com/THUwangcy/HawkesKT/blob/main/data/Preprocess.ipynb
+    Preprocess Slepemapy dataset with 5000 sampled students
+
+        :param min_user_inter_num: (int) Users whose number of interactions is less than min_user_inter_num will be removed
+        :param seed: (int) seed of the user shuffle, which also decides the sampled students
     """
     data_path = os.path.join(BASE_PATH, "sampled_slepemapy")
-    data_df_cz = pd.read_csv(os.path.join(data_path, "answer.csv"), sep=";")
-
-    # 1. place_answered is NaN
-    print("raw data:", len(data_df_cz))
-    filter_df_cz = data_df_cz[~data_df_cz["place_answered"].isna()]
-    print("drop nan:", len(filter_df_cz))
+    user_wise_df_cz = build_slepemapy_df(data_path, min_user_inter_num, seed, max_user_num=5000)  # sample 5000 students
 
-    # 2. define skill, problem, label
-    filter_df_cz.rename(columns={"user": "user_id"}, inplace=True)
-    filter_df_cz["correct"] = data_df_cz["place_asked"].astype(float) == data_df_cz[
-        "place_answered"
-    ].astype(float)
-    filter_df_cz["dwell_time"] = filter_df_cz["response_time"].apply(
-        lambda t: t / 1000.0
+    # Build Q-matrix
+    Q_mat = build_q_matrix(
+        user_wise_df_cz["item_id"].values,
+        user_wise_df_cz["skill_id"].values,
+        user_wise_df_cz["item_id"].nunique(),
+        user_wise_df_cz["skill_id"].nunique(),
     )
-    filter_df_cz["timestamp"] = filter_df_cz["inserted"].apply(
-        lambda t: time.mktime(time.strptime(t, "%Y-%m-%d %H:%M:%S"))
+
+    # Save
+    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), Q_mat)
+    user_wise_df_cz.to_csv(
+        os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False
     )
-    filter_df_cz["skill_id"] = filter_df_cz["place_asked"] - 1
-    filter_df_cz["problem_id"] = filter_df_cz["skill_id"] * 2 + filter_df_cz["type"] - 1
 
-    # 3. sequence length is not in a proper range
-    user_wise_lst = list()
-    for user, user_df in filter_df_cz.groupby("user_id"):
-        if len(user_df) >= min_user_inter_num:
-            df = user_df.sort_values(by=["timestamp"])  # assure the sequence order
-            user_wise_lst.append(df)
-
-    # 4. shuffle
-    np.random.shuffle(user_wise_lst)
-    user_wise_lst = user_wise_lst[:5000]  # sample 5000 students
-    user_wise_df_cz = pd.concat(user_wise_lst).reset_index(drop=True)
-    user_wise_df_cz = user_wise_df_cz[
-        ["user_id", "skill_id", "problem_id", "dwell_time", "timestamp", "correct"]
-    ]
-    print("drop < {}:".format(min_user_inter_num), len(user_wise_df_cz))
-    user_wise_df_cz.head()
 
-    # user re-index
-    user_ids = list(user_wise_df_cz["user_id"].unique())
-    user_dict = dict(zip(user_ids, range(1, len(user_ids) + 1)))
-    user_wise_df_cz["user_id"] = user_wise_df_cz["user_id"].apply(
-        lambda x: user_dict[x]
-    )
-    user_wise_df_cz.head()
+# columns of the ednet interaction store and their dtypes
+EDNET_COLUMNS = {
+    "user_id": np.int64,
+    "question_id": np.int64,
+    "timestamp": np.int64,
+    "correct": np.int8,
+    "tag_idx": np.int32,
+}
 
-    # Adujust dtypes
-    user_wise_df_cz = user_wise_df_cz.astype(
-        {"correct": np.float64, "dwell_time": np.float64, "timestamp": np.float64}
-    )
-    user_wise_df_cz.dtypes
-    user_wise_df_cz.rename(columns={"problem_id": "item_id"}, inplace=True)
 
-    # item, skill re-index
-    user_wise_df_cz["item_id"] = np.unique(
-        user_wise_df_cz["item_id"], return_inverse=True
-    )[1]
-    user_wise_df_cz["skill_id"] = np.unique(
-        user_wise_df_cz["skill_id"], return_inverse=True
-    )[1]
+def read_ednet_user(file_path, min_user_inter_num):
+    """
+    Read one KT1 user file, this runs in the worker processes of prepare_ednet.
 
-    # Build Q-matrix
-    Q_mat = np.zeros(
-        (user_wise_df_cz["item_id"].nunique(), user_wise_df_cz["skill_id"].nunique())
-    )
-    for item_id, skill_id in user_wise_df_cz[["item_id", "skill_id"]].values:
-        Q_mat[item_id, skill_id] = 1
+        :param file_path: (str) path of the user file, e.g. ../../data/KT1/u123.csv
+        :param min_user_inter_num: (int) users with fewer interactions are skipped
 
-    # Save
-    sparse.save_npz(os.path.join(data_path, "q_mat.npz"), csr_matrix(Q_mat))
-    user_wise_df_cz.to_csv(
-        os.path.join(data_path, "preprocessed_df.csv"), sep="\t", index=False
+        :output user_df: (pd.DataFrame) interactions of the user sorted by timestamp, None if the user is skipped
+    """
+    user_df = pd.read_csv(file_path, usecols=["timestamp", "question_id", "user_answer"])
+    if len(user_df) < min_user_inter_num:
+        return None
+
+    user_df["user_id"] = int(re.sub(r"[^0-9]", "", os.path.basename(file_path)))
+    # Sort data temporally
+    user_df.sort_values(by="timestamp", kind="stable", inplace=True)
+
+    return user_df
+
+
+def ingest_ednet(folder, question_df, store_path, max_user_num, min_user_inter_num, num_workers, batch_size=1024):
+    """
+    Parse the KT1 user files in a process pool and stream them into a columnar store.
+
+    Files are read in batches of batch_size users, so only one batch is in memory at a time.
+    Each batch is attached to the answers and tags of question_df with one hashed merge,
+    and every column is appended to its own flat binary file under store_path.
+    Users are taken in the order of os.listdir, like the sequential version.
+    """
+    # question_id -> (correct_answer, row of the question in question_df)
+    answer_df = pd.DataFrame(
+        {
+            "question_id": question_df["question_id"].values,
+            "correct_answer": question_df["correct_answer"].values,
+            "tag_idx": np.arange(len(question_df), dtype=np.int32),
+        }
     )
 
-def prepare_ednet(max_user_num, min_user_inter_num,  remove_nan_skills) :
+    tmp_path = store_path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    col_files = {col: open(os.path.join(tmp_path, col + ".bin"), "wb") for col in EDNET_COLUMNS}
+
+    files = os.listdir(folder)
+    read_user = partial(read_ednet_user, min_user_inter_num=min_user_inter_num)
+
+    user_num = 0
+    inter_num = 0
+    with Pool(num_workers) as pool:
+        for start in range(0, len(files), batch_size):
+            file_paths = [os.path.join(folder, f) for f in files[start:start + batch_size]]
+            user_dfs = [u for u in pool.map(read_user, file_paths, chunksize=16) if u is not None]
+            user_dfs = user_dfs[:max_user_num - user_num]
+            if len(user_dfs) == 0:
+                continue
+
+            batch_df = pd.concat(user_dfs, ignore_index=True)
+            batch_df = batch_df.merge(answer_df, on="question_id", how="left", validate="many_to_one")
+            batch_df["correct"] = (batch_df["correct_answer"] == batch_df["user_answer"]).astype(np.int8)
+            # questions missing in questions.csv have no tags
+            batch_df["tag_idx"] = batch_df["tag_idx"].fillna(-1)
+            batch_df["question_id"] = batch_df["question_id"].str[1:].astype(np.int64)
+
+            for col, dtype in EDNET_COLUMNS.items():
+                batch_df[col].values.astype(dtype).tofile(col_files[col])
+
+            user_num += len(user_dfs)
+            inter_num += len(batch_df)
+            print("{} users, {} interactions".format(user_num, inter_num))
+
+            if user_num >= max_user_num:
+                break
+
+    for f in col_files.values():
+        f.close()
+
+    # the store is complete only once it is renamed
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "columns": {col: np.dtype(dtype).name for col, dtype in EDNET_COLUMNS.items()},
+                "max_user_num": max_user_num,
+                "min_user_inter_num": min_user_inter_num,
+            },
+            f,
+        )
+    if os.path.exists(store_path):
+        shutil.rmtree(store_path)
+    os.replace(tmp_path, store_path)
+
+
+def load_ednet_store(store_path):
+    """
+    Open the columnar store written by ingest_ednet.
+
+    Every column is memory-mapped, so only the rows that are indexed are read from disk.
+
+        :output cols: (dict of np.memmap) |col| = (num_interactions,)
+    """
+    with open(os.path.join(store_path, "meta.json")) as f:
+        meta = json.load(f)
+
+    return {
+        col: np.memmap(os.path.join(store_path, col + ".bin"), dtype=dtype, mode="r")
+        for col, dtype in meta["columns"].items()
+    }
+
+
+def prepare_ednet(max_user_num, min_user_inter_num, remove_nan_skills, num_workers=None):
     DATASET_DIR = "../../data/KT1"
     data_path = os.path.join(BASE_PATH, "ednet")
     question_df = pd.read_csv("../../data/contents/questions.csv")
@@ -454,71 +591,47 @@ def prepare_ednet(max_user_num, min_user_inter_num,  remove_nan_skills) :
     if max_user_num > 784309 : 
         raise Exception("maximum user number cannot exceed 784,309.")
 
-    folder = DATASET_DIR
-    files = os.listdir(folder)
-
-    df = None
-    cnt_num = 1
+    # the store only holds the users of these parameters, so each of them gets its own store
+    store_path = os.path.join(data_path, "interactions_u{}_min{}".format(max_user_num, min_user_inter_num))
+    if not os.path.isfile(os.path.join(store_path, "meta.json")) :
+        ingest_ednet(
+            DATASET_DIR,
+            question_df,
+            store_path,
+            max_user_num=max_user_num,
+            min_user_inter_num=min_user_inter_num,
+            num_workers=num_workers or os.cpu_count(),
+        )
 
-    if not os.path.isfile(os.path.join(data_path, "temp.csv")) :
-        for f in files:
-            if cnt_num > max_user_num:
-                break
+    cols = load_ednet_store(store_path)
 
-            user_df = pd.read_csv(os.path.join(folder,f))
-            if len(user_df) < min_user_inter_num:
-                continue
-            
-            print(cnt_num,"\t",f)
-            cnt_num += 1
-            user_df['user_id'] = re.sub(r'[^0-9]', '', f)
-
-            correct_ans = []
-            tags = []
-            for i in range(len(user_df)):
-                tmp_ans = question_df[question_df['question_id'] == user_df['question_id'][i]]['correct_answer'].values[0]
-                tmp_tags = question_df[question_df['question_id'] == user_df['question_id'][i]]['tags'].values[0]
-                correct_ans.append(tmp_ans)
-                tags.append(tmp_tags)
-            user_df['correct_answer'] = correct_ans
-            user_df['tags'] = tags
-
-            correct = []
-            for i in range(len(user_df)):
-                tmp = int(user_df['correct_answer'][i] == user_df['user_answer'][i])
-                correct.append(tmp)
-            user_df['correct'] = correct
-            # Sort data temporally
-            user_df.sort_values(by="timestamp", inplace=True)
-
-            if cnt_num == 1 : 
-                df = user_df
-            else :
-                df = pd.concat([df, user_df], axis = 0) 
-
-        df.to_csv(
-            os.path.join(data_path, "temp.csv"), sep="\t", index=False
-        )
-    
-    else : 
-        df = pd.read_csv(os.path.join(data_path, "temp.csv"), sep="\t")
+    # tags are kept as codes into the unique tag strings instead of one string per interaction,
+    # the questions missing in questions.csv get the tag "-1"
+    tag_list, question_tag_codes = np.unique(
+        np.append(question_df["tags"].values.astype(str), "-1"), return_inverse=True
+    )
+    tag_idx = np.asarray(cols["tag_idx"])
+    tag_codes = question_tag_codes[tag_idx]  # tag_idx -1 is the appended "-1"
+    tags = pd.Categorical.from_codes(tag_codes, categories=tag_list)
 
-    # convert qustion_id to int    
-    df['question_id'] = df['question_id'].str[1:].astype(int)
-    df = df.reset_index(drop=True)
-    # print(df)
+    keep = slice(None)
     if remove_nan_skills :    
-        print('original log number: ', len(df))
-        df.drop(index=df[df['tags']=='-1'].index, inplace=True)
-        print('remove non-skill, log number: ', len(df))
-        df = df.reset_index(drop=True)
+        print('original log number: ', len(tags))
+        keep = np.flatnonzero(tag_list[tag_codes] != '-1')
+        print('remove non-skill, log number: ', len(keep))
+
+    # only the kept rows of the store are read
+    df = pd.DataFrame(
+        {col: np.asarray(cols[col][keep]) for col in ["user_id", "question_id", "timestamp", "correct"]}
+    )
+    df["tags"] = tags[keep]
 
     # Extract KCs
     kc_list = []
     for kc_str in df["tags"].unique():
         for kc in kc_str.split(";"):
             kc_list.append(kc)
-    kc_set = set(kc_list)
+    kc_set = sorted(set(kc_list))
     kc2idx = {kc: i for i, kc in enumerate(kc_set)}
 
     # question mapping
@@ -527,18 +640,16 @@ def prepare_ednet(max_user_num, min_user_inter_num,  remove_nan_skills) :
         q_list.append(qid)
     q2idx = {q: i for i, q in enumerate(q_list)}
 
-    # Build Q-matrix
-    Q_mat = np.zeros((len(df["question_id"].unique()), len(kc_set)))
-    for item_id, kc_str in df[["question_id", "tags"]].values:
-        for kc in kc_str.split(";"):
-            Q_mat[q2idx[item_id], kc2idx[kc]] = 1
+    # Build Q-matrix from the unique (question, KC) pairs
+    q_kc_df = df[["question_id", "tags"]].drop_duplicates()
+    q_kc_df = q_kc_df.assign(kc=q_kc_df["tags"].str.split(";")).explode("kc")
+    Q_mat = build_q_matrix(
+        q_kc_df["question_id"].map(q2idx).values, q_kc_df["kc"].map(kc2idx).values, len(q_list), len(kc_set)
+    )
 
     # Get unique skill id from combination of all skill ids
-    unique_skill_ids = np.unique(Q_mat, axis=0, return_inverse=True)[1]
-    df['skill_id'] = df['tags']
-    # df["skill_id"] = unique_skill_ids[df["question_id"]]
-    for i in range(len(df)) : 
-        df["skill_id"][i] = unique_skill_ids[q2idx[df["question_id"][i]]]
+    unique_skill_ids = get_skill_combination_ids(Q_mat)
+    df["skill_id"] = unique_skill_ids[df["question_id"].map(q2idx).values]
 
     print("# Preprocessed Skills: {}".format(df["skill_id"].nunique()))
 
@@ -554,6 +665,8 @@ if __name__ == "__main__":
     parser.add_argument("--max_user_num", type=int, default=5000)     #default=784309
     parser.add_argument("--min_user_inter_num", type=int, default=5)
     parser.add_argument("--remove_nan_skills", default=True, action="store_true")
+    parser.add_argument("--seed", type=int, default=0)    # seed of the user shuffle of slepemapy
+    parser.add_argument("--num_workers", type=int, default=None)    # processes for reading ednet user files, default: all cpus
     args = parser.parse_args()
 
     if args.data_name in [
@@ -584,9 +697,9 @@ if __name__ == "__main__":
     elif args.data_name == "spanish":
         prepare_spanish()
     elif args.data_name == "slepemapy":
-        prepare_slepemapy(args.min_user_inter_num)
+        prepare_slepemapy(args.min_user_inter_num, seed=args.seed)
     elif args.data_name == "sampled_slepemapy":
-        prepare_sampled_slepemapy(args.min_user_inter_num)
+        prepare_sampled_slepemapy(args.min_user_inter_num, seed=args.seed)
     elif args.data_name == "statics":
         prepare_statics()
     elif args.data_name == "ednet" :
@@ -594,4 +707,5 @@ if __name__ == "__main__":
             max_user_num=args.max_user_num,
             min_user_inter_num=args.min_user_inter_num,
             remove_nan_skills=args.remove_nan_skills,
+            num_workers=args.num_workers,
         )
@@ -0,0 +1,74 @@
+import os
+import sys
+import types
+import inspect
+
+import pytest
+import torch
+
+# the modules of the repo are imported from src, like train.py is run
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from get_modules.get_models import get_models
+
+NUM_Q, NUM_PID, NUM_DIFF = 30, 50, 10
+
+def get_config(model_name, **kwargs):
+    """
+    A small config with the arguments get_models reads, dropout is off so two runs can be compared.
+    """
+    config = dict(
+        model_name=model_name,
+        hidden_size=32,
+        output_size=1,
+        num_head=4,
+        num_encoder=2,
+        max_seq_len=24,
+        use_leakyrelu=True,
+        dropout_p=0.0,
+        attn_backend="bmm",
+        attn_block_size=0,
+        num_random_blocks=3,
+        block_size=4,
+    )
+    config.update(kwargs)
+
+    return types.SimpleNamespace(**config)
+
+@pytest.fixture
+def build_model():
+    def build(model_name, seed=0, **kwargs):
+        torch.manual_seed(seed)
+        model = get_models(NUM_Q, 2, NUM_PID, NUM_DIFF, torch.device("cpu"), get_config(model_name, **kwargs))
+
+        return model.eval()
+
+    return build
+
+@pytest.fixture
+def run_model():
+    def run(model, fields, mask):
+        """
+        :param fields: (dict of torch.Tensor) q, r, pid, diff, pt of the batch, only those the model takes are given
+        """
+        names = list(inspect.signature(model.forward).parameters)
+
+        return model(*[mask if name == "mask" else fields[name] for name in names])
+
+    return run
+
+@pytest.fixture
+def fields():
+    def make(bs, n, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+
+        return {
+            "q": torch.randint(0, NUM_Q, (bs, n), generator=generator),
+            "r": torch.randint(0, 2, (bs, n), generator=generator),
+            "pid": torch.randint(0, NUM_PID, (bs, n), generator=generator),
+            "diff": torch.randint(0, NUM_DIFF, (bs, n), generator=generator),
+            # number of past trials, see pid_diff_pt_collate_fn
+            "pt": torch.randint(0, 10, (bs, n), generator=generator),
+        }
+
+    return make
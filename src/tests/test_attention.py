@@ -0,0 +1,72 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from get_modules.get_models import MODELS
+from models.attention_utils import span_dynamic_conv
+
+SDPA_MODELS = [name for name in MODELS.names() if "attn_backend" in MODELS.get_meta(name)["extra_args"]]
+BLOCKWISE_MODELS = [name for name in MODELS.names() if "attn_block_size" in MODELS.get_meta(name)["extra_args"]]
+
+def get_masks(model_name, bs, n):
+    # windows padded at the end, and packed windows for the models that take them
+    lens = torch.linspace(3, n, bs).long()
+    masks = [torch.arange(n)[None, :] < lens[:, None]]
+
+    if MODELS.get_meta(model_name).get("packing", False):
+        segment_ids = torch.zeros(bs, n, dtype=torch.long)
+        segment_ids[:, :n // 3] = 1
+        segment_ids[:, n // 3:n - 2] = 2
+        masks.append(segment_ids)
+
+    return masks
+
+def assert_same_outputs_and_grads(model_a, model_b, run_model, batch, mask):
+    y_a = run_model(model_a, batch, mask)
+    y_b = run_model(model_b, batch, mask)
+    y_a.sum().backward()
+    y_b.sum().backward()
+
+    torch.testing.assert_close(y_b, y_a, rtol=1e-4, atol=1e-5)
+    for (name, param_a), param_b in zip(model_a.named_parameters(), model_b.parameters()):
+        if param_a.grad is not None:
+            torch.testing.assert_close(param_b.grad, param_a.grad, rtol=1e-4, atol=1e-5, msg=name)
+
+@pytest.mark.parametrize("model_name", SDPA_MODELS)
+def test_sdpa_matches_bmm(model_name, build_model, run_model, fields):
+    batch = fields(4, 24)
+
+    for mask in get_masks(model_name, 4, 24):
+        model_bmm = build_model(model_name, attn_backend="bmm")
+        model_sdpa = build_model(model_name, attn_backend="sdpa")
+
+        assert_same_outputs_and_grads(model_bmm, model_sdpa, run_model, batch, mask)
+
+@pytest.mark.parametrize("model_name", BLOCKWISE_MODELS)
+def test_blockwise_matches_full(model_name, build_model, run_model, fields):
+    batch = fields(4, 24)
+
+    for mask in get_masks(model_name, 4, 24):
+        # 24 positions in query tiles of 8, the gradients go through the checkpointed tiles
+        model_full = build_model(model_name, attn_block_size=0).train()
+        model_blockwise = build_model(model_name, attn_block_size=8).train()
+
+        assert_same_outputs_and_grads(model_full, model_blockwise, run_model, batch, mask)
+
+def test_span_dynamic_conv_matches_unfold():
+    bs, n, n_heads, head_size, kernel_size = 2, 11, 3, 4, 5
+    generator = torch.Generator().manual_seed(0)
+    value = torch.randn(bs, n, n_heads, head_size, generator=generator)
+    kernel = torch.softmax(torch.randn(bs, n, n_heads, kernel_size, generator=generator), dim=-1)
+
+    # the unfold of the ConvBERT attentions, one (kernel_size, 1) patch of the values for every position
+    unfolded = F.unfold(
+        value.reshape(bs, n, -1).transpose(1, 2).unsqueeze(-1),
+        kernel_size=[kernel_size, 1],
+        padding=[(kernel_size - 1) // 2, 0],
+    )
+    # |unfolded| = (bs, n_heads * head_size * kernel_size, n)
+    unfolded = unfolded.transpose(1, 2).reshape(bs, n, n_heads, head_size, kernel_size)
+    expected = (unfolded * kernel.unsqueeze(3)).sum(-1)
+
+    torch.testing.assert_close(span_dynamic_conv(value, kernel), expected)
@@ -0,0 +1,45 @@
+import inspect
+
+import numpy as np
+
+import pytest
+import torch
+
+from get_modules.get_models import MODELS
+from trainers.eval_utils import AllPositionsEvaluator, get_prefix_batches
+
+TRIMMED_MODELS = [name for name in MODELS.names() if MODELS.get_meta(name).get("packing", False)]
+
+def get_loader(model, fields, lens, n):
+    # one batch of windows in the order of the collate: q, r, the other fields the model takes, mask
+    names = [name for name in inspect.signature(model.forward).parameters if name not in ("q", "r", "mask")]
+    mask = torch.arange(n)[None, :] < torch.tensor(lens)[:, None]
+
+    return [(fields["q"] * mask, fields["r"] * mask, *[fields[name] * mask for name in names], mask)]
+
+@pytest.mark.parametrize("model_name", TRIMMED_MODELS)
+def test_trim_is_exact(model_name, build_model, fields):
+    # evaluate_all_positions trims the batches of these models, the predictions must not change
+    model = build_model(model_name)
+    loader = get_loader(model, fields(3, 24), [24, 13, 5], 24)
+
+    y_trimmed = AllPositionsEvaluator(model, torch.device("cpu"), batch_tokens=64, trim=True).evaluate(loader)
+    y_full = AllPositionsEvaluator(model, torch.device("cpu"), batch_tokens=64, trim=False).evaluate(loader)
+
+    assert len(y_trimmed) == 24 + 13 + 5
+    torch.testing.assert_close(torch.tensor(y_trimmed["y_score"].values), torch.tensor(y_full["y_score"].values))
+
+@pytest.mark.parametrize("trim", [True, False])
+def test_prefix_batches_stay_within_batch_tokens(trim):
+    n, batch_tokens = 100, 250
+    lens = np.random.default_rng(0).integers(1, n + 1, size=40)
+    row_len = None if trim else n
+    batches = get_prefix_batches(lens, batch_tokens, row_len)
+
+    for w_idx, t_idx in batches:
+        # the rows are as long as the longest prefix of the batch, or n if they are not trimmed
+        width = int(t_idx.max()) + 1 if trim else n
+        assert len(w_idx) * width <= batch_tokens
+    # every prefix is predicted once
+    pairs = np.concatenate([w_idx * n + t_idx for w_idx, t_idx in batches])
+    assert len(pairs) == lens.sum() and len(np.unique(pairs)) == lens.sum()
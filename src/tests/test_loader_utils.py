@@ -0,0 +1,219 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataloaders.loader_utils import factorize, build_seqs, cache_preprocess, save_cache, load_cache, RaggedArray
+from dataloaders.loader_utils import match_seq_len, get_window_starts, compact_int
+from utils import pid_collate_fn, INDEX_DTYPE
+
+def get_frame(num_rows=200, seed=0):
+    # a tiny interaction log, the users are interleaved like in the csv files
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        "user_id": rng.choice([7, 3, 11, 42, 5], num_rows),
+        "skill_id": rng.choice([10, 20, 30, 40], num_rows),
+        "item_id": rng.integers(100, 130, num_rows),
+        "correct": rng.integers(0, 2, num_rows),
+        "timestamp": rng.integers(0, 20, num_rows),
+    })
+
+def test_build_seqs_matches_user_loop():
+    df = get_frame()
+
+    q_list, q_idx = factorize(df["skill_id"].values)
+    u_list, (q_seqs, r_seqs) = build_seqs(df["user_id"].values, [q_idx, df["correct"].values])
+
+    # the loop of the dataloaders before build_seqs: one scan of the log per user
+    q2idx = {q: idx for idx, q in enumerate(np.unique(df["skill_id"].values))}
+    assert (u_list == np.unique(df["user_id"].values)).all()
+    for i, u in enumerate(u_list):
+        df_u = df[df["user_id"] == u]
+        assert (q_seqs[i] == np.array([q2idx[q] for q in df_u["skill_id"].values])).all()
+        assert (r_seqs[i] == df_u["correct"].values).all()
+
+def test_build_seqs_orders_by_order_values():
+    df = get_frame()
+
+    u_list, (r_seqs, t_seqs) = build_seqs(
+        df["user_id"].values, [df["correct"].values, df["timestamp"].values], order_values=df["timestamp"].values
+    )
+
+    # the rows of a user sorted by timestamp, ties keep the order of the log
+    for i, u in enumerate(u_list):
+        df_u = df[df["user_id"] == u].sort_values("timestamp", kind="stable")
+        assert (r_seqs[i] == df_u["correct"].values).all()
+        assert (t_seqs[i] == df_u["timestamp"].values).all()
+
+def test_ragged_array_rows_are_views():
+    seqs = [np.array([1, 2, 3]), np.array([], dtype=np.int64), np.array([4, 5])]
+    ragged = RaggedArray.from_seqs(seqs)
+
+    assert list(ragged.lengths) == [3, 0, 2]
+    for row, seq in zip(ragged, seqs):
+        assert (row == seq).all()
+    assert np.shares_memory(ragged[2], ragged.values)
+
+class TinyDataset():
+    """
+    A dataset with the preprocess() of the dataloaders, counting how often the csv is really preprocessed.
+    """
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        self.num_preprocess = 0
+
+    @cache_preprocess
+    def preprocess(self):
+        self.num_preprocess += 1
+        df = pd.read_csv(self.dataset_dir, sep="\t")
+
+        q_list, q_idx = factorize(df["skill_id"].values)
+        u_list, (q_seqs, r_seqs) = build_seqs(df["user_id"].values, [q_idx, df["correct"].values])
+        q2idx = {q: idx for idx, q in enumerate(q_list)}
+
+        return q_seqs, r_seqs, q_list, u_list, q2idx
+
+def test_cache_preprocess_round_trip(tmp_path):
+    dataset_dir = str(tmp_path / "preprocessed_df.csv")
+    get_frame().to_csv(dataset_dir, sep="\t", index=False)
+
+    first = TinyDataset(dataset_dir)
+    outputs = first.preprocess()
+    second = TinyDataset(dataset_dir)
+    cached = second.preprocess()
+
+    assert first.num_preprocess == 1 and second.num_preprocess == 0
+    # the sequences are read-only memory-maps of the cache, on the first run too
+    for seqs in (outputs[0], cached[0]):
+        assert isinstance(seqs.values, np.memmap)
+
+    expected = TinyDataset.preprocess.__wrapped__(TinyDataset(dataset_dir))
+    for seqs, expected_seqs in zip(cached[:2], expected[:2]):
+        assert len(seqs) == len(expected_seqs)
+        for seq, expected_seq in zip(seqs, expected_seqs):
+            assert (seq == expected_seq).all()
+    assert (cached[2] == expected[2]).all() and (cached[3] == expected[3]).all()
+    assert cached[4] == expected[4]
+
+def test_cache_preprocess_invalidated_by_the_csv(tmp_path):
+    dataset_dir = str(tmp_path / "preprocessed_df.csv")
+    get_frame(seed=0).to_csv(dataset_dir, sep="\t", index=False)
+    TinyDataset(dataset_dir).preprocess()
+
+    # a regenerated csv has another size or modification time, so it is preprocessed again
+    get_frame(num_rows=150, seed=1).to_csv(dataset_dir, sep="\t", index=False)
+    dataset = TinyDataset(dataset_dir)
+    outputs = dataset.preprocess()
+
+    assert dataset.num_preprocess == 1
+    assert sum(len(seq) for seq in outputs[1]) == 150
+
+def test_cache_keeps_the_entries_of_other_runs(tmp_path):
+    dataset_dir = str(tmp_path / "preprocessed_df.csv")
+    get_frame(seed=0).to_csv(dataset_dir, sep="\t", index=False)
+    TinyDataset(dataset_dir).preprocess()
+    cache_dir = tmp_path / "cache"
+    first_entries = set(os.listdir(cache_dir))
+
+    # another csv gets its own entry, the one another run may still be reading stays
+    get_frame(num_rows=150, seed=1).to_csv(dataset_dir, sep="\t", index=False)
+    TinyDataset(dataset_dir).preprocess()
+    entries = set(os.listdir(cache_dir))
+
+    assert len(entries) == 2 and first_entries < entries
+    # no temporary directories are left behind
+    assert not any(".tmp" in entry for entry in entries)
+
+def test_save_cache_keeps_a_complete_entry_of_another_run(tmp_path):
+    cache_path = str(tmp_path / "cache" / "Tiny_0123456789abcdef")
+    save_cache(cache_path, "key", [np.arange(3)])
+    # a second run with the same key finishes later, its copy is dropped and the first one stays readable
+    save_cache(cache_path, "key", [np.arange(3)])
+
+    assert (load_cache(cache_path, "key")[0] == np.arange(3)).all()
+    assert os.listdir(tmp_path / "cache") == ["Tiny_0123456789abcdef"]
+
+def match_seq_len_loop(seqs, max_seq_len, stride, pad_val=-1):
+    # windows of every user one by one: from 0 by stride until a window reaches the end of the user
+    windows = []
+    for seq in seqs:
+        start = 0
+        while True:
+            window = np.full(max_seq_len, pad_val, dtype=seq.dtype)
+            window[:len(seq[start:start + max_seq_len])] = seq[start:start + max_seq_len]
+            windows.append(window)
+            if start + max_seq_len >= len(seq):
+                break
+            start += stride
+
+    return np.array(windows)
+
+@pytest.mark.parametrize("stride", [None, 1, 3, 10])
+def test_match_seq_len_matches_window_loop(stride):
+    rng = np.random.default_rng(0)
+    seqs = [rng.integers(0, 9, seq_len) for seq_len in [1, 9, 10, 11, 25, 37]]
+
+    windows, = match_seq_len([RaggedArray.from_seqs(seqs)], 10, stride)
+    expected = match_seq_len_loop(seqs, 10, stride or 10)
+
+    assert windows.shape == expected.shape
+    assert (np.asarray(windows) == expected).all()
+    # a single window and a few windows are gathered like the whole array
+    assert (windows[4] == expected[4]).all()
+    assert (windows[np.array([5, 0, 2])] == expected[[5, 0, 2]]).all()
+
+def test_get_window_starts_keeps_every_interaction():
+    lens = np.array([1, 10, 11, 25])
+    user_idx, w_offsets = get_window_starts(lens, 10, 4)
+
+    for u, seq_len in enumerate(lens):
+        covered = np.zeros(seq_len, dtype=bool)
+        for offset in w_offsets[user_idx == u]:
+            covered[offset:offset + 10] = True
+        assert covered.all()
+
+@pytest.mark.parametrize("stride", [-1, 11])
+def test_get_window_starts_rejects_strides_that_skip(stride):
+    with pytest.raises(ValueError):
+        get_window_starts(np.array([30]), 10, stride)
+
+@pytest.mark.parametrize("values, dtype", [
+    (np.array([0, 1, 1, 0]), np.int8),
+    (np.array([True, False]), np.int8),
+    (np.array([0, 127]), np.int8),
+    (np.array([0, 128]), np.int16),
+    (np.array([0, 32767]), np.int16),
+    (np.array([0, 40000]), np.int32),
+    (np.array([], dtype=np.int64), np.int8),
+    (np.array([0, 2 ** 31]), np.int64),
+    (np.array([0.5, 1.5]), np.float64),
+])
+def test_compact_int_dtypes(values, dtype):
+    compact = compact_int(values)
+
+    assert compact.dtype == dtype
+    assert (compact == values).all()
+
+def test_collate_gives_index_dtype_from_compact_fields():
+    # compact fields of different dtypes become INDEX_DTYPE in the batch, the padding stays 0 under the mask
+    batch = [
+        (compact_int(np.array([3, 200])), compact_int(np.array([1, 0])), compact_int(np.array([40000, 5]))),
+        (compact_int(np.array([7])), compact_int(np.array([1])), compact_int(np.array([2]))),
+    ]
+    q_seqs, r_seqs, pid_seqs, mask_seqs = pid_collate_fn(batch)
+
+    for seqs in (q_seqs, r_seqs, pid_seqs):
+        assert seqs.dtype == INDEX_DTYPE
+    assert pid_seqs.tolist() == [[40000, 5], [2, 0]]
+    assert mask_seqs.tolist() == [[True, True], [True, False]]
+
+def test_cache_stores_compact_sequences(tmp_path):
+    dataset_dir = str(tmp_path / "preprocessed_df.csv")
+    get_frame().to_csv(dataset_dir, sep="\t", index=False)
+
+    q_seqs, r_seqs = TinyDataset(dataset_dir).preprocess()[:2]
+
+    # 4 skills and the 0/1 responses both fit in int8
+    assert q_seqs.values.dtype == np.int8 and r_seqs.values.dtype == np.int8
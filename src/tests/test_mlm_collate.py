@@ -0,0 +1,65 @@
+import types
+
+import numpy as np
+import torch
+
+from utils import EpochDataLoader, pid_collate_fn
+from trainers import trainer_utils
+from trainers.trainer_utils import MlmCollate, Mlm4BertTrain, unpack_mlm_batch
+
+def get_epoch_masks(torch_seed, num_epochs=2):
+    generator = torch.Generator().manual_seed(0)
+    samples = [
+        tuple(torch.randint(0, 2, (int(seq_len),), generator=generator) for _ in range(3))
+        for seq_len in torch.randint(4, 12, (16,), generator=generator)
+    ]
+
+    # the torch seed changes the base seed of the workers, the masks must not depend on it
+    torch.manual_seed(torch_seed)
+
+    loader = EpochDataLoader(
+        samples,
+        batch_size=4,
+        collate_fn=MlmCollate(pid_collate_fn, seed=7),
+        num_workers=2,
+    )
+
+    return [
+        [unpack_mlm_batch(batch)[1][1] for batch in loader]
+        for _ in range(num_epochs)
+    ]
+
+def test_worker_masks_depend_only_on_the_seed():
+    masks_a = get_epoch_masks(torch_seed=0)
+    masks_b = get_epoch_masks(torch_seed=1)
+
+    for epoch_a, epoch_b in zip(masks_a, masks_b):
+        for mask_a, mask_b in zip(epoch_a, epoch_b):
+            assert torch.equal(mask_a, mask_b)
+
+    # every epoch draws new masks
+    assert not all(torch.equal(mask_0, mask_1) for mask_0, mask_1 in zip(*masks_a))
+
+def test_worker_generator_is_seeded_by_seed_worker_and_epoch(monkeypatch):
+    r_seqs = torch.randint(0, 2, (8, 40), generator=torch.Generator().manual_seed(0))
+    mask_seqs = torch.ones_like(r_seqs, dtype=torch.bool)
+    data = (r_seqs, r_seqs, mask_seqs)
+
+    def get_masks(worker_id, epoch, worker_seed=0):
+        # the DataLoader gives every worker its id and a seed drawn from the torch RNG
+        worker_info = types.SimpleNamespace(id=worker_id, seed=worker_seed)
+        monkeypatch.setattr(trainer_utils, "get_worker_info", lambda: worker_info)
+        collate = MlmCollate(seed=7)
+        collate.set_epoch(epoch)
+        return collate(data).mlm_idxs
+
+    for worker_id, epoch in [(0, 0), (1, 0), (0, 1)]:
+        seed = int(np.random.SeedSequence([7, worker_id, epoch]).generate_state(1, np.uint64)[0] >> 1)
+        _, expected = Mlm4BertTrain(r_seqs, mask_seqs, torch.Generator().manual_seed(seed))
+        assert torch.equal(get_masks(worker_id, epoch), expected)
+        # the worker seed of the DataLoader is ignored when a seed is given
+        assert torch.equal(get_masks(worker_id, epoch, worker_seed=123), expected)
+
+    # the workers and the epochs draw different masks
+    assert not torch.equal(get_masks(0, 0), get_masks(1, 0))
+    assert not torch.equal(get_masks(0, 0), get_masks(0, 1))
@@ -0,0 +1,75 @@
+import types
+
+import pytest
+import torch
+
+from get_modules.get_models import MODELS
+from get_modules.get_loaders import get_loaders
+
+PACKING_MODELS = [name for name in MODELS.names() if MODELS.get_meta(name).get("packing", False)]
+
+@pytest.mark.parametrize("attn_block_size", [0, 8])
+@pytest.mark.parametrize("model_name", PACKING_MODELS)
+def test_single_learner_matches_unpacked(model_name, attn_block_size, build_model, run_model, fields):
+    # one learner packed alone has the segment id 1 on its interactions and 0 on <PAD>
+    model = build_model(model_name, attn_block_size=attn_block_size)
+    batch = fields(1, 24)
+    seq_len = 17
+
+    mask = torch.arange(24)[None, :] < seq_len
+    segment_ids = mask.long()
+
+    with torch.no_grad():
+        y_unpacked = run_model(model, batch, mask)
+        y_packed = run_model(model, batch, segment_ids)
+
+    torch.testing.assert_close(y_packed[:, :seq_len], y_unpacked[:, :seq_len])
+
+@pytest.mark.parametrize("model_name", PACKING_MODELS)
+def test_packed_learners_match_their_own_windows(model_name, build_model, run_model, fields):
+    # two learners of 10 and 9 interactions share one window, each has to get the output of its own window
+    model = build_model(model_name)
+    batch = fields(1, 24)
+    lens = [10, 9]
+
+    segment_ids = torch.zeros(1, 24, dtype=torch.long)
+    segment_ids[:, :10] = 1
+    segment_ids[:, 10:19] = 2
+
+    with torch.no_grad():
+        y_packed = run_model(model, batch, segment_ids)
+
+        start = 0
+        for seq_len in lens:
+            # the learner alone at the start of an unpacked window
+            own_batch = {name: torch.zeros_like(field) for name, field in batch.items()}
+            for name, field in batch.items():
+                own_batch[name][:, :seq_len] = field[:, start:start + seq_len]
+            mask = torch.arange(24)[None, :] < seq_len
+
+            y_own = run_model(model, own_batch, mask)
+            torch.testing.assert_close(y_packed[:, start:start + seq_len], y_own[:, :seq_len])
+
+            start += seq_len
+
+@pytest.mark.parametrize("model_name", PACKING_MODELS)
+def test_trimmed_batch_matches_full(model_name, build_model, run_model, fields):
+    # --length_bucket trims a batch to its longest window, the real positions must not change
+    model = build_model(model_name)
+    batch = fields(2, 24)
+    mask = torch.arange(24)[None, :] < torch.tensor([[10], [8]])
+
+    with torch.no_grad():
+        y_full = run_model(model, batch, mask)
+        y_trimmed = run_model(model, {name: field[:, :10] for name, field in batch.items()}, mask[:, :10])
+
+    torch.testing.assert_close(y_trimmed[mask[:, :10]], y_full[mask])
+
+@pytest.mark.parametrize("model_name", [name for name in MODELS.names() if name not in PACKING_MODELS])
+def test_length_bucket_rejects_models_that_see_the_padding(model_name):
+    config = types.SimpleNamespace(
+        model_name=model_name, packing=False, length_bucket=4, collate="window", window_stride=None, max_seq_len=24
+    )
+
+    with pytest.raises(ValueError):
+        get_loaders(config)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+import torch
+from sklearn import metrics
+
+from trainers.trainer_utils import Mlm4BertTrain, Mlm4BertTest, MetricsAccumulator, get_mlm_generator
+from trainers.trainer_utils import MLM_MASK_IDX, MLM_PAD_IDX
+
+def get_responses(bs=64, n=50, seed=0):
+    # windows padded at the end, -1 at <PAD>, every window has at least one interaction
+    generator = torch.Generator().manual_seed(seed)
+    r_seqs = torch.randint(0, 2, (bs, n), generator=generator)
+    lens = torch.randint(1, n + 1, (bs, ), generator=generator)
+    mask_seqs = torch.arange(n)[None, :] < lens[:, None]
+
+    return r_seqs.masked_fill(~mask_seqs, -1), mask_seqs
+
+def test_mlm_train_masks_15_percent_of_the_real_positions():
+    r_seqs, mask_seqs = get_responses()
+    mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs, get_mlm_generator(torch.device("cpu"), seed=0))
+
+    # like the former loop: int(real_len * 0.15) positions of every sequence, never a <PAD>
+    lens = mask_seqs.sum(dim=1)
+    assert (mlm_idxs.sum(dim=1) == (lens * 0.15).long()).all()
+    assert not (mlm_idxs & ~mask_seqs).any()
+
+    # <PAD> is 3, the positions that are not masked keep their responses
+    assert (mlm_r_seqs[~mask_seqs] == MLM_PAD_IDX).all()
+    kept = mask_seqs & ~mlm_idxs
+    assert (mlm_r_seqs[kept] == r_seqs[kept]).all()
+    assert set(mlm_r_seqs[mlm_idxs].tolist()) <= {0, 1, MLM_MASK_IDX}
+
+def test_mlm_train_mask_ratios():
+    r_seqs, mask_seqs = get_responses(bs=2000, n=100)
+    mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs, get_mlm_generator(torch.device("cpu"), seed=0))
+
+    # 80% <MASK>, 10% a random response (half of them the original one by chance), 10% the original response
+    masked = mlm_r_seqs[mlm_idxs]
+    assert (masked == MLM_MASK_IDX).float().mean().item() == pytest.approx(.8, abs=.01)
+    assert (masked == r_seqs[mlm_idxs]).float().mean().item() == pytest.approx(.15, abs=.01)
+
+def test_mlm_train_is_fixed_by_the_generator():
+    r_seqs, mask_seqs = get_responses()
+    first = Mlm4BertTrain(r_seqs, mask_seqs, get_mlm_generator(torch.device("cpu"), seed=3))
+    second = Mlm4BertTrain(r_seqs, mask_seqs, get_mlm_generator(torch.device("cpu"), seed=3))
+    other = Mlm4BertTrain(r_seqs, mask_seqs, get_mlm_generator(torch.device("cpu"), seed=4))
+
+    assert all((a == b).all() for a, b in zip(first, second))
+    assert (first[1] != other[1]).any()
+
+def mlm_test_loop(r_seqs, mask_seqs):
+    # the former per-sequence loop: <MASK> at the last real position, <PAD> is 3
+    mlm_r_seqs, mlm_idxs = [], []
+    for r_seq, mask_seq in zip(r_seqs, mask_seqs):
+        real_r_seq = torch.masked_select(r_seq, mask_seq)
+        real_r_seq[-1] = MLM_MASK_IDX
+        pad_seq = torch.full((r_seq.size(0) - real_r_seq.size(0), ), MLM_PAD_IDX, dtype=r_seq.dtype)
+        mlm_r_seqs.append(torch.cat((real_r_seq, pad_seq), dim=-1))
+
+        mlm_idx = torch.zeros(r_seq.size(0), dtype=torch.bool)
+        mlm_idx[real_r_seq.size(0) - 1] = True
+        mlm_idxs.append(mlm_idx)
+
+    return torch.stack(mlm_r_seqs), torch.stack(mlm_idxs)
+
+def test_mlm_test_masks_only_the_last_position():
+    r_seqs, mask_seqs = get_responses()
+    mlm_r_seqs, mlm_idxs = Mlm4BertTest(r_seqs, mask_seqs)
+    expected_r_seqs, expected_idxs = mlm_test_loop(r_seqs, mask_seqs)
+
+    assert (mlm_idxs.sum(dim=1) == 1).all()
+    assert (mlm_idxs == expected_idxs).all()
+    assert (mlm_r_seqs == expected_r_seqs).all()
+
+def get_scores(num_batches=7, bs=300, seed=0):
+    rng = np.random.default_rng(seed)
+    batches = []
+    for _ in range(num_batches):
+        y_true = rng.integers(0, 2, size=bs)
+        # informative but noisy scores, so the AUC is neither 0.5 nor 1
+        y_score = 1 / (1 + np.exp(-(y_true - .5 + rng.normal(size=bs))))
+        batches.append((torch.tensor(y_true), torch.tensor(y_score, dtype=torch.float32)))
+
+    return batches
+
+def accumulate(batches, num_bins, capacity=1 << 16):
+    accumulator = MetricsAccumulator(num_bins=num_bins, capacity=capacity)
+    for y_true, y_score in batches:
+        accumulator.update(y_true, y_score, torch.tensor(1.))
+
+    return accumulator
+
+# a capacity smaller than one batch also checks the growth of the buffers
+@pytest.mark.parametrize("capacity", [1 << 16, 100])
+def test_exact_metrics_match_sklearn(capacity):
+    batches = get_scores()
+    results = accumulate(batches, num_bins=0, capacity=capacity).get_results()
+
+    y_true = torch.cat([y_true for y_true, _ in batches]).numpy()
+    y_score = torch.cat([y_score for _, y_score in batches]).numpy()
+    assert results["AUC"] == pytest.approx(metrics.roc_auc_score(y_true, y_score), abs=1e-12)
+    assert results["RMSE"] == pytest.approx(np.sqrt(metrics.mean_squared_error(y_true, y_score)), rel=1e-6)
+    assert results["ACC"] == pytest.approx(metrics.accuracy_score(y_true, y_score >= .5))
+    assert results["loss"] == pytest.approx(1.)
+
+def test_histogram_auc_is_close_to_the_exact_one():
+    batches = get_scores()
+    exact = accumulate(batches, num_bins=0).get_auc()
+
+    # the only error comes from the scores that share a bin, it shrinks with the number of bins
+    errors = [abs(accumulate(batches, num_bins=num_bins).get_auc() - exact) for num_bins in (100, 10000)]
+    assert errors[0] < 1e-2 and errors[1] < 1e-4
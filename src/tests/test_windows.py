@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+
+from dataloaders.loader_utils import RaggedArray, match_seq_len
+from utils import PaddedWindows, PackedWindows, pid_collate_fn
+
+class TinyWindows():
+    """
+    Windows of a few learners like the datasets give them, recording the windows every call reads.
+    """
+    def __init__(self, max_seq_len=10):
+        rng = np.random.default_rng(0)
+        lens = [3, 10, 14, 7, 1, 25]
+        seqs = [RaggedArray.from_seqs([rng.integers(0, 9, seq_len) for seq_len in lens]) for _ in range(3)]
+        self.q_seqs, self.r_seqs, self.pid_seqs = match_seq_len(seqs, max_seq_len)
+        self.reads = []
+
+    def __getitem__(self, index):
+        self.reads.append(np.size(np.arange(len(self))[index]))
+        return self.q_seqs[index], self.r_seqs[index], self.pid_seqs[index]
+
+    def __len__(self):
+        return len(self.q_seqs)
+
+def test_padded_windows_match_the_collate():
+    dataset = TinyWindows()
+    batch_idxs = torch.tensor([5, 0, 2, 8])
+
+    for trim in (False, True):
+        batch = PaddedWindows(dataset, trim=trim)[batch_idxs]
+        expected = pid_collate_fn([dataset[int(i)] for i in batch_idxs])
+        # the collate pads to the longest window, the windows are already max_seq_len long
+        seq_len = batch[-1].size(1)
+        assert seq_len == (int(batch[-1].sum(1).max()) if trim else 10)
+
+        for field, expected_field in zip(batch, expected):
+            assert field.dtype == expected_field.dtype
+            assert torch.equal(field, expected_field[:, :seq_len])
+
+def test_padded_windows_read_only_the_gathered_batch():
+    dataset = TinyWindows()
+    windows = PaddedWindows(dataset, chunk_size=4)
+
+    # the lengths are read in chunks, a batch reads only its own windows
+    assert max(dataset.reads) == 4
+    dataset.reads.clear()
+    windows[torch.tensor([1, 3])]
+    assert dataset.reads == [2]
+
+def test_packed_windows_keep_every_interaction():
+    dataset = TinyWindows()
+    windows = PaddedWindows(dataset)
+    packed = PackedWindows(windows, torch.arange(len(windows)), chunk_size=3)
+
+    assert int(packed.lens.sum()) == int(windows.lens.sum())
+    assert len(packed) < len(windows)
+
+    # the interactions of every segment are those of one window, in order
+    q_packed, mask_packed = packed[torch.arange(len(packed))][0], packed[torch.arange(len(packed))][-1]
+    segments = sorted(
+        tuple(q_packed[row][mask_packed[row] == seg_id].tolist())
+        for row in range(len(packed)) for seg_id in mask_packed[row].unique().tolist() if seg_id != 0
+    )
+    q_windows, _, _, mask_windows = windows[torch.arange(len(windows))]
+    expected = sorted(tuple(q[mask].tolist()) for q, mask in zip(q_windows, mask_windows))
+    assert segments == expected
@@ -1,10 +1,14 @@
+import os
+import multiprocessing
 import numpy as np
 import datetime
+from copy import copy
 
 import torch
-from get_modules.get_loaders import get_loaders
+from get_modules.get_loaders import get_loaders, get_dataset, get_fold_splits
 from get_modules.get_models import get_models
 from get_modules.get_trainers import get_trainers
+from trainers.eval_utils import evaluate_all_positions
 from utils import get_optimizers, get_crits, recorder, visualizer
 
 from define_argparser import define_argparser
@@ -44,6 +48,11 @@ def main(config, train_loader=None, valid_loader=None, test_loader=None, num_q=N
     train_scores, valid_scores, \
         highest_valid_score, highest_test_score  = trainer.train(train_loader, valid_loader, test_loader, config)
 
+    # 6-1. predict every interaction of the test set with the best model and export the predictions
+    # (the trainers also print the all-positions score of every epoch)
+    if config.eval_all_positions:
+        evaluate_all_positions(trainer.model, test_loader, device, config, export_path=config.eval_export_path)
+
     # 7. model record
     # for model's name
     today = datetime.datetime.today()
@@ -58,6 +67,31 @@ def main(config, train_loader=None, valid_loader=None, test_loader=None, num_q=N
 
     return train_scores, valid_scores, highest_valid_score, highest_test_score, record_time
 
+# run one fold of the fivefold cross validation
+# dataset and fold_splits are built by the worker itself when they are not given,
+# from the dataset cache and the saved splits, so every worker sees the same folds
+def run_fold(config, idx, dataset=None, fold_splits=None):
+    if dataset is None:
+        dataset = get_dataset(config)
+    if fold_splits is None:
+        fold_splits = get_fold_splits(dataset[0], config)
+
+    # every fold keeps its own early stopping checkpoint, folds can run at the same time
+    fold_config = copy(config)
+    checkpoint_root, checkpoint_ext = os.path.splitext(config.checkpoint_path)
+    fold_config.checkpoint_path = "%s_fold%d%s" % (checkpoint_root, idx, checkpoint_ext)
+    if config.eval_export_path is not None:
+        export_root, export_ext = os.path.splitext(config.eval_export_path)
+        fold_config.eval_export_path = "%s_fold%d%s" % (export_root, idx, export_ext)
+
+    train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff = get_loaders(fold_config, idx, dataset, fold_splits)
+
+    return main(fold_config, train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff)
+
+# initializer of the fold worker processes
+def init_fold_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
 # If you used python train.py, then this will be start first
 if __name__ == "__main__":
     # get config from define_argparser
@@ -66,14 +100,28 @@ if __name__ == "__main__":
     # if fivefold = True
     if config.fivefold == True:
 
-        test_scores_list = []
-        
-        for idx in range(5):
-            train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff = get_loaders(config, idx)
-            train_auc_scores, valid_auc_scores, \
-                 best_valid_score, test_auc_score,  \
-                    record_time = main(config, train_loader, valid_loader, test_loader, num_q, num_r, num_pid, num_diff)
-            test_scores_list.append(test_auc_score)
+        # the dataset is built and split once, every fold takes its indices
+        dataset = get_dataset(config)
+        fold_splits = get_fold_splits(dataset[0], config)
+
+        # the folds run in fold_workers processes at the same time
+        if config.fold_workers > 1:
+            # cap the threads of every worker, so the workers don't oversubscribe the cores
+            num_threads = config.threads_per_fold or max(1, (os.cpu_count() or 1) // config.fold_workers)
+            # the workers inherit the environment, it is read when their BLAS and OpenMP start
+            for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+                os.environ[name] = str(num_threads)
+
+            # spawn, a forked CUDA context can't be used in the workers
+            with multiprocessing.get_context("spawn").Pool(
+                config.fold_workers, initializer=init_fold_worker, initargs=(num_threads,)
+            ) as pool:
+                fold_results = pool.starmap(run_fold, [(config, idx) for idx in range(5)])
+        else:
+            fold_results = [run_fold(config, idx, dataset, fold_splits) for idx in range(5)]
+
+        test_scores_list = [test_auc_score for _, _, _, test_auc_score, _ in fold_results]
+        record_time = fold_results[-1][-1]
         # mean the test_scores_list
         test_auc_score = sum(test_scores_list)/5
         # for record
@@ -86,4 +134,3 @@ if __name__ == "__main__":
         recorder(test_auc_score, record_time, config)
         # for visualizer
         visualizer(train_auc_scores, valid_auc_scores, record_time)
-    
\ No newline at end of file
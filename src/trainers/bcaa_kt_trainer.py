@@ -2,97 +2,12 @@ import torch
 from copy import deepcopy
 
 from torch.nn.functional import one_hot
-from sklearn import metrics
 import numpy as np
 from tqdm import tqdm
-from random import random, randint
 
 from utils import EarlyStopping
-
-# 15% <MASK>
-def Mlm4BertTrain(r_seqs, mask_seqs):
-    #|r_seqs| = (bs, n)
-
-    # r_seqs를 불러들인 후, for문으로 반복해서 불러들임
-    mlm_r_seqs = []
-    mlm_idxs = []
-
-    # 불러들인 r_seq를 대상으로 torch.masked_select()를 사용해서 길이를 자름
-    # PAD는 -1로 처리
-    for r_seq, mask_seq in zip(r_seqs, mask_seqs):
-        r_len = r_seq.size(0)
-        # real_r_seq: r_seq에 <PAD>를 제거한 sq
-        real_r_seq = torch.masked_select(r_seq, mask_seq).cpu()
-        real_r_seq_len = real_r_seq.size(0)
-
-        mlm_idx = np.random.choice(real_r_seq_len, int(real_r_seq_len*0.15), replace=False)
-
-        for idx in mlm_idx:
-            if random() < 0.8: # 15% 중 80%는 <MASK>
-                real_r_seq[idx] = 2 # <MASK>는 2로 표시하기
-            elif random() < 0.5: # 15% 중 10%는 0과 1의 random 값으로 넣기
-                real_r_seq[idx] = randint(0, 1)
-            # 15% 중 10%는 원래 값 그대로
-
-        # pad_r_seq에 PAD(-1)을 씌움
-        pad_len = r_len - real_r_seq_len
-        # <PAD>를 3으로 채우기, -1로 채우면 embedding에서 error 발생
-        pad_seq = torch.full((1, pad_len), 3).squeeze(0) 
-        # 패드 다시 결합
-        pad_r_seq = torch.cat((real_r_seq, pad_seq), dim=-1)
-        # mlm_r_seqs에 넣기
-        mlm_r_seqs.append(pad_r_seq)
-
-        # <mask> idx bool 만들기
-        # r_len의 길이(전체 길이)만큼 zero vector로 만듦
-        mlm_zeros = np.zeros(shape=(r_len, ))
-        # mlm_idx에 해당하는 곳에 1을 넣음
-        mlm_zeros[mlm_idx] = 1
-        # mlm_idxs에 값을 더함
-        mlm_idxs.append(mlm_zeros)
-
-    mlm_r_seqs = torch.stack(mlm_r_seqs)
-    mlm_idxs = torch.BoolTensor(mlm_idxs)
-
-    # mlm_r_seqs: mask가 씌워진 r_seqs
-    # mlm_idx: mask가 씌워진 idx 값
-    return mlm_r_seqs, mlm_idxs
-    # |mlm_r_seqs| = (bs, n)
-    # |mask_seqs| = (bs, n)
-
-# seq의 가장 마지막에 <MASK>
-def Mlm4BertTest(r_seqs, mask_seqs):
-    #|r_seqs| = (bs, n)
-
-    mlm_r_seqs = []
-    mlm_idxs = []
-
-    for r_seq, mask_seq in zip(r_seqs, mask_seqs):
-        r_len = r_seq.size(0)
-
-        real_r_seq = torch.masked_select(r_seq, mask_seq).cpu()
-        real_r_seq_len = real_r_seq.size(0)
-
-        #여기서는 real_r_seq의 마지막
-        mlm_idx = real_r_seq_len - 1
-        #마지막 index에 <MASK>를 씌움, <MASK>는 2
-        real_r_seq[mlm_idx] = 2
-
-        pad_len = r_len - real_r_seq_len
-        pad_seq = torch.full((1, pad_len), 3).squeeze(0) # <PAD>는 3
-        pad_r_seq = torch.cat((real_r_seq, pad_seq), dim=-1)
-        mlm_r_seqs.append(pad_r_seq)
-
-        mlm_zeros = np.zeros(shape=(r_len, ))
-        mlm_zeros[mlm_idx] = 1
-        mlm_idxs.append(mlm_zeros)
-
-    mlm_r_seqs = torch.stack(mlm_r_seqs)
-    mlm_idxs = torch.BoolTensor(mlm_idxs)
-
-    return mlm_r_seqs, mlm_idxs
-    # |mlm_r_seqs| = (bs, n)
-    # |mask_seqs| = (bs, n)
+from trainers.trainer_utils import Mlm4BertTrain, Mlm4BertTest, get_mlm_generator, unpack_mlm_batch, MetricsAccumulator
+from trainers.eval_utils import evaluate_all_positions
 
 class BcaaKtTrainer():
 
@@ -106,7 +21,9 @@ class BcaaKtTrainer():
         crit, 
         max_seq_len, 
         grad_acc=False, 
-        grad_acc_iter=4 #4면 기존 batch_size의 4배
+        grad_acc_iter=4, #4면 기존 batch_size의 4배
+        mlm_seed=None, # seed of the mlm masking, see get_mlm_generator
+        auc_bins=0 # 0: exact AUC, k: streaming AUC from a histogram of k bins
         ):
         self.model = model
         self.optimizer = optimizer
@@ -117,15 +34,17 @@ class BcaaKtTrainer():
         self.max_seq_len = max_seq_len
         self.grad_acc = grad_acc #gradient accumulation
         self.grad_acc_iter = grad_acc_iter
+        self.mlm_generator = get_mlm_generator(device, mlm_seed) # masking draws on the device
+        self.auc_bins = auc_bins
     
     def _train(self, train_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         for idx, data in enumerate(tqdm(train_loader)):
             self.model.train()
+            data, mlm_batch = unpack_mlm_batch(data)
             q_seqs, r_seqs, pid_seqs, mask_seqs = data
 
             q_seqs = q_seqs.to(self.device) #|q_seqs| = (bs, n)
@@ -134,10 +53,14 @@ class BcaaKtTrainer():
             mask_seqs = mask_seqs.to(self.device) #|mask_seqs| = (bs, n)
 
             # correct에서 따로 사용하기 위해 clone 작성
-            real_seqs = r_seqs.clone()
+            real_seqs = r_seqs.float()
 
             # mlm_r_seqs: r_seqs에 Masked Language Model 구현을 위한 [MASK]를 씌움, [MASK]는 2로 표기 / mlm_idx: [MASK]의 위치
-            mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs)
+            # with --mlm_workers the masks were already drawn in the DataLoader workers
+            if mlm_batch is not None:
+                mlm_r_seqs, mlm_idxs = mlm_batch
+            else:
+                mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs, self.mlm_generator)
             # |mlm_r_seqs| = (bs, n)
             # |mlm_idxs| = (bs, n), True or False가 들어있어야 함
 
@@ -147,10 +70,10 @@ class BcaaKtTrainer():
             # zero_grad(아래로 위치 변경)
         
             y_hat = self.model(
-                q_seqs.long(), 
-                mlm_r_seqs.long(), # train을 위한 mlm된 r_seqs
-                pid_seqs.long(),
-                mask_seqs.long() # attn_mask
+                q_seqs, 
+                mlm_r_seqs, # train을 위한 mlm된 r_seqs
+                pid_seqs,
+                mask_seqs # attn_mask
             ).to(self.device)
             # |y_hat| = (bs, n, output_size=1)
 
@@ -177,27 +100,17 @@ class BcaaKtTrainer():
                 loss.backward()
                 self.optimizer.step()
 
-            y_trues.append(correct)
-            y_scores.append(y_hat)
-            loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+            metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     def _validate(self, valid_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         with torch.no_grad():
             for data in tqdm(valid_loader):
@@ -210,7 +123,7 @@ class BcaaKtTrainer():
                 pid_seqs = pid_seqs.to(self.device)
                 mask_seqs = mask_seqs.to(self.device)
 
-                real_seqs = r_seqs.clone()
+                real_seqs = r_seqs.float()
 
                 mlm_r_seqs, mlm_idxs = Mlm4BertTest(r_seqs, mask_seqs)
 
@@ -220,10 +133,10 @@ class BcaaKtTrainer():
                 # |mlm_idxs| = (bs, n), True or False가 들어있어야 함
 
                 y_hat = self.model(
-                    q_seqs.long(),
-                    mlm_r_seqs.long(),
-                    pid_seqs.long(),
-                    mask_seqs.long()
+                    q_seqs,
+                    mlm_r_seqs,
+                    pid_seqs,
+                    mask_seqs
                 ).to(self.device)
 
                 y_hat = y_hat.squeeze()
@@ -234,27 +147,17 @@ class BcaaKtTrainer():
                 loss = self.crit(y_hat, correct)
                 # |loss| = (1)
 
-                y_trues.append(correct)
-                y_scores.append(y_hat)
-                loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+                metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     def _test(self, test_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         with torch.no_grad():
             for data in tqdm(test_loader):
@@ -267,7 +170,7 @@ class BcaaKtTrainer():
                 pid_seqs = pid_seqs.to(self.device)
                 mask_seqs = mask_seqs.to(self.device)
 
-                real_seqs = r_seqs.clone()
+                real_seqs = r_seqs.float()
 
                 mlm_r_seqs, mlm_idxs = Mlm4BertTest(r_seqs, mask_seqs)
 
@@ -277,10 +180,10 @@ class BcaaKtTrainer():
                 # |mlm_idxs| = (bs, n), True or False가 들어있어야 함
 
                 y_hat = self.model(
-                    q_seqs.long(),
-                    mlm_r_seqs.long(),
-                    pid_seqs.long(),
-                    mask_seqs.long()
+                    q_seqs,
+                    mlm_r_seqs,
+                    pid_seqs,
+                    mask_seqs
                 ).to(self.device)
 
                 y_hat = y_hat.squeeze()
@@ -291,21 +194,12 @@ class BcaaKtTrainer():
                 loss = self.crit(y_hat, correct)
                 # |loss| = (1)
 
-                y_trues.append(correct)
-                y_scores.append(y_hat)
-                loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+                metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     #auc용으로 train
     def train(self, train_loader, valid_loader, test_loader, config):
@@ -327,7 +221,8 @@ class BcaaKtTrainer():
 
         # early_stopping 선언
         early_stopping = EarlyStopping(metric_name=metric_name,
-                                    best_score=best_valid_score)
+                                    best_score=best_valid_score,
+                                    path=config.checkpoint_path)
 
         # Train and Valid Session
         for epoch_index in range(self.n_epochs):
@@ -342,6 +237,10 @@ class BcaaKtTrainer():
             valid_score = self._validate(valid_loader, metric_name)
             test_score = self._test(test_loader, metric_name)
 
+            # all-positions score of the test set, see trainers/eval_utils.py
+            if config.eval_all_positions:
+                evaluate_all_positions(self.model, test_loader, self.device, config)
+
             # train, test record 저장
             train_scores.append(train_score)
             valid_scores.append(valid_score)
@@ -381,7 +280,7 @@ class BcaaKtTrainer():
         
         # 가장 최고의 모델 복구
         #self.model.load_state_dict(best_model)
-        self.model.load_state_dict(torch.load("../checkpoints/checkpoint.pt"))
+        self.model.load_state_dict(torch.load(config.checkpoint_path))
 
         return train_scores, valid_scores, \
             best_valid_score, best_test_score
\ No newline at end of file
@@ -2,97 +2,12 @@ import torch
 from copy import deepcopy
 
 from torch.nn.functional import one_hot
-from sklearn import metrics
 import numpy as np
 from tqdm import tqdm
-from random import random, randint
 
 from utils import EarlyStopping
-
-# For Train MLM
-# 15% <MASK>, 80% of 15% are real <MASK>, 10% of 15% are reverse, 10% of 15% are not changed
-def Mlm4BertTrain(r_seqs, mask_seqs):
-    #|r_seqs| = (bs, n)
-
-    mlm_r_seqs = []
-    mlm_idxs = []
-
-    # <PAD> is -1
-    for r_seq, mask_seq in zip(r_seqs, mask_seqs):
-        r_len = r_seq.size(0)
-        # real_r_seq: r_seq with no <PAD>
-        real_r_seq = torch.masked_select(r_seq, mask_seq).cpu()
-        real_r_seq_len = real_r_seq.size(0)
-
-        mlm_idx = np.random.choice(real_r_seq_len, int(real_r_seq_len*0.15), replace=False)
-
-        for idx in mlm_idx:
-            if random() < 0.8: # 15% of 80% are <MASK>
-                real_r_seq[idx] = 2 # <MASK> is 2
-            elif random() < 0.5: # 15% of 10% are random among the 0 or 1
-                real_r_seq[idx] = randint(0, 1)
-            # 15% of 10% are same with original
-
-        # cover the PAD(-1)
-        pad_len = r_len - real_r_seq_len
-        # <PAD> is 3
-        pad_seq = torch.full((1, pad_len), 3).squeeze(0) 
-        # combine the <PAD>
-        pad_r_seq = torch.cat((real_r_seq, pad_seq), dim=-1)
-        # append to the mlm_r_seqs
-        mlm_r_seqs.append(pad_r_seq)
-
-        # <MASK> idx bool
-        # make zero vector with r_len size
-        mlm_zeros = np.zeros(shape=(r_len, ))
-        # mlm_idx are 1
-        mlm_zeros[mlm_idx] = 1
-        # append to the mlm_idxs
-        mlm_idxs.append(mlm_zeros)
-
-    mlm_r_seqs = torch.stack(mlm_r_seqs)
-    mlm_idxs = torch.BoolTensor(mlm_idxs)
-
-    # mlm_r_seqs: masked r_seqs
-    # mlm_idx: masked idx
-    return mlm_r_seqs, mlm_idxs
-    # |mlm_r_seqs| = (bs, n)
-    # |mask_seqs| = (bs, n)
-
-# For Test MLM
-# The last of seq will be changed to the <MASK>
-def Mlm4BertTest(r_seqs, mask_seqs):
-    #|r_seqs| = (bs, n)
-
-    mlm_r_seqs = []
-    mlm_idxs = []
-
-    for r_seq, mask_seq in zip(r_seqs, mask_seqs):
-        r_len = r_seq.size(0)
-
-        real_r_seq = torch.masked_select(r_seq, mask_seq).cpu()
-        real_r_seq_len = real_r_seq.size(0)
-
-        # last index of real_r_seq
-        mlm_idx = real_r_seq_len - 1
-        # last index get a <MASK>, <MASK> is 2
-        real_r_seq[mlm_idx] = 2
-
-        pad_len = r_len - real_r_seq_len
-        pad_seq = torch.full((1, pad_len), 3).squeeze(0) # <PAD> is 3
-        pad_r_seq = torch.cat((real_r_seq, pad_seq), dim=-1)
-        mlm_r_seqs.append(pad_r_seq)
-
-        mlm_zeros = np.zeros(shape=(r_len, ))
-        mlm_zeros[mlm_idx] = 1
-        mlm_idxs.append(mlm_zeros)
-
-    mlm_r_seqs = torch.stack(mlm_r_seqs)
-    mlm_idxs = torch.BoolTensor(mlm_idxs)
-
-    return mlm_r_seqs, mlm_idxs
-    # |mlm_r_seqs| = (bs, n)
-    # |mask_seqs| = (bs, n)
+from trainers.trainer_utils import Mlm4BertTrain, Mlm4BertTest, get_mlm_generator, unpack_mlm_batch, MetricsAccumulator
+from trainers.eval_utils import evaluate_all_positions
 
 class Bert4ktPlusDiffTrainer():
 
@@ -106,7 +21,9 @@ class Bert4ktPlusDiffTrainer():
         crit, 
         max_seq_len, 
         grad_acc=False, 
-        grad_acc_iter=4
+        grad_acc_iter=4,
+        mlm_seed=None,
+        auc_bins=0 # 0: exact AUC, k: streaming AUC from a histogram of k bins
         ):
         self.model = model
         self.optimizer = optimizer
@@ -117,15 +34,17 @@ class Bert4ktPlusDiffTrainer():
         self.max_seq_len = max_seq_len
         self.grad_acc = grad_acc #gradient accumulation
         self.grad_acc_iter = grad_acc_iter
+        self.mlm_generator = get_mlm_generator(device, mlm_seed) # masking draws on the device
+        self.auc_bins = auc_bins
     
     def _train(self, train_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         for idx, data in enumerate(tqdm(train_loader)):
             self.model.train()
+            data, mlm_batch = unpack_mlm_batch(data)
             q_seqs, r_seqs, pid_seqs, diff_seqs, mask_seqs = data
 
             q_seqs = q_seqs.to(self.device) # |q_seqs| = (bs, n)
@@ -133,23 +52,29 @@ class Bert4ktPlusDiffTrainer():
             pid_seqs = pid_seqs.to(self.device) # |pid_seqs| = (bs, n)
             diff_seqs = diff_seqs.to(self.device)
             mask_seqs = mask_seqs.to(self.device) # |mask_seqs| = (bs, n)
+            # packed windows give the segment ids as mask_seqs (0 is <PAD>), the model takes them as they are
+            attn_mask_seqs, mask_seqs = mask_seqs, mask_seqs != 0
 
             # for correct
-            real_seqs = r_seqs.clone()
+            real_seqs = r_seqs.float()
 
             # mlm_r_seqs: for MLM, [MASK] position get 2 / mlm_idx are index of [MASK]
-            mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs)
+            # with --mlm_workers the masks were already drawn in the DataLoader workers
+            if mlm_batch is not None:
+                mlm_r_seqs, mlm_idxs = mlm_batch
+            else:
+                mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs, self.mlm_generator)
             # |mlm_r_seqs| = (bs, n)
             # |mlm_idxs| = (bs, n)
             mlm_r_seqs = mlm_r_seqs.to(self.device)
             mlm_idxs = mlm_idxs.to(self.device)
 
             y_hat = self.model(
-                q_seqs.long(), 
-                mlm_r_seqs.long(), # r_seqs with MLM
-                pid_seqs.long(),
-                diff_seqs.long(),
-                mask_seqs.long() # for attn_mask
+                q_seqs, 
+                mlm_r_seqs, # r_seqs with MLM
+                pid_seqs,
+                diff_seqs,
+                attn_mask_seqs # for attn_mask
             ).to(self.device)
             # |y_hat| = (bs, n, output_size=1)
 
@@ -178,27 +103,17 @@ class Bert4ktPlusDiffTrainer():
                 loss.backward()
                 self.optimizer.step()
 
-            y_trues.append(correct)
-            y_scores.append(y_hat)
-            loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+            metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     def _validate(self, valid_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         with torch.no_grad():
             for data in tqdm(valid_loader):
@@ -211,7 +126,7 @@ class Bert4ktPlusDiffTrainer():
                 diff_seqs = diff_seqs.to(self.device)
                 mask_seqs = mask_seqs.to(self.device)
 
-                real_seqs = r_seqs.clone()
+                real_seqs = r_seqs.float()
 
                 mlm_r_seqs, mlm_idxs = Mlm4BertTest(r_seqs, mask_seqs)
 
@@ -219,11 +134,11 @@ class Bert4ktPlusDiffTrainer():
                 mlm_idxs = mlm_idxs.to(self.device)
 
                 y_hat = self.model(
-                    q_seqs.long(),
-                    mlm_r_seqs.long(),
-                    pid_seqs.long(),
-                    diff_seqs.long(),
-                    mask_seqs.long()
+                    q_seqs,
+                    mlm_r_seqs,
+                    pid_seqs,
+                    diff_seqs,
+                    mask_seqs
                 ).to(self.device)
 
                 y_hat = y_hat.squeeze()
@@ -233,27 +148,17 @@ class Bert4ktPlusDiffTrainer():
 
                 loss = self.crit(y_hat, correct)
 
-                y_trues.append(correct)
-                y_scores.append(y_hat)
-                loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+                metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     def _test(self, test_loader, metric_name):
 
-        auc_score = 0
-        y_trues, y_scores = [], []
-        loss_list = []
+        # detached running metrics, the epoch doesn't keep the graphs of its batches
+        metrics_acc = MetricsAccumulator(self.auc_bins)
 
         with torch.no_grad():
             for data in tqdm(test_loader):
@@ -266,7 +171,7 @@ class Bert4ktPlusDiffTrainer():
                 diff_seqs = diff_seqs.to(self.device)
                 mask_seqs = mask_seqs.to(self.device)
 
-                real_seqs = r_seqs.clone()
+                real_seqs = r_seqs.float()
 
                 mlm_r_seqs, mlm_idxs = Mlm4BertTest(r_seqs, mask_seqs)
 
@@ -274,11 +179,11 @@ class Bert4ktPlusDiffTrainer():
                 mlm_idxs = mlm_idxs.to(self.device)
 
                 y_hat = self.model(
-                    q_seqs.long(),
-                    mlm_r_seqs.long(),
-                    pid_seqs.long(),
-                    diff_seqs.long(),
-                    mask_seqs.long()
+                    q_seqs,
+                    mlm_r_seqs,
+                    pid_seqs,
+                    diff_seqs,
+                    mask_seqs
                 ).to(self.device)
 
                 y_hat = y_hat.squeeze()
@@ -288,21 +193,12 @@ class Bert4ktPlusDiffTrainer():
 
                 loss = self.crit(y_hat, correct)
 
-                y_trues.append(correct)
-                y_scores.append(y_hat)
-                loss_list.append(loss)
-
-        y_trues = torch.cat(y_trues).detach().cpu().numpy()
-        y_scores = torch.cat(y_scores).detach().cpu().numpy()
-
-        auc_score += metrics.roc_auc_score( y_trues, y_scores )
-
-        loss_result = torch.mean(torch.Tensor(loss_list)).detach().cpu().numpy()
+                metrics_acc.update(correct, y_hat, loss)
 
         if metric_name == "AUC":
-            return auc_score
+            return metrics_acc.get_auc()
         elif metric_name == "RMSE":
-            return loss_result
+            return metrics_acc.get_loss()
 
     # train use the _train, _validate, _test
     def train(self, train_loader, valid_loader, test_loader, config):
@@ -322,7 +218,8 @@ class Bert4ktPlusDiffTrainer():
 
         # early_stopping
         early_stopping = EarlyStopping(metric_name=metric_name,
-                                    best_score=best_valid_score)
+                                    best_score=best_valid_score,
+                                    path=config.checkpoint_path)
 
         # Train and Valid Session
         for epoch_index in range(self.n_epochs):
@@ -337,6 +234,10 @@ class Bert4ktPlusDiffTrainer():
             valid_score = self._validate(valid_loader, metric_name)
             test_score = self._test(test_loader, metric_name)
 
+            # all-positions score of the test set, see trainers/eval_utils.py
+            if config.eval_all_positions:
+                evaluate_all_positions(self.model, test_loader, self.device, config)
+
             # train, test record 저장
             train_scores.append(train_score)
             valid_scores.append(valid_score)
@@ -372,7 +273,7 @@ class Bert4ktPlusDiffTrainer():
             ))
         print("\n")
         
-        self.model.load_state_dict(torch.load("../checkpoints/checkpoint.pt"))
+        self.model.load_state_dict(torch.load(config.checkpoint_path))
 
         return train_scores, valid_scores, \
             best_valid_score, best_test_score
\ No newline at end of file
@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+import torch
+
+from trainers.trainer_utils import MLM_MASK_IDX, MLM_PAD_IDX
+from get_modules.get_models import MODELS
+
+# all-positions evaluation
+# _validate and _test predict only the last interaction of every window.
+# here every interaction t of every window is predicted like the last one of its prefix:
+# the model sees the interactions 0..t of the window, and the response of t is <MASK>.
+# a window of length L gives L masked prefixes, the prefixes of many windows are sorted by length
+# and fused into batches of about batch_tokens positions, so a batch is padded only to its longest prefix.
+
+def get_prefix_batches(lens, batch_tokens, row_len=None):
+    """
+    The prefixes (window, last position) of the windows, cut into batches of prefixes of similar length.
+
+        :param lens: (np.ndarray) |lens| = (W, ), lengths of the windows
+        :param batch_tokens: (int) max number of positions (rows * row length) of a batch
+        :param row_len: (int) length of the rows fed to the model, None if they are trimmed to the longest prefix
+
+        :output batches: (list of (np.ndarray, np.ndarray)) window and last position of the prefixes of every batch
+    """
+    lens = np.asarray(lens, dtype=np.int64)
+    # one prefix for every interaction
+    w_idx = np.repeat(np.arange(len(lens)), lens)
+    starts = np.cumsum(lens) - lens
+    t_idx = np.arange(len(w_idx)) - np.repeat(starts, lens)
+
+    # the longest prefixes first, then the rows of a batch are limited by its first prefix
+    order = np.argsort(-t_idx, kind="stable")
+    w_idx, t_idx = w_idx[order], t_idx[order]
+
+    batches = []
+    i = 0
+    while i < len(order):
+        width = t_idx[i] + 1 if row_len is None else row_len
+        rows = max(1, batch_tokens // width)
+        batches.append((w_idx[i:i + rows], t_idx[i:i + rows]))
+        i += rows
+
+    return batches
+
+def cat_windows(batches):
+    # batches of a field can be trimmed to different lengths (length_bucket), they are padded with 0 to the longest
+    n = max(batch.size(1) for batch in batches)
+    windows = batches[0].new_zeros((sum(len(batch) for batch in batches), n))
+
+    offset = 0
+    for batch in batches:
+        windows[offset:offset + len(batch), :batch.size(1)] = batch
+        offset += len(batch)
+
+    return windows
+
+def forward_prefixes(model, data, mlm_r_seqs, mask_seqs):
+    # the models take (q, masked r, the other fields of the collate, mask)
+    return model(data[0], mlm_r_seqs, *data[2:-1], mask_seqs)
+
+class AllPositionsEvaluator():
+    """
+    Predictions of every interaction of the windows of a loader, under the
+    "mask only this position, see only the past" protocol.
+
+        :param model: (nn.Module) trained model
+        :param device: (torch.device) device of the model
+        :param batch_tokens: (int) max number of positions of a fused batch
+        :param pool_size: (int) number of windows whose prefixes are fused together, bounds the memory for large test sets
+        :param trim: (bool) cut a batch to its longest prefix, False for the models that need max_seq_len windows
+        :param forward: (callable) forward(model, data, mlm_r_seqs, mask_seqs), for models with other inputs
+    """
+    def __init__(self, model, device, batch_tokens, pool_size=4096, trim=True, forward=forward_prefixes):
+        self.model = model
+        self.device = device
+        self.batch_tokens = batch_tokens
+        self.pool_size = pool_size
+        self.trim = trim
+        self.forward = forward
+
+    def iter_pools(self, loader):
+        # windows of the loader, concatenated into pools of about pool_size windows
+        pool, pool_len = [], 0
+        for data in loader:
+            pool.append(data)
+            pool_len += len(data[0])
+            if pool_len >= self.pool_size:
+                yield [cat_windows(fields) for fields in zip(*pool)]
+                pool, pool_len = [], 0
+        if pool:
+            yield [cat_windows(fields) for fields in zip(*pool)]
+
+    def predict_pool(self, data):
+        """
+        :param data: (list of torch.Tensor) fields of the windows of a pool, mask_seqs is the last one
+
+        :output w_idx, t_idx: (np.ndarray) window and position of every prediction
+        :output y_scores: (np.ndarray) predictions
+        """
+        mask_seqs = data[-1]
+        # windows are padded at the end
+        lens = mask_seqs.sum(dim=1).numpy()
+        n = mask_seqs.size(1)
+
+        w_list, t_list, y_list = [], [], []
+        # untrimmed rows are always n long, the budget has to count all of their positions
+        for w_idx, t_idx in get_prefix_batches(lens, self.batch_tokens, None if self.trim else n):
+            seq_len = int(t_idx[0]) + 1 if self.trim else n
+            w = torch.from_numpy(w_idx)
+            t = torch.from_numpy(t_idx).to(self.device)
+
+            # |prefix_mask| = (rows, seq_len), the positions 0..t of every prefix
+            prefix_mask = torch.arange(seq_len, device=self.device).unsqueeze(0) <= t.unsqueeze(1)
+            # the future of a prefix is <PAD>: zeroed like the pads of the windows, so it can't leak into the prediction
+            fields = [
+                field[w, :seq_len].to(self.device).masked_fill(~prefix_mask, 0) for field in data[:-1]
+            ]
+
+            r_seqs = fields[1]
+            mlm_r_seqs = torch.where(prefix_mask, r_seqs, torch.full_like(r_seqs, MLM_PAD_IDX))
+            mlm_r_seqs[torch.arange(len(t), device=self.device), t] = MLM_MASK_IDX
+
+            y_hat = self.forward(self.model, fields + [prefix_mask], mlm_r_seqs, prefix_mask)
+            # |y_hat| = (rows, seq_len, 1)
+            y_hat = y_hat.reshape(len(t), seq_len)
+            y_list.append(y_hat[torch.arange(len(t), device=self.device), t].cpu())
+            w_list.append(w_idx)
+            t_list.append(t_idx)
+
+        return np.concatenate(w_list), np.concatenate(t_list), torch.cat(y_list).numpy()
+
+    def evaluate(self, loader):
+        """
+        :param loader: (DataLoader) unshuffled loader of the windows, e.g. test_loader
+
+        :output predictions: (pd.DataFrame) one row per interaction: window (in the order of the loader),
+            position in the window, q, y_true and y_score, sorted by window and position
+        """
+        self.model.eval()
+
+        predictions = []
+        window_offset = 0
+        with torch.no_grad():
+            for data in self.iter_pools(loader):
+                w_idx, t_idx, y_scores = self.predict_pool(data)
+                predictions.append(pd.DataFrame({
+                    "window": w_idx + window_offset,
+                    "position": t_idx,
+                    "q": data[0][w_idx, t_idx].numpy(),
+                    "y_true": data[1][w_idx, t_idx].numpy(),
+                    "y_score": y_scores,
+                }))
+                window_offset += len(data[0])
+
+        return pd.concat(predictions).sort_values(["window", "position"], ignore_index=True)
+
+def evaluate_all_positions(model, test_loader, device, config, export_path=None):
+    """
+    Score every interaction of the test set with AllPositionsEvaluator, the trainers call it every epoch
+    with --eval_all_positions and train.py once more with the best model to export the predictions.
+
+    Only the models that can be packed are trimmed: their attention only sees the real keys,
+    so a prefix gives the same prediction however long its batch is padded.
+    The others (e.g. bidkt, the span convolutions, bigbird) are evaluated on max_seq_len windows,
+    where the last position of every window gets the same prediction as in _test.
+
+        :param export_path: (str) if given, the predictions are written to this csv
+
+        :output predictions: (pd.DataFrame) see AllPositionsEvaluator.evaluate
+    """
+    evaluator = AllPositionsEvaluator(
+        model,
+        device,
+        batch_tokens=config.eval_batch_tokens or config.batch_size * config.max_seq_len,
+        trim=MODELS.get_meta(config.model_name).get("packing", False)
+    )
+    predictions = evaluator.evaluate(test_loader)
+
+    if config.crit == "binary_cross_entropy":
+        # sklearn is only needed for this score
+        from sklearn import metrics
+
+        score = metrics.roc_auc_score(predictions["y_true"], predictions["y_score"])
+        print("All positions test score(AUC) is %.4f" % score)
+    elif config.crit == "rmse":
+        score = np.sqrt(np.mean((predictions["y_true"] - predictions["y_score"]) ** 2))
+        print("All positions test score(RMSE) is %.4f" % score)
+
+    if export_path is not None:
+        predictions.to_csv(export_path, index=False)
+
+    return predictions
@@ -0,0 +1,252 @@
+from collections import namedtuple
+
+import numpy as np
+import torch
+from torch.utils.data import get_worker_info
+
+# <MASK> and <PAD> of the mlm r_seqs, the embedding of r has 4 entries: 0, 1, <MASK>, <PAD>
+MLM_MASK_IDX = 2
+MLM_PAD_IDX = 3
+
+def get_mlm_generator(device, seed=None):
+    """
+    torch.Generator on the device of the batches, so the masking draws never leave the device.
+
+        :param device: (torch.device) device of the trainer
+        :param seed: (int) seed of the masking, if None it is drawn from the global torch RNG (torch.manual_seed still fixes it)
+
+        :output generator: (torch.Generator)
+    """
+    if seed is None:
+        seed = int(torch.randint(2 ** 62, (1,)).item())
+
+    return torch.Generator(device=device).manual_seed(seed)
+
+# 15% <MASK>
+def Mlm4BertTrain(r_seqs, mask_seqs, generator=None, mlm_ratio=0.15):
+    """
+    Batched masked language model masking, on the device of r_seqs and without host round-trips.
+
+    Like the former per-sequence loop, int(real_len * 0.15) positions are drawn without replacement
+    from the real (not <PAD>) positions of every sequence: 80% of them are <MASK>, 10% a random 0 or 1,
+    10% keep the original response. The <PAD> positions are 3.
+    The windows are padded at the end (mask_seqs is a prefix), so the positions are the same as the loop's.
+
+        :param r_seqs: (torch.Tensor) |r_seqs| = (bs, n), responses, -1 at <PAD>
+        :param mask_seqs: (torch.Tensor) |mask_seqs| = (bs, n), torch.bool
+        :param generator: (torch.Generator) on the device of r_seqs, see get_mlm_generator
+        :param mlm_ratio: (float) ratio of the masked positions
+
+        :output mlm_r_seqs: (torch.Tensor) |mlm_r_seqs| = (bs, n), masked r_seqs
+        :output mlm_idxs: (torch.Tensor) |mlm_idxs| = (bs, n), torch.bool, the masked positions
+    """
+    device = r_seqs.device
+
+    # random rank of every real position in its sequence, <PAD> gets the last ranks
+    scores = torch.rand(r_seqs.size(), generator=generator, device=device)
+    scores = scores.masked_fill(~mask_seqs, 2.)
+    ranks = torch.empty_like(r_seqs, dtype=torch.long)
+    ranks.scatter_(1, scores.argsort(dim=1), torch.arange(r_seqs.size(1), device=device).expand_as(ranks))
+
+    # |n_mlm| = (bs, 1), the first int(real_len * 0.15) ranks are masked
+    n_mlm = (mask_seqs.sum(dim=1, keepdim=True) * mlm_ratio).long()
+    mlm_idxs = ranks < n_mlm
+    # |mlm_idxs| = (bs, n)
+
+    # 80% <MASK>, 10% random 0 or 1, 10% original
+    action = torch.rand(r_seqs.size(), generator=generator, device=device)
+    random_r = torch.randint(0, 2, r_seqs.size(), generator=generator, device=device, dtype=r_seqs.dtype)
+
+    mlm_r_seqs = torch.where(mask_seqs, r_seqs, torch.full_like(r_seqs, MLM_PAD_IDX))
+    mlm_r_seqs = torch.where(mlm_idxs & (action < 0.8), torch.full_like(r_seqs, MLM_MASK_IDX), mlm_r_seqs)
+    mlm_r_seqs = torch.where(mlm_idxs & (action >= 0.8) & (action < 0.9), random_r, mlm_r_seqs)
+
+    return mlm_r_seqs, mlm_idxs
+    # |mlm_r_seqs| = (bs, n)
+    # |mlm_idxs| = (bs, n)
+
+# seq의 가장 마지막에 <MASK>
+def Mlm4BertTest(r_seqs, mask_seqs):
+    """
+    Evaluation masking: the last real position of every sequence is <MASK> and the only predicted one.
+    The last index of every window is mask_seqs.sum(1) - 1 (the windows are padded at the end),
+    so the whole batch is masked with one scatter on its device.
+
+        :param r_seqs: (torch.Tensor) |r_seqs| = (bs, n), responses, -1 at <PAD>
+        :param mask_seqs: (torch.Tensor) |mask_seqs| = (bs, n), torch.bool
+
+        :output mlm_r_seqs: (torch.Tensor) |mlm_r_seqs| = (bs, n), r_seqs with <MASK> at the last position, <PAD> is 3
+        :output mlm_idxs: (torch.Tensor) |mlm_idxs| = (bs, n), torch.bool, True only at the last position
+    """
+    # |last_idxs| = (bs, 1)
+    last_idxs = (mask_seqs.sum(dim=1, keepdim=True) - 1).long()
+
+    mlm_idxs = torch.zeros_like(mask_seqs, dtype=torch.bool).scatter_(1, last_idxs, True)
+    mlm_r_seqs = torch.where(mask_seqs, r_seqs, torch.full_like(r_seqs, MLM_PAD_IDX))
+    mlm_r_seqs = mlm_r_seqs.masked_fill(mlm_idxs, MLM_MASK_IDX)
+
+    return mlm_r_seqs, mlm_idxs
+    # |mlm_r_seqs| = (bs, n)
+    # |mlm_idxs| = (bs, n)
+
+# a batch whose training masks were already drawn by MlmCollate
+MlmBatch = namedtuple("MlmBatch", ["data", "mlm_r_seqs", "mlm_idxs"])
+
+class MlmCollate():
+    """
+    Collate stage masking: the training masks are drawn in the DataLoader workers,
+    so the masking overlaps the forward and backward of the previous batches.
+
+    Every worker has its own generator. With a seed, it is seeded by (seed, worker id, epoch),
+    so the masks only depend on the seed and the number of workers. The epoch is given by set_epoch,
+    which EpochDataLoader calls every time it is iterated. Without a seed, the worker seed of the DataLoader is used.
+    Without workers, one generator of the main process is used, like in the trainers.
+
+        :param collate: (callable) collate of the samples, None if the dataset gives whole batches (window collate)
+        :param seed: (int) seed of the masking, see get_mlm_generator
+    """
+    def __init__(self, collate=None, seed=None):
+        self.collate = collate
+        self.seed = seed
+        self.epoch = 0
+        self.generator = None
+        self.generator_key = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def get_generator(self):
+        worker_info = get_worker_info()
+
+        if worker_info is None:
+            if self.generator is None:
+                self.generator = get_mlm_generator(torch.device("cpu"), self.seed)
+            return self.generator
+
+        # a new generator every time the workers (and their seeds) or the epoch change
+        generator_key = (worker_info.seed, worker_info.id, self.epoch)
+        if self.generator_key != generator_key:
+            self.generator_key = generator_key
+            entropy = [worker_info.seed] if self.seed is None else [self.seed, worker_info.id, self.epoch]
+            seed = int(np.random.SeedSequence(entropy).generate_state(1, np.uint64)[0] >> 1)
+            self.generator = torch.Generator().manual_seed(seed)
+
+        return self.generator
+
+    def __call__(self, batch):
+        data = self.collate(batch) if self.collate is not None else batch
+
+        # r_seqs is the second and mask_seqs the last field of every collate
+        r_seqs, mask_seqs = data[1], data[-1]
+        # packed windows give the segment ids as mask_seqs, 0 is <PAD>
+        mlm_r_seqs, mlm_idxs = Mlm4BertTrain(r_seqs, mask_seqs != 0, self.get_generator())
+
+        return MlmBatch(tuple(data), mlm_r_seqs, mlm_idxs)
+
+def unpack_mlm_batch(data):
+    """
+    Split a batch of the train_loader into its fields and the masks drawn by MlmCollate.
+
+        :output data: (tuple) fields of the collate
+        :output mlm_batch: (tuple) (mlm_r_seqs, mlm_idxs), None if the trainer has to draw them
+    """
+    if isinstance(data, MlmBatch):
+        return data.data, (data.mlm_r_seqs, data.mlm_idxs)
+
+    return data, None
+
+class MetricsAccumulator():
+    """
+    Running metrics of an epoch, without keeping the scores in the autograd graph.
+
+    Every batch is detached once and accumulated on its device: the scores and labels into preallocated
+    buffers (exact AUC, like roc_auc_score over the whole epoch), or into a histogram of num_bins bins
+    (the AUC is exact up to the bins, and the memory doesn't grow with the epoch).
+    The loss, squared error and accuracy are running sums, so nothing is copied to the host before the end.
+
+        :param num_bins: (int) 0: exact AUC from the buffers, k: streaming AUC from a histogram of k bins
+        :param capacity: (int) initial size of the buffers, doubled when they are full
+    """
+    def __init__(self, num_bins=0, capacity=1 << 16):
+        self.num_bins = num_bins
+        self.capacity = capacity
+        self.device = None
+
+    def init_buffers(self, device):
+        self.device = device
+        self.count = 0
+        self.num_batches = 0
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+        self.se_sum = torch.zeros((), dtype=torch.float64, device=device)
+        self.correct_sum = torch.zeros((), dtype=torch.long, device=device)
+
+        if self.num_bins > 0:
+            self.pos_hist = torch.zeros(self.num_bins, dtype=torch.float64, device=device)
+            self.neg_hist = torch.zeros(self.num_bins, dtype=torch.float64, device=device)
+        else:
+            self.y_trues = torch.empty(self.capacity, dtype=torch.float32, device=device)
+            self.y_scores = torch.empty(self.capacity, dtype=torch.float32, device=device)
+
+    def update(self, y_true, y_score, loss):
+        """
+            :param y_true: (torch.Tensor) labels of the predicted positions
+            :param y_score: (torch.Tensor) scores of the predicted positions, 0 ~ 1
+            :param loss: (torch.Tensor) loss of the batch
+        """
+        y_true = y_true.detach().reshape(-1).float()
+        y_score = y_score.detach().reshape(-1).float()
+        n = y_true.numel()
+
+        if self.device is None:
+            self.init_buffers(y_score.device)
+
+        self.num_batches += 1
+        self.loss_sum += loss.detach()
+        self.se_sum += ((y_score - y_true) ** 2).sum()
+        self.correct_sum += ((y_score >= .5).float() == y_true).sum()
+
+        if self.num_bins > 0:
+            bin_idx = (y_score * self.num_bins).long().clamp_(0, self.num_bins - 1)
+            self.pos_hist.index_add_(0, bin_idx, y_true.double())
+            self.neg_hist.index_add_(0, bin_idx, 1 - y_true.double())
+        else:
+            if self.count + n > len(self.y_scores):
+                new_capacity = max(2 * len(self.y_scores), self.count + n)
+                self.y_trues = torch.cat([self.y_trues[:self.count], self.y_trues.new_empty(new_capacity - self.count)])
+                self.y_scores = torch.cat([self.y_scores[:self.count], self.y_scores.new_empty(new_capacity - self.count)])
+            self.y_trues[self.count:self.count + n] = y_true
+            self.y_scores[self.count:self.count + n] = y_score
+
+        self.count += n
+
+    def get_auc(self):
+        if self.num_bins > 0:
+            pos_hist, neg_hist = self.pos_hist.cpu().numpy(), self.neg_hist.cpu().numpy()
+            # a positive beats the negatives of the lower bins, and ties with the negatives of its own bin
+            neg_below = np.cumsum(neg_hist) - neg_hist
+            return float((pos_hist * (neg_below + .5 * neg_hist)).sum() / (pos_hist.sum() * neg_hist.sum()))
+
+        # the exact AUC is the only user of sklearn, the histogram AUC and the MLM workers don't need it
+        from sklearn import metrics
+
+        return metrics.roc_auc_score(
+            self.y_trues[:self.count].cpu().numpy(), self.y_scores[:self.count].cpu().numpy()
+        )
+
+    def get_loss(self):
+        # mean of the batch losses
+        return (self.loss_sum / self.num_batches).item()
+
+    def get_rmse(self):
+        return (self.se_sum / self.count).sqrt().item()
+
+    def get_accuracy(self):
+        return self.correct_sum.item() / self.count
+
+    def get_results(self):
+        return {
+            "AUC": self.get_auc(),
+            "RMSE": self.get_rmse(),
+            "ACC": self.get_accuracy(),
+            "loss": self.get_loss(),
+        }
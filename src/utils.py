@@ -1,16 +1,20 @@
-import pandas as pd
 import numpy as np
 import csv
 
 import torch
 import torch.nn as nn
 from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Dataset, Sampler, Subset, ConcatDataset, DataLoader
+
+from dataloaders.loader_utils import get_pack_offsets
 
 from torch.optim import SGD, Adam
 
 from torch.nn.functional import binary_cross_entropy
 
-import matplotlib.pyplot as plt
+# the collate functions give every index field as int32, which nn.Embedding takes as it is,
+# so the trainers don't cast them every batch
+INDEX_DTYPE = torch.int32
 
 def collate_fn(batch, pad_val=-1):
 
@@ -19,8 +23,8 @@ def collate_fn(batch, pad_val=-1):
 
     for q_seq, r_seq in batch:
 
-        q_seqs.append(torch.Tensor(q_seq)) 
-        r_seqs.append(torch.Tensor(r_seq))
+        q_seqs.append(torch.as_tensor(q_seq, dtype=INDEX_DTYPE)) 
+        r_seqs.append(torch.as_tensor(r_seq, dtype=INDEX_DTYPE))
 
     q_seqs = pad_sequence(
         q_seqs, batch_first=True, padding_value=pad_val
@@ -46,9 +50,9 @@ def pid_collate_fn(batch, pad_val=-1):
 
     for q_seq, r_seq, pid_seq in batch:
 
-        q_seqs.append(torch.Tensor(q_seq)) 
-        r_seqs.append(torch.Tensor(r_seq)) 
-        pid_seqs.append(torch.Tensor(pid_seq)) 
+        q_seqs.append(torch.as_tensor(q_seq, dtype=INDEX_DTYPE)) 
+        r_seqs.append(torch.as_tensor(r_seq, dtype=INDEX_DTYPE)) 
+        pid_seqs.append(torch.as_tensor(pid_seq, dtype=INDEX_DTYPE)) 
 
     q_seqs = pad_sequence(
         q_seqs, batch_first=True, padding_value=pad_val
@@ -79,9 +83,9 @@ def pid_time_collate_fn(batch, pad_val=-1):
 
     for q_seq, r_seq, pid_seq, time_seq in batch:
 
-        q_seqs.append(torch.Tensor(q_seq))
-        r_seqs.append(torch.Tensor(r_seq))
-        pid_seqs.append(torch.Tensor(pid_seq))
+        q_seqs.append(torch.as_tensor(q_seq, dtype=INDEX_DTYPE))
+        r_seqs.append(torch.as_tensor(r_seq, dtype=INDEX_DTYPE))
+        pid_seqs.append(torch.as_tensor(pid_seq, dtype=INDEX_DTYPE))
         time_seqs.append(torch.Tensor(time_seq))
 
     q_seqs = pad_sequence(
@@ -115,10 +119,10 @@ def pid_diff_collate_fn(batch, pad_val=-1):
 
     for q_seq, r_seq, pid_seq, diff_seq in batch:
 
-        q_seqs.append(torch.Tensor(q_seq))
-        r_seqs.append(torch.Tensor(r_seq))
-        pid_seqs.append(torch.Tensor(pid_seq))
-        diff_seqs.append(torch.Tensor(diff_seq))
+        q_seqs.append(torch.as_tensor(q_seq, dtype=INDEX_DTYPE))
+        r_seqs.append(torch.as_tensor(r_seq, dtype=INDEX_DTYPE))
+        pid_seqs.append(torch.as_tensor(pid_seq, dtype=INDEX_DTYPE))
+        diff_seqs.append(torch.as_tensor(diff_seq, dtype=INDEX_DTYPE))
 
     q_seqs = pad_sequence(
         q_seqs, batch_first=True, padding_value=pad_val
@@ -152,11 +156,11 @@ def pid_diff_pt_collate_fn(batch, pad_val=-1):
 
     for q_seq, r_seq, pid_seq, diff_seq, pt_seq in batch:
 
-        q_seqs.append(torch.Tensor(q_seq))
-        r_seqs.append(torch.Tensor(r_seq))
-        pid_seqs.append(torch.Tensor(pid_seq))
-        diff_seqs.append(torch.Tensor(diff_seq))
-        pt_seqs.append(torch.Tensor(pt_seq))
+        q_seqs.append(torch.as_tensor(q_seq, dtype=INDEX_DTYPE))
+        r_seqs.append(torch.as_tensor(r_seq, dtype=INDEX_DTYPE))
+        pid_seqs.append(torch.as_tensor(pid_seq, dtype=INDEX_DTYPE))
+        diff_seqs.append(torch.as_tensor(diff_seq, dtype=INDEX_DTYPE))
+        pt_seqs.append(torch.as_tensor(pt_seq, dtype=INDEX_DTYPE))
 
     q_seqs = pad_sequence(
         q_seqs, batch_first=True, padding_value=pad_val
@@ -183,6 +187,236 @@ def pid_diff_pt_collate_fn(batch, pad_val=-1):
     #|r_seqs| = (batch_size, maximum_sequence_length_in_the_batch)
     #|mask_seqs| = (batch_size, maximum_sequence_length_in_the_batch)
 
+# collate fast path
+# match_seq_len already pads every window to max_seq_len,
+# so a batch is gathered with one call to the dataset and masked and zero-padded at once
+class PaddedWindows(Dataset):
+    """
+    The windows of a dataset gathered a whole batch at a time, masked like the collate functions do.
+
+    dataset[batch_idxs] gathers a whole batch at once and gives the same fields as the collate function of the dataset.
+    Use it with WindowBatchSampler and batch_size=None.
+    The windows are only cut from the sequences of the dataset when their batch is gathered (see RaggedWindows),
+    so the memory-mapped sequences are never copied as a whole, only the length of every window is kept.
+
+        :param dataset: (Dataset) dataset whose fields are (num_windows, max_seq_len) arrays padded with pad_val,
+            dataset[idxs] gives the rows idxs of every field
+        :param float_fields: (tuple of int) fields given as float32 instead of INDEX_DTYPE, e.g. time_seqs
+        :param pad_val: (int) value of the padded positions
+        :param trim: (bool) if True, a batch is padded only to the longest window in it instead of max_seq_len
+        :param chunk_size: (int) number of windows read at a time to get the lengths of the windows
+    """
+    def __init__(self, dataset, float_fields=(), pad_val=-1, trim=False, chunk_size=65536):
+        super().__init__()
+
+        self.dataset = dataset
+        self.pad_val = pad_val
+        self.trim = trim
+
+        # true length of every window, the padding is always at the end
+        lens = []
+        for start in range(0, len(dataset), chunk_size):
+            fields = dataset[np.arange(start, min(start + chunk_size, len(dataset)))]
+            lens.append((np.asarray(fields[0]) != pad_val).sum(1))
+        self.lens = torch.from_numpy(np.concatenate(lens))
+        self.max_seq_len = fields[0].shape[1]
+
+        self.num_fields = len(fields)
+        self.float_fields = [i for i in range(self.num_fields) if i in float_fields]
+        self.index_fields = [i for i in range(self.num_fields) if i not in float_fields]
+
+    def gather(self, idxs, seq_len=None):
+        """
+        Gather the windows idxs, every field masked like the collate functions do.
+
+            :param idxs: (torch.Tensor) indices of the windows
+            :param seq_len: (int) only the first seq_len positions are gathered, max_seq_len if None
+
+            :output fields: (list of torch.Tensor) |fields[i]| = (len(idxs), seq_len), INDEX_DTYPE or float32
+            :output mask_seqs: (torch.Tensor) |mask_seqs| = (len(idxs), seq_len), torch.bool
+        """
+        seq_len = seq_len or self.max_seq_len
+        fields = [np.asarray(field)[:, :seq_len] for field in self.dataset[np.asarray(idxs)]]
+        mask_seqs = fields[0] != self.pad_val
+
+        for i in self.index_fields:
+            # the padding becomes 0, the index fields are cast from their compact dtype only here
+            fields[i] = torch.from_numpy(np.where(mask_seqs, fields[i], 0)).to(INDEX_DTYPE)
+        for i in self.float_fields:
+            fields[i] = torch.from_numpy(fields[i].astype(np.float32) * mask_seqs)
+
+        return fields, torch.from_numpy(mask_seqs)
+
+    def __getitem__(self, batch_idxs):
+        # only the first seq_len positions are gathered, the rest of the batch is padding
+        seq_len = int(self.lens[batch_idxs].max()) if self.trim else self.max_seq_len
+        fields, mask_seqs = self.gather(batch_idxs, seq_len)
+
+        return (*fields, mask_seqs)
+        #|fields[i]| = (batch_size, seq_len)
+        #|mask_seqs| = (batch_size, seq_len)
+
+    def __len__(self):
+        return len(self.lens)
+
+class PackedWindows(Dataset):
+    """
+    Windows of a PaddedWindows packed into shared windows of max_seq_len, so short learners don't need a window each.
+
+    The windows are placed by get_pack_offsets and every learner keeps its own interactions in order.
+    mask_seqs of a batch is not a bool tensor but the segment id of every position (0 is <PAD>, 1, 2, ... the learners),
+    the models use it for the positions and the block-diagonal attention mask, see models/mask_utils.py.
+    Unlike PaddedWindows, the shared windows are built once and kept in memory, about the size of the packed windows.
+
+        :param windows: (PaddedWindows) windows to pack
+        :param indices: (torch.Tensor) indices of the windows to pack, e.g. those of the train split
+    """
+    def __init__(self, windows, indices, chunk_size=65536):
+        super().__init__()
+
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        max_seq_len = windows.max_seq_len
+
+        pack_idx, pack_offsets, num_packs = get_pack_offsets(windows.lens[indices].numpy(), max_seq_len)
+
+        # segment id is the order of the window in its shared window, from 1
+        order = np.lexsort((pack_offsets, pack_idx))
+        sorted_pack_idx = pack_idx[order]
+        seg_ids = np.empty(len(order), dtype=np.int64)
+        seg_ids[order] = np.arange(len(order)) - np.searchsorted(sorted_pack_idx, sorted_pack_idx) + 1
+
+        self.num_fields = windows.num_fields
+        self.float_fields = windows.float_fields
+        self.trim = windows.trim
+
+        # |fields[i]| = (num_packs, max_seq_len)
+        self.fields = [
+            torch.zeros(num_packs, max_seq_len, dtype=torch.float32 if i in self.float_fields else INDEX_DTYPE)
+            for i in range(self.num_fields)
+        ]
+        # |mask_seqs| = (num_packs, max_seq_len), segment ids
+        self.mask_seqs = torch.zeros(num_packs, max_seq_len, dtype=INDEX_DTYPE)
+
+        pack_idx, pack_offsets = torch.from_numpy(pack_idx), torch.from_numpy(pack_offsets)
+        seg_ids = torch.from_numpy(seg_ids).to(INDEX_DTYPE)
+        # the windows are read in chunks, so only the shared windows are in memory as a whole
+        for start in range(0, len(indices), chunk_size):
+            chunk = torch.arange(start, min(start + chunk_size, len(indices)))
+            fields, mask_seqs = windows.gather(indices[chunk])
+
+            # move every real position of the windows to its place in the shared windows
+            # |w_idx| = |src_cols| = (num_real_positions,), w_idx is the position of the window in the chunk
+            w_idx, src_cols = mask_seqs.nonzero(as_tuple=True)
+            dst_rows = pack_idx[chunk][w_idx]
+            dst_cols = pack_offsets[chunk][w_idx] + src_cols
+
+            for field, packed_field in zip(fields, self.fields):
+                packed_field[dst_rows, dst_cols] = field[w_idx, src_cols]
+            self.mask_seqs[dst_rows, dst_cols] = seg_ids[chunk][w_idx]
+
+        self.lens = (self.mask_seqs != 0).sum(1)
+
+    def __getitem__(self, batch_idxs):
+        # only the first seq_len positions are gathered, the rest of the batch is padding
+        seq_len = int(self.lens[batch_idxs].max()) if self.trim else self.mask_seqs.size(1)
+
+        return (*[field[batch_idxs, :seq_len] for field in self.fields], self.mask_seqs[batch_idxs, :seq_len])
+
+    def __len__(self):
+        return len(self.mask_seqs)
+
+class WindowBatchSampler(Sampler):
+    """
+    Yield the indices of a whole batch at once, so the DataLoader calls the dataset once per batch.
+
+        :param indices: (torch.Tensor) indices of the windows to sample from, see get_window_indices
+        :param batch_size: (int) number of windows in a batch, the last batch can be smaller
+        :param shuffle: (bool) shuffle the windows every epoch
+        :param generator: (torch.Generator) random generator of the shuffle, the default one if None
+    """
+    def __init__(self, indices, batch_size, shuffle=False, generator=None):
+        self.indices = torch.as_tensor(indices, dtype=torch.long)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = generator
+
+    def __iter__(self):
+        indices = self.indices
+        if self.shuffle:
+            indices = indices[torch.randperm(len(indices), generator=self.generator)]
+
+        yield from indices.split(self.batch_size)
+
+    def __len__(self):
+        return (len(self.indices) + self.batch_size - 1) // self.batch_size
+
+class LengthBucketBatchSampler(WindowBatchSampler):
+    """
+    Yield whole batches of windows of similar length, to be used with PaddedWindows(trim=True).
+
+    The windows are shuffled and cut into pools of bucket_size batches.
+    Every pool is sorted by window length and cut into batches, and the order of the batches is shuffled again,
+    so a batch is padded only to its longest window and every window is still seen once per epoch.
+    Without shuffle, all windows are sorted by length at once.
+
+        :param indices: (torch.Tensor) indices of the windows to sample from, see get_window_indices
+        :param lens: (torch.Tensor) true length of every window of the dataset, e.g. PaddedWindows.lens
+        :param batch_size: (int) number of windows in a batch
+        :param bucket_size: (int) number of batches in a pool
+        :param shuffle: (bool) shuffle the windows and the batches every epoch
+        :param generator: (torch.Generator) random generator of the shuffle, the default one if None
+    """
+    def __init__(self, indices, lens, batch_size, bucket_size=50, shuffle=False, generator=None):
+        super().__init__(indices, batch_size, shuffle, generator)
+        self.lens = torch.as_tensor(lens)[self.indices]
+        self.bucket_size = bucket_size
+
+    def __iter__(self):
+        if not self.shuffle:
+            order = torch.argsort(self.lens, stable=True)
+            yield from self.indices[order].split(self.batch_size)
+            return
+
+        order = torch.randperm(len(self.indices), generator=self.generator)
+        # sort by (pool, length) at once, the pool is the primary key
+        pool_ids = torch.arange(len(order)) // (self.batch_size * self.bucket_size)
+        lens = self.lens[order]
+        order = order[torch.argsort(pool_ids * (int(lens.max()) + 1) + lens, stable=True)] if len(order) > 0 else order
+
+        batches = self.indices[order].split(self.batch_size)
+        for batch_idx in torch.randperm(len(batches), generator=self.generator).tolist():
+            yield batches[batch_idx]
+
+def get_window_indices(dataset):
+    """
+    Indices of the windows of dataset in the dataset it was split from,
+    e.g. for the outputs of random_split or a ConcatDataset of Subsets.
+    """
+    if isinstance(dataset, Subset):
+        return get_window_indices(dataset.dataset)[torch.as_tensor(dataset.indices, dtype=torch.long)]
+    if isinstance(dataset, ConcatDataset):
+        return torch.cat([get_window_indices(sub_dataset) for sub_dataset in dataset.datasets])
+
+    return torch.arange(len(dataset))
+
+class EpochDataLoader(DataLoader):
+    """
+    DataLoader that moves its dataset and its collate_fn to the next epoch every time it is iterated,
+    so the trainers get a new epoch without calling set_epoch,
+    e.g. the shuffle of a StreamingWindows and the masks of a MlmCollate.
+    """
+    def __init__(self, dataset, *args, **kwargs):
+        super().__init__(dataset, *args, **kwargs)
+        self.epoch = 0
+
+    def __iter__(self):
+        for stage in (self.dataset, self.collate_fn):
+            if hasattr(stage, "set_epoch"):
+                stage.set_epoch(self.epoch)
+        self.epoch += 1
+
+        return super().__iter__()
+
 # get_optimizer
 def get_optimizers(model, config):
     if config.optimizer == "adam":
@@ -302,6 +536,9 @@ def recorder(test_auc_score, record_time, config):
 
 # visualizer
 def visualizer(train_auc_scores, valid_auc_scores, record_time):
+    # matplotlib is slow to import, so it is imported only when a plot is drawn
+    import matplotlib.pyplot as plt
+
     plt.plot(train_auc_scores)
     plt.plot(valid_auc_scores)
     plt.legend(['train_auc_scores', 'valid_auc_scores'])